@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse, stats
+
+
+def _edge_keys(matrix):
+    """
+    Returns the key (row*N + column) of every edge of a sparse matrix, in the order of its data.
+    """
+    matrix = sparse.csr_matrix(matrix)
+    N = matrix.shape[1]
+    rows = np.repeat(np.arange(matrix.shape[0], dtype=np.int64), np.diff(matrix.indptr))
+    return rows*N + matrix.indices.astype(np.int64), matrix.data
+
+
+class ResultsTensor:
+
+    def __init__(self, simulations):
+        """
+        The results of many simulations of one network stacked into arrays over one canonical order of the edges
+        (by row, then column) and the nodes, thus comparisons between strategies are vectorised:
+        payments (K, nnz), obligations (nnz,), reserves (K, N) and default_stage (K, N), the stage in which a node
+        defaulted (0 is never). Edges that are not in the L of a simulation (e.g. another day of a SnapshotSeries)
+        have no payments.
+        Inputs:
+        simulations: dict, label: Simulation (ran or loaded), all of the same network
+        """
+        self.labels = list(simulations)
+        simulations = list(simulations.values())
+        self.K = len(simulations)
+        self.N = N = simulations[0].N
+        assert all(simulation.N == N for simulation in simulations), 'All simulations need the same number of nodes.'
+
+        # Step 1
+        # The canonical order: all edges of the L's of the simulations, sorted
+        edge_keys = [_edge_keys(simulation.L)[0] for simulation in simulations]
+        self.keys = np.unique(np.concatenate(edge_keys)) if len(edge_keys) > 1 else np.sort(edge_keys[0])
+        self.rows = self.keys // N
+        self.columns = self.keys % N
+        self.nnz = len(self.keys)
+        del edge_keys
+
+        # Step 2
+        # Place the obligations and payments of every simulation
+        self.obligations = np.zeros(self.nnz)
+        self.payments = np.zeros((self.K, self.nnz))
+        self.reserves = np.zeros((self.K, N))
+        self.default_stage = np.zeros((self.K, N), dtype=np.int32)
+        # Which edges are in the L of a simulation, only when not all L's have the same edges
+        self.in_L = None if all(simulation.L.nnz == self.nnz for simulation in simulations) else \
+            np.zeros((self.K, self.nnz), dtype=bool)
+        for k, simulation in enumerate(simulations):
+            keys, data = _edge_keys(simulation.L)
+            positions = np.searchsorted(self.keys, keys)
+            self.obligations[positions] = data
+            if self.in_L is not None:
+                self.in_L[k, positions] = True
+            keys, data = _edge_keys(simulation.p)
+            self.payments[k, np.searchsorted(self.keys, keys)] = data
+            self.reserves[k] = simulation.reserves
+            for stage, nodes in simulation.all_defaults.items():
+                self.default_stage[k, np.asarray(nodes, dtype=np.int64)] = stage
+
+        self.size_p = self.payments.sum(axis=1)
+        self.total_flow = np.array([simulation.total_flow for simulation in simulations])
+
+        # The edges by row and by column, for the strengths
+        self.row_counts = np.bincount(self.rows, minlength=N)
+        self.column_order = np.argsort(self.columns, kind='stable')
+        self.column_counts = np.bincount(self.columns, minlength=N)
+
+    def _sums(self, values, counts, order=None):
+        # Sums of the edges per node, for every simulation at once
+        values = values if order is None else values[..., order]
+        sums = np.zeros(values.shape[:-1] + (self.N,))
+        nonempty = np.flatnonzero(counts)
+        if len(nonempty):
+            starts = (np.cumsum(counts) - counts)[nonempty]
+            sums[..., nonempty] = np.add.reduceat(values, starts, axis=-1)
+        return sums
+
+    def out_strengths(self, values=None):
+        """
+        Returns the total payments of every node, (K, N), or the row sums of values (..., nnz).
+        """
+        return self._sums(self.payments if values is None else values, self.row_counts)
+
+    def in_strengths(self, values=None):
+        """
+        Returns the total receiving of every node, (K, N), or the column sums of values (..., nnz).
+        """
+        return self._sums(self.payments if values is None else values, self.column_counts, self.column_order)
+
+    def ratios(self):
+        """
+        Returns the payments relative to the obligations of every edge, (K, nnz).
+        """
+        return np.divide(self.payments, self.obligations, out=np.zeros_like(self.payments),
+                         where=self.obligations != 0)
+
+    def strength_ratios(self, direction='out'):
+        """
+        Returns the out (or in) strength of every node relative to the one in L, (K, N), nan for nodes without
+        obligations.
+        """
+        if direction == 'out':
+            strengths, strengths_L = self.out_strengths(), self.out_strengths(self.obligations)
+        else:
+            strengths, strengths_L = self.in_strengths(), self.in_strengths(self.obligations)
+        return np.divide(strengths, strengths_L, out=np.full_like(strengths, np.nan), where=strengths_L != 0)
+
+    def difference(self, a, b):
+        """
+        Returns the payments of simulation a minus those of simulation b per edge, (nnz,).
+        """
+        return self.payments[self.labels.index(a)] - self.payments[self.labels.index(b)]
+
+    def rank_correlation(self, quantity='payments'):
+        """
+        Returns the Spearman rank correlations (pd.DataFrame, K x K) between the simulations of quantity:
+        'payments', 'ratios', 'reserves' or 'default_stage'.
+        """
+        values = self.ratios() if quantity == 'ratios' else getattr(self, quantity)
+        ranks = stats.rankdata(values, axis=1)
+        return pd.DataFrame(np.corrcoef(ranks), index=self.labels, columns=self.labels)
+
+    def summary(self):
+        """
+        Returns the headline results per simulation (pd.DataFrame).
+        """
+        defaulted = self.default_stage > 0
+        paid_in_full = self.payments == self.obligations
+        if self.in_L is None:
+            paid_in_full = paid_in_full.sum(axis=1)/self.nnz
+        else:
+            paid_in_full = (paid_in_full & self.in_L).sum(axis=1)/self.in_L.sum(axis=1)
+        return pd.DataFrame({
+            'size_p': self.size_p,
+            'size_p_relative': self.size_p/self.total_flow,
+            'defaults': defaulted.sum(axis=1),
+            'paid_in_full': paid_in_full,
+        }, index=self.labels)
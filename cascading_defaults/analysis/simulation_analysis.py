@@ -299,10 +299,6 @@ def show_ratios_payments(simulations, density=True):
         nonzeros_in = np.array(L.sum(axis=0)).flatten().nonzero()[0]
         nonzeros_out = np.array(L.sum(axis=1)).flatten().nonzero()[0]
 
-        # Correct for the sinknode
-        nonzeros_in = nonzeros_in[np.argwhere(nonzeros_in!=0)]
-        nonzeros_out = nonzeros_out[np.argwhere(nonzeros_out!=0)]
-
         # Strengths
         in_strengths_L = np.array(L.sum(axis=0)).flatten()[nonzeros_in]
         out_strengths_L = np.array(L.sum(axis=1)).flatten()[nonzeros_out]
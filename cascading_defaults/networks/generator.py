@@ -0,0 +1,256 @@
+import os
+import shutil
+
+import numpy as np
+from scipy import sparse
+
+from .. import current_dir
+from ..simulation.monte_carlo import draw
+from ..utils import row_blocks
+
+
+def _rng(seed, *key):
+    """
+    The random number generator of one part (key) of the network, independent of the other parts.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=key))
+
+
+def _propensities(rng, N, exponent):
+    """
+    Returns heavy-tailed (Pareto with minimum 1 and tail exponent exponent) weights of the nodes, or ones without
+    exponent.
+    """
+    if exponent is None:
+        return np.ones(N)
+    return (1. - rng.random(N)) ** (-1. / (exponent - 1.))
+
+
+class SyntheticNetwork:
+
+    def __init__(self, N, mean_degree=10, out_degree_exponent=2.5, in_degree_exponent=2.5,
+                 weights=('lognormal', {'mean': 8., 'sigma': 2.}), reciprocity=0., communities=1, mixing=0.1,
+                 sink_probability=0., seed=0, rows_per_seed=1024):
+        """
+        Random obligations networks (CSR-matrices) with heavy-tailed degrees, built directly in CSR a block of rows at
+        a time, for 10^3 to 10^8 edges. The edges of a node are drawn like Chung-Lu: node i has about mean_degree *
+        (out propensity of i) creditors, each creditor j is drawn with probability proportional to the in propensity
+        of j. Parallel edges are merged (their obligations summed), self-loops are dropped.
+        Inputs:
+        N: int, number of nodes
+        mean_degree: float, expected number of creditors per node (before merging parallel edges)
+        out_degree_exponent, in_degree_exponent: float (> 2), tail exponent of the out and in degrees, None is the
+                                                 same propensity for all nodes (Erdos-Renyi)
+        weights: distribution of the obligations (see monte_carlo.draw), e.g. ('lognormal', {'mean': 8, 'sigma': 2})
+                 or for Pareto lambda rng, n: 1e3*(1 + rng.pareto(1.5, n))
+        reciprocity: float, probability that the creditor of an obligation owes the debtor as well
+        communities: int, number of communities (consecutive blocks of nodes of random sizes)
+        mixing: float, probability that a creditor is drawn from the whole network instead of the own community
+        sink_probability: float, probability that a node owes the outside world, these obligations are the
+                          exogenous_outflow of Simulation (see exogenous_outflow), not edges of the network
+        seed: int, the same seed (and rows_per_seed) gives the same network, whatever the block size
+        rows_per_seed: int, the obligations of every rows_per_seed consecutive debtors are drawn with their own random
+                       number generator, blocks consist of whole such units
+        """
+        self.N = N
+        self.mean_degree = mean_degree
+        self.out_degree_exponent = out_degree_exponent
+        self.in_degree_exponent = in_degree_exponent
+        self.weights = weights
+        self.reciprocity = reciprocity
+        self.communities = communities
+        self.mixing = mixing
+        self.sink_probability = sink_probability
+        self.seed = seed
+        self.rows_per_seed = rows_per_seed
+
+        # Step 1
+        # Propensities and the (expected) number of creditors of every node
+        rng = _rng(seed, 0)
+        out_propensity = _propensities(rng, N, out_degree_exponent)
+        in_propensity = _propensities(rng, N, in_degree_exponent)
+        self.out_degrees = np.minimum(rng.poisson(mean_degree * out_propensity / out_propensity.mean()), N - 1)
+        self.cumulative_in = np.cumsum(in_propensity)
+
+        # Communities are consecutive blocks of nodes
+        if communities > 1:
+            cuts = np.sort(rng.choice(np.arange(1, N), size=communities - 1, replace=False))
+            self.community_bounds = np.concatenate([[0], cuts, [N]])
+        else:
+            self.community_bounds = np.array([0, N])
+        self.community = np.repeat(np.arange(len(self.community_bounds) - 1), np.diff(self.community_bounds))
+
+        self.index_dtype = np.int32 if N < 2**31 else np.int64
+
+    def _creditors(self, rng, debtors):
+        """
+        Draws a creditor for every obligation of debtors (np.array of nodes).
+        """
+        cumulative = self.cumulative_in
+        # The range of the cumulative propensities to draw from: the own community or the whole network
+        bounds = self.community_bounds[np.stack([self.community[debtors], self.community[debtors] + 1])]
+        low = np.where(bounds[0] > 0, cumulative[np.maximum(bounds[0] - 1, 0)], 0.)
+        high = cumulative[bounds[1] - 1]
+        if self.communities > 1:
+            whole = rng.random(len(debtors)) < self.mixing
+            low[whole], high[whole] = 0., cumulative[-1]
+        targets = low + rng.random(len(debtors)) * (high - low)
+        return np.minimum(np.searchsorted(cumulative, targets, side='right'), self.N - 1)
+
+    def _unit_edges(self, unit):
+        """
+        The drawn obligations of the debtors of one seed unit (rows_per_seed rows): (debtors, creditors, weights,
+        reciprocated, weights back) with the weights back those of the reciprocated obligations, the same every time,
+        whatever the blocks.
+        """
+        rng = _rng(self.seed, 1, unit)
+        start, stop = unit*self.rows_per_seed, min((unit + 1)*self.rows_per_seed, self.N)
+        debtors = np.repeat(np.arange(start, stop), self.out_degrees[start:stop])
+        creditors = self._creditors(rng, debtors)
+        weights = draw(self.weights, rng, len(debtors))
+        reciprocated = rng.random(len(debtors)) < self.reciprocity
+        keep = debtors != creditors
+        reciprocated = reciprocated[keep]
+        weights_back = draw(self.weights, rng, int(reciprocated.sum()))
+        return debtors[keep], creditors[keep], weights[keep], reciprocated, weights_back
+
+    def _base_edges(self, start, stop):
+        """
+        The drawn obligations of the debtors start to stop (boundaries of seed units).
+        """
+        units = [self._unit_edges(unit) for unit in range(start // self.rows_per_seed,
+                                                         -(-stop // self.rows_per_seed))]
+        return tuple(np.concatenate(parts) for parts in zip(*units))
+
+    def _blocks(self, block_size):
+        # Blocks of whole seed units
+        degrees = np.add.reduceat(self.out_degrees, np.arange(0, self.N, self.rows_per_seed))
+        boundaries = row_blocks(np.concatenate([[0], np.cumsum(degrees)]), block_size)
+        boundaries = np.minimum(boundaries*self.rows_per_seed, self.N)
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+    def _reciprocal_edges(self, blocks, verbose):
+        """
+        Pass 1: the obligations back (creditor to debtor) of all reciprocated obligations, sorted by debtor.
+        """
+        verboseprint = print if verbose else lambda *a, **k: None
+        debtors, creditors, weights = [], [], []
+        for n, (start, stop) in enumerate(blocks):
+            verboseprint(f'\rreciprocity, block: {n+1:<6}/ {len(blocks)}', end='')
+            block_debtors, block_creditors, _, reciprocated, weights_back = self._base_edges(start, stop)
+            debtors.append(block_creditors[reciprocated].astype(self.index_dtype))
+            creditors.append(block_debtors[reciprocated].astype(self.index_dtype))
+            weights.append(weights_back)
+        verboseprint('')
+        debtors, creditors, weights = (np.concatenate(parts) for parts in (debtors, creditors, weights))
+        order = np.argsort(debtors, kind='stable')
+        return debtors[order], creditors[order], weights[order]
+
+    def blocks(self, block_size=2**22, verbose=0):
+        """
+        Generator of the network in blocks of rows of about block_size obligations: (start, stop, block), with block
+        the CSR-matrix of the rows start to stop (shape (stop-start, N)).
+        """
+        verboseprint = print if verbose else lambda *a, **k: None
+        blocks = self._blocks(block_size)
+        reciprocal = self._reciprocal_edges(blocks, verbose) if self.reciprocity else None
+        for n, (start, stop) in enumerate(blocks):
+            verboseprint(f'\rblock: {n+1:<6}/ {len(blocks)}', end='')
+            debtors, creditors, weights, _, _ = self._base_edges(start, stop)
+            if reciprocal is not None:
+                first, last = np.searchsorted(reciprocal[0], [start, stop])
+                debtors = np.concatenate([debtors, reciprocal[0][first:last]])
+                creditors = np.concatenate([creditors, reciprocal[1][first:last]])
+                weights = np.concatenate([weights, reciprocal[2][first:last]])
+            block = sparse.coo_matrix((weights, (debtors - start, creditors)), shape=(stop - start, self.N)).tocsr()
+            block.sum_duplicates()
+            yield start, stop, block
+        verboseprint('')
+
+    def exogenous_outflow(self):
+        """
+        Returns what every node owes the outside world (np.array with shape (N,)): a node owes it with probability
+        sink_probability, an obligation drawn like the others. Drawn per seed unit, thus the same whatever the blocks.
+        """
+        outflow = np.zeros(self.N)
+        if not self.sink_probability:
+            return outflow
+        for unit in range(-(-self.N // self.rows_per_seed)):
+            rng = _rng(self.seed, 2, unit)
+            start, stop = unit*self.rows_per_seed, min((unit + 1)*self.rows_per_seed, self.N)
+            owes = np.flatnonzero(rng.random(stop - start) < self.sink_probability) + start
+            outflow[owes] = draw(self.weights, rng, len(owes))
+        return outflow
+
+    def generate(self, block_size=2**22, verbose=0):
+        """
+        Returns the network as a CSR-matrix (in memory).
+        """
+        indptr = [np.zeros(1, dtype=np.int64)]
+        indices, data = [], []
+        nnz = 0
+        for start, stop, block in self.blocks(block_size, verbose):
+            indptr.append(block.indptr[1:].astype(np.int64) + nnz)
+            indices.append(block.indices.astype(self.index_dtype))
+            data.append(block.data)
+            nnz += block.nnz
+        indptr = np.concatenate(indptr)
+        if nnz < 2**31:
+            indptr = indptr.astype(np.int32)
+        return sparse.csr_matrix((np.concatenate(data), np.concatenate(indices), indptr), shape=(self.N, self.N))
+
+    def save(self, label, mmap=False, block_size=2**22, verbose=1):
+        """
+        Writes the network to transactionnetworks/{label}/L.npz, which select_right_L reads (label_of_network=label),
+        or with mmap as .npy files in transactionnetworks/{label}/L/ (see save_memmap_csr), without ever holding the
+        whole network in memory. With sink_probability the exogenous outflows are written to
+        transactionnetworks/{label}/exogenous_outflow.npy.
+        """
+        folder = os.path.join(current_dir, f'transactionnetworks/{label}')
+        os.makedirs(folder, exist_ok=True)
+        if self.sink_probability:
+            np.save(os.path.join(folder, 'exogenous_outflow.npy'), self.exogenous_outflow())
+        if not mmap:
+            L = self.generate(block_size, verbose)
+            print(f'Saving {L.nnz} obligations to {os.path.join(folder, "L.npz").replace(os.getcwd(), "~")}.')
+            with open(os.path.join(folder, 'L.npz'), 'wb') as file:
+                sparse.save_npz(file, L)
+            return L
+
+        # The number of obligations is only known at the end, the blocks are appended to raw files first
+        path = os.path.join(folder, 'L')
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        indptr = np.lib.format.open_memmap(os.path.join(path, 'indptr.npy'), mode='w+', dtype=np.int64,
+                                           shape=(self.N + 1,))
+        indptr[0] = 0
+        nnz = 0
+        with open(os.path.join(path, 'indices.raw'), 'wb') as indices_file, \
+                open(os.path.join(path, 'data.raw'), 'wb') as data_file:
+            for start, stop, block in self.blocks(block_size, verbose):
+                indptr[start+1:stop+1] = block.indptr[1:] + nnz
+                indices_file.write(block.indices.astype(self.index_dtype).tobytes())
+                data_file.write(block.data.astype(np.float64).tobytes())
+                nnz += block.nnz
+        indptr.flush()
+
+        # indptr and indices with the same dtype (see load_memmap_csr): int64 for 2**31 obligations or nodes or more
+        index_dtype = np.int64 if max(nnz, self.N) >= 2**31 else np.int32
+        if index_dtype == np.int32:
+            small_indptr = np.asarray(indptr, dtype=np.int32)
+            del indptr
+            np.save(os.path.join(path, 'indptr.npy'), small_indptr)
+        for name, dtype, file_dtype in (('indices', self.index_dtype, index_dtype), ('data', np.float64, np.float64)):
+            raw = np.memmap(os.path.join(path, f'{name}.raw'), dtype=dtype, mode='r', shape=(nnz,)) if nnz else \
+                np.zeros(0, dtype=dtype)
+            array = np.lib.format.open_memmap(os.path.join(path, f'{name}.npy'), mode='w+', dtype=file_dtype,
+                                              shape=(nnz,))
+            for first in range(0, nnz, block_size):
+                array[first:first+block_size] = raw[first:first+block_size]
+            array.flush()
+            del raw, array
+            os.remove(os.path.join(path, f'{name}.raw'))
+        np.save(os.path.join(path, 'shape.npy'), np.array([self.N, self.N], dtype=np.int64))
+        print(f'Saved {nnz} obligations to {path.replace(os.getcwd(), "~")}/.')
+        return nnz
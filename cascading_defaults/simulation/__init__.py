@@ -1 +1,11 @@
 from .simulation import Simulation
+from .systemic_importance import SystemicImportance
+from .monte_carlo import MonteCarlo
+from .snapshots import SnapshotSeries
+from .grid import SimulationGrid
+from .continuation import ContinuationRunner
+from .diagnostics import ConvergenceMonitor
+from .acceleration import AndersonAccelerator, compare_acceleration
+from .trajectory import TrajectoryRecorder, Trajectory
+from .cache import ResultCache
+from .catalog import Catalog
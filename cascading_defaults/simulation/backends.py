@@ -0,0 +1,236 @@
+import numpy as np
+from scipy import sparse
+
+from .payments import payments_largest_creditor
+
+# The compiled extensions (setup.py) and numba are optional
+try:
+    from cython_defaults import cython_edge_payments
+    from cython_sorting import sort_L_cython
+except ImportError:
+    cython_edge_payments = sort_L_cython = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+class Backend:
+    """
+    Implementation of the payment kernels. Every backend gives the same results, up to float rounding.
+    """
+    name = None
+
+    @property
+    def available(self):
+        return True
+
+    def payments_largest_creditor(self, plan, incomings, pay_remaining_money, out=None, workspace=None,
+                                  sink_out=None):
+        """
+        Returns the payments over every edge (np.array aligned with plan.L.data) of the largest creditor strategy.
+        When given, the payments are written into out and the buffers of workspace are used. With exogenous outflows
+        in the plan, the payments to the outside world are written into sink_out (np.array with shape (N,)).
+        """
+        raise NotImplementedError(f'Backend {self.name} has no payments_largest_creditor.')
+
+    def sort_L(self, L, ascending_descending='ascending'):
+        """
+        Returns L (CSR) with the edges of every row sorted by their payables, ties by their column (ascending), thus
+        every backend gives the same order.
+        """
+        raise NotImplementedError(f'Backend {self.name} has no sort_L.')
+
+
+class NumpyBackend(Backend):
+    name = 'numpy'
+
+    def payments_largest_creditor(self, plan, incomings, pay_remaining_money, out=None, workspace=None,
+                                  sink_out=None):
+        return payments_largest_creditor(plan, incomings, pay_remaining_money, out=out, workspace=workspace,
+                                         sink_out=sink_out)
+
+    def sort_L(self, L, ascending_descending='ascending'):
+        L = sparse.csr_matrix(L)
+        if ascending_descending not in ['ascending', 'descending']:
+            raise Exception(f'Wrong order-way ({ascending_descending})')
+        rows = np.repeat(np.arange(L.shape[0]), np.diff(L.indptr))
+        key = L.data if ascending_descending == 'ascending' else -L.data
+        order = np.lexsort((L.indices, key, rows))
+        return sparse.csr_matrix((L.data[order], L.indices[order], L.indptr.copy()), shape=L.shape)
+
+
+class CythonBackend(Backend):
+    name = 'cython'
+
+    @property
+    def available(self):
+        return cython_edge_payments is not None
+
+    def payments_largest_creditor(self, plan, incomings, pay_remaining_money, out=None, workspace=None,
+                                  sink_out=None):
+        if plan.outflows is not None and sink_out is None:
+            sink_out = np.empty(plan.N)
+        return cython_edge_payments(plan.L, plan.total_payables_array, incomings,
+                                    pay_remaining_money=pay_remaining_money, out=out, outflows=plan.outflows,
+                                    sink_positions=plan.sink_positions, sink_out=sink_out)
+
+    def sort_L(self, L, ascending_descending='ascending'):
+        return sort_L_cython(L, ascending_descending=ascending_descending)
+
+
+class NumbaBackend(NumpyBackend):
+    name = 'numba'
+
+    def __init__(self):
+        self._kernel = None
+
+    @property
+    def available(self):
+        return numba is not None
+
+    @property
+    def kernel(self):
+        # Compiled at first use, as importing numba (and compiling) is slow
+        if self._kernel is None:
+            self._kernel = numba.njit(nogil=True, cache=True)(_largest_creditor_loop)
+        return self._kernel
+
+    def payments_largest_creditor(self, plan, incomings, pay_remaining_money, out=None, workspace=None,
+                                  sink_out=None):
+        amounts_payed = out if out is not None else np.empty_like(plan.L.data)
+        has_sink = plan.outflows is not None
+        if has_sink:
+            outflows, sink_positions = plan.outflows, plan.sink_positions
+            sink_out = sink_out if sink_out is not None else np.empty(plan.N)
+        else:
+            outflows, sink_positions, sink_out = np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0)
+        # As plain arrays (views), numba doesn't take memory-mapped ones
+        self.kernel(np.asarray(plan.L.indptr), np.asarray(plan.L.data), plan.total_payables_array,
+                    np.asarray(incomings, dtype=np.float64), bool(pay_remaining_money), np.asarray(amounts_payed),
+                    has_sink, outflows, sink_positions, sink_out)
+        return amounts_payed
+
+
+def _largest_creditor_loop(L_indptr, L_data, total_payables, incomings, pay_remaining_money, amounts_payed,
+                           has_sink, outflows, sink_positions, sink_payed):
+    # Same loop as payments_largest_creditor in defaults.pyx, compiled by numba
+    amounts_payed[:] = 0.
+    if has_sink:
+        sink_payed[:] = 0.
+    for i in range(L_indptr.shape[0]-1):
+        total_amount_payed = 0.
+        if incomings[i] >= total_payables[i]:
+            for j in range(L_indptr[i], L_indptr[i+1]):
+                amounts_payed[j] = L_data[j]
+            if has_sink:
+                sink_payed[i] = outflows[i]
+        else:
+            stopped = False
+            for j in range(L_indptr[i], L_indptr[i+1]):
+                if has_sink and j == sink_positions[i]:
+                    if total_amount_payed + outflows[i] < incomings[i]:
+                        sink_payed[i] = outflows[i]
+                        total_amount_payed += outflows[i]
+                    else:
+                        if pay_remaining_money:
+                            sink_payed[i] = incomings[i] - total_amount_payed
+                        stopped = True
+                        break
+                if total_amount_payed + L_data[j] < incomings[i]:
+                    amounts_payed[j] = L_data[j]
+                    total_amount_payed += L_data[j]
+                elif pay_remaining_money:
+                    amounts_payed[j] = incomings[i] - total_amount_payed
+                    stopped = True
+                    break
+                else:
+                    stopped = True
+                    break
+            if has_sink and not stopped and sink_positions[i] == L_indptr[i+1]:
+                if total_amount_payed + outflows[i] < incomings[i]:
+                    sink_payed[i] = outflows[i]
+                elif pay_remaining_money:
+                    sink_payed[i] = incomings[i] - total_amount_payed
+
+
+# Fastest first, used when no backend is selected
+backends = {backend.name: backend for backend in [NumbaBackend(), CythonBackend(), NumpyBackend()]}
+_selected_backend = None
+
+
+def register_backend(backend):
+    backends[backend.name] = backend
+
+
+def available_backends():
+    return [name for name, backend in backends.items() if backend.available]
+
+
+def set_backend(name=None):
+    """
+    Selects the backend for all calls that don't pass one, None is the fastest available.
+    """
+    global _selected_backend
+    if name is not None:
+        get_backend(name)
+    _selected_backend = name
+
+
+def get_backend(name=None):
+    """
+    Returns the backend by name, the globally selected one, or the fastest available one.
+    """
+    name = name or _selected_backend
+    if name is None:
+        name = available_backends()[0]
+    if name not in backends:
+        raise Exception(f'Backend {name} does not exist, choose from {list(backends)}.')
+    backend = backends[name]
+    if not backend.available:
+        raise Exception(f'Backend {name} is not available here, choose from {available_backends()}.')
+    return backend
+
+
+def check_backends(n_networks=5, N=200, density=0.05, seed=0, names=None, atol=1e-8):
+    """
+    Cross-checks the available backends on random networks, against the first one.
+    Raises an AssertionError when they differ, returns the largest absolute difference per backend.
+    """
+    from .strategies import LargestCreditorFirst, LargestCreditorLast
+
+    names = names or available_backends()
+    rng = np.random.default_rng(seed)
+    differences = {name: 0. for name in names}
+    for n in range(n_networks):
+        L = sparse.random(N, N, density=density, random_state=rng.integers(2**31), format='csr') * 100
+        for strategy_class in [LargestCreditorFirst, LargestCreditorLast]:
+            for pay_remaining_money in [False, True]:
+                strategy = strategy_class(build_reserves=True, pay_remaining_money=pay_remaining_money,
+                                          has_exogenous=False)
+                strategy.L_needed()  # Sets ascending_descending
+                sorted_Ls = {name: get_backend(name).sort_L(L, strategy.ascending_descending) for name in names}
+                for name in names:
+                    for attribute in ('data', 'indices', 'indptr'):
+                        assert np.array_equal(getattr(sorted_Ls[name], attribute),
+                                              getattr(sorted_Ls[names[0]], attribute)), \
+                            f'sort_L of backend {name} differs from {names[0]} ({attribute}).'
+                # Without and with obligations to the outside world (of which some equal an edge of the row)
+                outflows = rng.random(N) * 100
+                outflows[::7] = L.max(axis=1).toarray().flatten()[::7]
+                for exogenous_outflows in [None, outflows]:
+                    plan = strategy.compile_plan(sorted_Ls[names[0]], exogenous_outflows=exogenous_outflows)
+                    incomings = rng.random(N) * plan.total_payables_array * 1.2
+                    reference_sink, sink = np.zeros(N), np.zeros(N)
+                    reference = get_backend(names[0]).payments_largest_creditor(plan, incomings, pay_remaining_money,
+                                                                                sink_out=reference_sink)
+                    for name in names:
+                        amounts_payed = get_backend(name).payments_largest_creditor(plan, incomings,
+                                                                                    pay_remaining_money, sink_out=sink)
+                        difference = max(np.abs(amounts_payed - reference).max(initial=0.),
+                                         np.abs(sink - reference_sink).max(initial=0.))
+                        differences[name] = max(differences[name], difference)
+                        assert difference <= atol, f'Backend {name} differs {difference} from {names[0]} ' \
+                                                   f'({strategy.label}, network {n}).'
+    return differences
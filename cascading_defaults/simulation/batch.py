@@ -0,0 +1,116 @@
+import numpy as np
+
+from cascading_defaults.simulation.workspace import Workspace
+
+DTYPE = np.float64
+
+
+def scenario_sums(x):
+    """
+    Sums of the columns (scenarios) of x with shape (N,B). Every column is summed on its own (pairwise, like the sum of
+    an N-length vector), thus the sum of a scenario doesn't depend on the other scenarios in the batch.
+    """
+    return np.ascontiguousarray(x.T).sum(axis=1)
+
+
+def clear_batch(strategy, L, reserves, exogenous_cashflows=None, failed_nodes=None, rtol=5e-2, max_iter=None,
+                backend=None, exogenous_outflows=None):
+    """
+    Runs the fictitious default algorithm of Simulation for a batch of B scenarios at once, on one prepared L.
+    Convergence is checked per scenario on the total payments and receiving of every node (N-length vectors),
+    scenarios that converged are dropped from the batch.
+    Inputs:
+    strategy: cascading_defaults.simulation.Strategy instance
+    L: scipy sparse CSR matrix, as returned by strategy.select_right_L
+    reserves: np.array with shape (N,B), the starting reserves of every scenario (see Simulation)
+    exogenous_cashflows: np.array with shape (N,B) or None, downscaled like those of Simulation
+    exogenous_outflows: np.array with shape (N,) or None, what the nodes owe the outside world (see Simulation)
+    failed_nodes: np.array with shape (B,) or None, a node per scenario that fails (pays nothing) from the start
+    backend: str, name of the backend of the payment kernels (see backends.py)
+    Outputs:
+    dict with np.arrays 'size_p' (B,), 'total_flow' (B,), 'stages' (B,), 'total_payments' (N,B), 'reserves' (N,B)
+    and 'default_stage' (N,B), the stage in which a node defaulted (0 is never)
+    """
+    N, B = reserves.shape
+    if not strategy.has_exogenous:
+        exogenous_outflows = None
+    elif exogenous_outflows is None:
+        exogenous_outflows = np.zeros(N)
+    plan = strategy.plan(L, exogenous_outflows=exogenous_outflows)
+    workspace = Workspace(plan)
+    total_payables_array = plan.total_payables_array
+    total_receivables_array = plan.total_receivables_array
+    payables_column = total_payables_array.reshape((-1,1))
+
+    if not strategy.has_exogenous or exogenous_cashflows is None:
+        exogenous_cashflows = np.zeros((N, B))
+    else:
+        # Downscaled to equal everything payed to exo, unscaled without outflows (see Simulation)
+        exogenous_cashflows = np.array(exogenous_cashflows, dtype=DTYPE)
+        total_outflows = plan.outflows.sum() if plan.outflows is not None else 0.
+        if total_outflows > 0:
+            sums = scenario_sums(exogenous_cashflows)
+            exogenous_cashflows = exogenous_cashflows * np.divide(total_outflows, sums, out=np.zeros(B),
+                                                                  where=sums > 0)
+
+    # Set starting 'reserves' (i.e. available money)
+    reserves = np.array(reserves + total_receivables_array.reshape((-1,1)) + exogenous_cashflows, dtype=DTYPE)
+    total_flow = scenario_sums(reserves)
+
+    failed = np.zeros((N, B), dtype=bool)
+    if failed_nodes is not None:
+        failed[failed_nodes, np.arange(B)] = True
+
+    # Start with the assumption that it's just the network of obligations
+    total_payments = np.tile(payables_column, (1, B))
+    total_receiving = np.tile(total_receivables_array.reshape((-1,1)), (1, B))
+    default_stage = np.zeros((N, B), dtype=np.int32)
+    stages = np.zeros(B, dtype=np.int32)
+    active = np.arange(B)
+
+    stage = 1
+    while active.shape[0]:
+        incomings = np.where(failed[:, active], 0., reserves[:, active])
+        payments, receiving, exogenous_payments = strategy.batch_payments(plan, incomings, backend,
+                                                                          workspace=workspace)
+
+        if strategy.build_reserves:
+            reserves[:, active] -= payments
+
+        # Decrease total exogenous available in a EisenbergNoe-ish way
+        if strategy.has_exogenous:
+            sums = scenario_sums(exogenous_cashflows[:, active])
+            ratio = np.divide(scenario_sums(exogenous_payments), sums, out=np.ones(len(active)), where=sums > 0)
+            exogenous_cashflows[:, active] = exogenous_cashflows[:, active] * ratio
+
+        if strategy.build_reserves:
+            reserves[:, active] += receiving + exogenous_cashflows[:, active]
+
+        # A node is default when the obligations exceed the incoming cash
+        new_defaults = (payables_column > payments) & (default_stage[:, active] == 0)
+        default_stage[:, active] = np.where(new_defaults, stage, default_stage[:, active])
+
+        # Terminate the scenarios of which the payments don't change anymore
+        converged = (np.isclose(payments, total_payments[:, active], rtol=rtol).all(axis=0) &
+                     np.isclose(receiving, total_receiving[:, active], rtol=rtol).all(axis=0))
+        total_payments[:, active] = payments
+        total_receiving[:, active] = receiving
+
+        stage += 1
+        if stage > N or (max_iter and stage >= max_iter):
+            converged[:] = True
+        stages[active[converged]] = stage - 1
+        active = active[~converged]
+
+    # The difference of payments and receiving, you keep in your pockets
+    if strategy.build_reserves:
+        reserves = reserves - total_payments
+
+    return {
+        'size_p': scenario_sums(total_payments),
+        'total_flow': total_flow,
+        'stages': stages,
+        'total_payments': total_payments,
+        'reserves': reserves,
+        'default_stage': default_stage
+    }
@@ -0,0 +1,164 @@
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+
+import numpy as np
+
+from .. import current_dir
+from ..utils import fingerprint, save_contents, load_contents
+
+# Attributes that are not results: the inputs (part of the key) and the settings of the simulation itself
+_not_cached = ['L', 'plan', 'workspace', 'strategy', 'label', 'label_of_run', 'transaction_network', 'backend',
+               'block_size', 'out_of_core', 'memory_budget', 'loaded', 'has_run', 'has_done_post']
+
+_code_version = None
+
+
+# The packages of which the code is used to clear (and to load L), relative to cascading_defaults
+_code_folders = ['simulation', 'utils', 'networks']
+
+
+def code_version():
+    """
+    Returns a hash (hex str) of the sources of the packages that clear (simulation, utils and networks), thus cached
+    results of older code aren't used.
+    """
+    global _code_version
+    if _code_version is None:
+        package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        h = hashlib.blake2b(digest_size=16)
+        for name in _code_folders:
+            folder = os.path.join(package, name)
+            for filename in sorted(os.listdir(folder)):
+                if filename.endswith(('.py', '.pyx')):
+                    h.update(f'{name}/{filename}'.encode())
+                    with open(os.path.join(folder, filename), 'rb') as file:
+                        h.update(file.read())
+        _code_version = h.hexdigest()
+    return _code_version
+
+
+class ResultCache:
+
+    def __init__(self, folder='simulations/cache', max_bytes=16*2**30):
+        """
+        Results of simulations by a hash of their inputs: L, the strategy, the backend, the start reserves, the
+        exogenous cashflows and outflows, rtol, max_iter and the code. Running a simulation of which the inputs didn't
+        change loads the results instead. When the results take more than max_bytes, the least recently used ones are
+        removed.
+        Inputs:
+        folder: str, relative to the current directory
+        max_bytes: int, bytes on disk of all results together
+        """
+        self.folder = folder
+        self.path = os.path.join(current_dir, folder)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.index = self._read_index()
+
+    def _read_index(self):
+        # Key: bytes on disk, from least to most recently used
+        try:
+            with open(os.path.join(self.path, 'index.pkl'), 'rb') as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return OrderedDict()
+
+    def _write_index(self):
+        os.makedirs(self.path, exist_ok=True)
+        filename = os.path.join(self.path, 'index.pkl')
+        with open(f'{filename}.tmp', 'wb') as file:
+            pickle.dump(self.index, file)
+        os.replace(f'{filename}.tmp', filename)
+
+    @staticmethod
+    def key(simulation, rtol, max_iter=None, start_p=None, start_exogenous_payments=None, monitor=None,
+            accelerator=None):
+        """
+        Returns the key (hex str) of a run of simulation, before it runs.
+        """
+        strategy = simulation.strategy
+        h = hashlib.blake2b(digest_size=16)
+        h.update(code_version().encode())
+        h.update(fingerprint(simulation.L).encode())
+        h.update(repr((type(strategy).__name__, strategy.build_reserves, strategy.pay_remaining_money,
+                       strategy.has_exogenous, simulation.low_memory, float(rtol), max_iter,
+                       strategy.get_backend(simulation=simulation).name)).encode())
+        for array in (simulation.reserves, simulation.exogenous_cashflows, simulation.exogenous_outflows):
+            if array is not None:
+                h.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        if start_p is not None:
+            # A warm start converges in fewer stages
+            h.update(fingerprint(start_p).encode())
+            if start_exogenous_payments is not None:
+                h.update(np.ascontiguousarray(start_exogenous_payments, dtype=np.float64).tobytes())
+        if monitor is not None:
+            settings = {name: value for name, value in vars(monitor).items()
+                        if name in ('cycles', 'stagnation', 'action', 'max_period', 'window', 'min_improvement',
+                                    'decimals', 'max_accelerations')}
+            h.update(repr(sorted(settings.items())).encode())
+        if accelerator is not None:
+            h.update(repr((accelerator.memory, accelerator.delay, accelerator.regularization, accelerator.max_growth,
+                           accelerator.max_rejections, accelerator.margin)).encode())
+        return h.hexdigest()
+
+    def get(self, key, simulation, verbose=0):
+        """
+        Loads the results of key into simulation, returns whether these were cached.
+        """
+        with self.lock:
+            if key not in self.index:
+                return False
+            if not os.path.exists(os.path.join(self.path, key)):
+                del self.index[key]
+                self._write_index()
+                return False
+            self.index.move_to_end(key)
+            self._write_index()
+            load_contents(simulation, upperfolder=os.path.join(self.folder, key), verbose=verbose,
+                          label_seperate_folder=False)
+        simulation.loaded = True
+        simulation.has_run = True
+        simulation.has_done_post = True
+        return True
+
+    def put(self, key, simulation, verbose=0):
+        """
+        Stores the results of simulation under key, and removes the least recently used results above max_bytes.
+        """
+        path = os.path.join(self.path, key)
+        with self.lock:
+            save_contents(simulation, upperfolder=os.path.join(self.folder, key), verbose=verbose,
+                          label_seperate_folder=False, skip_at_save=list(_not_cached))
+            self.index[key] = sum(os.path.getsize(os.path.join(path, filename)) for filename in os.listdir(path))
+            self.index.move_to_end(key)
+            while sum(self.index.values()) > self.max_bytes and len(self.index) > 1:
+                old_key, _ = self.index.popitem(last=False)
+                shutil.rmtree(os.path.join(self.path, old_key), ignore_errors=True)
+            self._write_index()
+
+    def clear(self):
+        """
+        Removes all cached results.
+        """
+        with self.lock:
+            for key in self.index:
+                shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+            self.index = OrderedDict()
+            self._write_index()
+
+
+_result_cache = None
+
+
+def result_cache():
+    """
+    Returns the ResultCache used by Simulation.run(cache=True).
+    """
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache()
+    return _result_cache
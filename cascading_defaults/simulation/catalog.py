@@ -0,0 +1,193 @@
+from contextlib import closing
+import os
+import pickle
+import sqlite3
+import time
+
+import pandas as pd
+
+from .. import current_dir
+from ..utils import load_contents
+
+_columns = {
+    'folder': 'TEXT PRIMARY KEY',
+    'network': 'TEXT',
+    'label_of_run': 'TEXT',
+    'strategy_label': 'TEXT',
+    'strategy': 'TEXT',
+    'build_reserves': 'INTEGER',
+    'pay_remaining_money': 'INTEGER',
+    'has_exogenous': 'INTEGER',
+    'low_memory': 'INTEGER',
+    'N': 'INTEGER',
+    'nnz': 'INTEGER',
+    'stages': 'INTEGER',
+    'termination_reason': 'TEXT',
+    'size_p_relative': 'REAL',
+    'total_flow': 'REAL',
+    'defaults': 'INTEGER',
+    'never_defaulted': 'INTEGER',
+    'saved_at': 'REAL'
+}
+
+# The attributes of a saved simulation that are needed for its row (not L, nnz is then unknown)
+_attributes = ['transaction_network', 'label_of_run', 'strategy', 'low_memory', 'N', 'size_p_relative',
+               'termination_reason', 'total_flow', 'defaulted_nodes', 'all_defaults']
+
+
+def catalog_row(simulation, folder):
+    """
+    Returns the row (dict) of a simulation saved in folder (relative to the current directory).
+    """
+    strategy = simulation.strategy
+    size_p_relative = getattr(simulation, 'size_p_relative', [])
+    all_defaults = getattr(simulation, 'all_defaults', {})
+    return {
+        'folder': folder,
+        'network': simulation.transaction_network,
+        'label_of_run': None if simulation.label_of_run is None else str(simulation.label_of_run),
+        'strategy_label': strategy.label,
+        'strategy': type(strategy).__name__,
+        'build_reserves': int(strategy.build_reserves),
+        'pay_remaining_money': int(strategy.pay_remaining_money),
+        'has_exogenous': int(strategy.has_exogenous),
+        'low_memory': int(getattr(simulation, 'low_memory', False)),
+        'N': int(simulation.N),
+        'nnz': int(simulation.L.nnz) if getattr(simulation, 'L', None) is not None else None,
+        'stages': len(size_p_relative),
+        'termination_reason': getattr(simulation, 'termination_reason', None),
+        'size_p_relative': float(size_p_relative[-1]) if len(size_p_relative) else None,
+        'total_flow': float(simulation.total_flow),
+        'defaults': len(getattr(simulation, 'defaulted_nodes', [])),
+        'never_defaulted': len(all_defaults[0]) if 0 in all_defaults else None,
+        'saved_at': time.time()
+    }
+
+
+class Catalog:
+
+    def __init__(self, filename='simulations/catalog.sqlite'):
+        """
+        Index (SQLite) of the saved simulations, one row per folder: the parameters, the network, the convergence
+        and the headline results. Simulation.save keeps it up to date, thus runs can be selected without loading them.
+        Inputs:
+        filename: str, relative to the current directory
+        """
+        self.filename = filename
+        self.path = os.path.join(current_dir, filename)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            columns = ', '.join(f'{name} {kind}' for name, kind in _columns.items())
+            connection.execute(f'CREATE TABLE IF NOT EXISTS simulations ({columns})')
+            connection.execute('CREATE INDEX IF NOT EXISTS parameters ON simulations '
+                               '(network, strategy, build_reserves, pay_remaining_money, has_exogenous)')
+
+    def _connect(self):
+        # A connection per call, thus the catalog can be used from any thread (see AsyncSaver)
+        return sqlite3.connect(self.path, timeout=30)
+
+    def record(self, row):
+        """
+        Adds (or replaces) the row of a saved simulation, see catalog_row.
+        """
+        names = list(_columns)
+        with closing(self._connect()) as connection, connection:
+            connection.execute(f'INSERT OR REPLACE INTO simulations ({", ".join(names)}) '
+                               f'VALUES ({", ".join("?" for _ in names)})', [row.get(name) for name in names])
+
+    def remove(self, folder):
+        with closing(self._connect()) as connection, connection:
+            connection.execute('DELETE FROM simulations WHERE folder = ?', (folder,))
+
+    def query(self, where=None, params=(), **selection):
+        """
+        Returns the rows (pd.DataFrame) of the matching simulations.
+        Inputs:
+        selection: column=value, a list of values matches any of them, e.g. strategy=['LargestCreditorFirst',
+                   'LargestCreditorLast'], build_reserves=True
+        where: str, an extra SQL condition, e.g. 'size_p_relative < ?', with params its parameters
+        """
+        conditions, values = [], []
+        for name, value in selection.items():
+            if name not in _columns:
+                raise Exception(f'Unknown column {name}, choose from {list(_columns)}.')
+            if isinstance(value, (list, tuple, set)):
+                value = list(value)
+                conditions.append(f'{name} IN ({", ".join("?" for _ in value)})')
+                values.extend(int(v) if isinstance(v, bool) else v for v in value)
+            elif value is None:
+                conditions.append(f'{name} IS NULL')
+            else:
+                conditions.append(f'{name} = ?')
+                values.append(int(value) if isinstance(value, bool) else value)
+        if where:
+            conditions.append(f'({where})')
+            values.extend(params)
+        sql = 'SELECT * FROM simulations'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        with closing(self._connect()) as connection, connection:
+            return pd.read_sql_query(sql, connection, params=values)
+
+    def load(self, rows=None, verbose=0, attributes=None, **selection):
+        """
+        Loads the simulations of rows (as returned by query), or of query(**selection), returns a dict
+        folder: Simulation.
+        attributes: list of str, load only these attributes (see load_contents)
+        """
+        from .simulation import Simulation
+
+        if rows is None:
+            rows = self.query(**selection)
+        simulations = {}
+        for folder in rows['folder']:
+            simulation = Simulation.__new__(Simulation)
+            load_contents(simulation, upperfolder=folder, verbose=verbose, label_seperate_folder=False,
+                          attributes=attributes)
+            simulation.loaded = True
+            simulations[folder] = simulation
+        return simulations
+
+    def rebuild(self, upperfolder='simulations', verbose=1):
+        """
+        Crawls upperfolder for saved simulations (e.g. saved before the catalog existed) and records them, rows of
+        folders that don't exist anymore are removed.
+        """
+        from .simulation import Simulation
+
+        verboseprint = print if verbose else lambda *a, **k: None
+        root = os.path.join(current_dir, upperfolder)
+        recorded = 0
+        for path, _, filenames in os.walk(root):
+            if 'type.pkl' not in filenames:
+                continue
+            with open(os.path.join(path, 'type.pkl'), 'rb') as file:
+                if pickle.load(file) != str(Simulation):
+                    continue
+            # Not the results of a ResultCache, these have no labels
+            if not all(f'{attribute}.pkl' in filenames for attribute in ('strategy', 'transaction_network', 'N')):
+                continue
+            folder = os.path.relpath(path, current_dir)
+            simulation = Simulation.__new__(Simulation)
+            load_contents(simulation, upperfolder=folder, label_seperate_folder=False,
+                          attributes=[attribute for attribute in _attributes if f'{attribute}.pkl' in filenames])
+            self.record(catalog_row(simulation, folder))
+            recorded += 1
+        for folder in self.query()['folder']:
+            if not os.path.exists(os.path.join(current_dir, folder)):
+                self.remove(folder)
+        verboseprint(f'Recorded {recorded} simulations in {self.filename}.')
+        return self
+
+
+_catalog = None
+
+
+def catalog():
+    """
+    Returns the Catalog that Simulation.save keeps up to date.
+    """
+    global _catalog
+    if _catalog is None:
+        _catalog = Catalog()
+    return _catalog
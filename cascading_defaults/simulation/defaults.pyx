@@ -2,21 +2,31 @@ cimport numpy as cnp
 import numpy as np
 import scipy.sparse as sparse
 
-cdef cnp.float64_t[:] payments_robin_hood(cnp.int32_t[:] L_indptr,
-                                          cnp.int32_t[:] L_indices,
-                                          cnp.float64_t[:] L_data,
-                                          cnp.float64_t[:] total_payables,
-                                          cnp.float64_t[:] incomings,
-                                          cnp.float64_t[:] equities,
-                                          cnp.int32_t order,
-                                          bint pay_remaining_money):
-    
-    cdef cnp.float64_t[:] amounts_payed = np.zeros_like(L_data)
+# The index arrays of a CSR-matrix are int64 when it has 2**31 edges or more (indptr) or nodes (indices)
+ctypedef fused indptr_t:
+    cnp.int32_t
+    cnp.int64_t
+
+ctypedef fused indices_t:
+    cnp.int32_t
+    cnp.int64_t
+
+def payments_robin_hood(const indptr_t[:] L_indptr,
+                        const indices_t[:] L_indices,
+                        cnp.float64_t[:] L_data,
+                        cnp.float64_t[:] total_payables,
+                        cnp.float64_t[:] incomings,
+                        cnp.float64_t[:] equities,
+                        cnp.int32_t order,
+                        bint pay_remaining_money,
+                        cnp.float64_t[:] amounts_payed):
+    
+    amounts_payed[:] = 0.
     cdef cnp.float64_t total_amount_payed = 0.
     cdef cnp.float64_t[:] equities_creditors
     cdef cnp.float64_t[:] zeros = np.zeros_like(L_indptr, dtype=np.float64)
-    cdef cnp.int32_t[:] creditors
-    cdef cnp.int32_t[:] argsort
+    cdef const indices_t[:] creditors
+    cdef cnp.int64_t[:] argsort
     cdef Py_ssize_t i
     cdef Py_ssize_t j
     
@@ -41,7 +51,7 @@ cdef cnp.float64_t[:] payments_robin_hood(cnp.int32_t[:] L_indptr,
             equities_creditors = zeros[:len(creditors)]
             for j in range(len(creditors)):
                 equities_creditors[j] = equities[creditors[j]]
-            argsort = np.array(np.argsort(equities_creditors)[::order] + L_indptr[i], dtype=np.int32)
+            argsort = np.array(np.argsort(equities_creditors)[::order] + L_indptr[i], dtype=np.int64)
             # Pay edge with equity[creditor] is smallest until total_payments >= total_incoming
             for j in range(len(argsort)):
                 if total_amount_payed + L_data[argsort[j]] < incomings[i]:
@@ -57,15 +67,23 @@ cdef cnp.float64_t[:] payments_robin_hood(cnp.int32_t[:] L_indptr,
     return amounts_payed
     
 
-cdef cnp.float64_t[:] payments_largest_creditor(cnp.int32_t[:] L_indptr,
-                                                cnp.int32_t[:] L_indices,
-                                                cnp.float64_t[:] L_data,
-                                                cnp.float64_t[:] total_payables,
-                                                cnp.float64_t[:] incomings,
-                                                bint pay_remaining_money):
-    
-    cdef cnp.float64_t[:] amounts_payed = np.zeros_like(L_data)
+cdef cnp.float64_t[:] payments_largest_creditor(const indptr_t[:] L_indptr,
+                                                const indices_t[:] L_indices,
+                                                const cnp.float64_t[:] L_data,
+                                                const cnp.float64_t[:] total_payables,
+                                                const cnp.float64_t[:] incomings,
+                                                bint pay_remaining_money,
+                                                cnp.float64_t[:] amounts_payed,
+                                                bint has_sink,
+                                                const cnp.float64_t[:] outflows,
+                                                const cnp.int64_t[:] sink_positions,
+                                                cnp.float64_t[:] sink_payed) noexcept nogil:
+    
+    amounts_payed[:] = 0.
+    if has_sink:
+        sink_payed[:] = 0.
     cdef cnp.float64_t total_amount_payed = 0.
+    cdef bint stopped
     cdef Py_ssize_t i
     cdef Py_ssize_t j
         
@@ -78,28 +96,49 @@ cdef cnp.float64_t[:] payments_largest_creditor(cnp.int32_t[:] L_indptr,
         # If yes: pay all creditors
         if incomings[i] >= total_payables[i]:  # If they get more then they have to pay
             amounts_payed[L_indptr[i]: L_indptr[i+1]] = L_data[L_indptr[i]: L_indptr[i+1]]  # Copy all data from row in p
+            if has_sink:
+                sink_payed[i] = outflows[i]
         # If not: step 4.2
         else:        
             # Step 4.2
             # Pay smallest payable until total_payments >= total_incoming
             # BTW, This only works because the data was sorted
+            stopped = 0
             for j in range(L_indptr[i], L_indptr[i+1]):
+                # The outside world (virtual sink node) comes before edge sink_positions[i]
+                if has_sink and j == sink_positions[i]:
+                    if total_amount_payed + outflows[i] < incomings[i]:
+                        sink_payed[i] = outflows[i]
+                        total_amount_payed += outflows[i]
+                    else:
+                        if pay_remaining_money != 0:
+                            sink_payed[i] = incomings[i] - total_amount_payed
+                        stopped = 1
+                        break
                 if total_amount_payed + L_data[j] < incomings[i]:
                     amounts_payed[j] = L_data[j]
                     total_amount_payed += L_data[j]
                 elif pay_remaining_money != 0:
                     amounts_payed[j] = incomings[i] - total_amount_payed
+                    stopped = 1
                     break
                 else:
+                    stopped = 1
                     break
+            # After all edges
+            if has_sink and not stopped and sink_positions[i] == L_indptr[i+1]:
+                if total_amount_payed + outflows[i] < incomings[i]:
+                    sink_payed[i] = outflows[i]
+                elif pay_remaining_money != 0:
+                    sink_payed[i] = incomings[i] - total_amount_payed
     
     return amounts_payed
 
-cdef tuple sort_csr_matrix_rowwise(cnp.int32_t[:] indptr,
-                                    cnp.int32_t[:] indices,
-                                    cnp.float64_t[:] data,
-                                    cnp.int32_t order):
-    cdef cnp.int32_t[:] sorted_indices = np.empty_like(indices)
+def sort_csr_matrix_rowwise(const indptr_t[:] indptr,
+                            const indices_t[:] indices,
+                            const cnp.float64_t[:] data,
+                            cnp.int32_t order):
+    cdef indices_t[:] sorted_indices = np.empty_like(indices)
     cdef cnp.float64_t[:] sorted_data = np.empty_like(data)
     
     cdef list argsort
@@ -107,7 +146,9 @@ cdef tuple sort_csr_matrix_rowwise(cnp.int32_t[:] indptr,
     cdef Py_ssize_t j
     
     for i in range(indptr.shape[0]-1):  # Iterate over all nodes
-        argsort = list(np.argsort(data[indptr[i]:indptr[i+1]]) + indptr[i])[::order]
+        # By the payables, ties by the column (like the NumPy backend)
+        argsort = list(np.lexsort((np.asarray(indices[indptr[i]:indptr[i+1]]),
+                                   order*np.asarray(data[indptr[i]:indptr[i+1]]))) + indptr[i])
         for j in range(len(argsort)):
             sorted_data[j + indptr[i]] = data[argsort[j]]
             sorted_indices[j + indptr[i]] = indices[argsort[j]]
@@ -168,17 +209,69 @@ cpdef cython_payments(cls, strategy='largest_creditor', last_first='first', pay_
     # Step 4
     # For all companies calculate all the payments
     if strategy == 'largest_creditor':
-        amounts_payed_view = payments_largest_creditor(L_indptr, L_indices, L_data,
-                                                       total_payables_view, incomings_view, pay_remaining_money_c)
+        amounts_payed_view = cython_edge_payments(L_csr, total_payables_view, incomings_view,
+                                                  pay_remaining_money=pay_remaining_money)
     elif strategy == 'robin_hood':
         amounts_payed_view = payments_robin_hood(L_indptr, L_indices, L_data, total_payables_view,
-                                                  incomings_view, equities_view, order, pay_remaining_money_c)
+                                                  incomings_view, equities_view, order, pay_remaining_money_c,
+                                                  np.zeros_like(L_data))
             
     # Step 5
     # Aggregate all payments (rows) to one payment matrix
-    new_p = sparse.csr_matrix((amounts_payed_view, L_indices, L_indptr), shape=p_csr.shape)
+    # Copy the index arrays, scipy may sort the indices of new_p in place, which would scramble L
+    new_p = sparse.csr_matrix((amounts_payed_view, L_indices.copy(), L_indptr.copy()), shape=p_csr.shape)
     return new_p
 
+cpdef cython_edge_payments(L, total_payables, incomings, last_first='first', pay_remaining_money=False, out=None,
+                           outflows=None, sink_positions=None, sink_out=None):
+    """
+    Inputs: L (prepared CSR-matrix), total_payables and incomings (np.arrays with shape (N,)),
+    out (np.array aligned with L.data to write the payments in, optional),
+    outflows, sink_positions and sink_out (np.arrays with shape (N,)): the obligations to the outside world, the edge
+    before which these come in every row, and where to write their payments (optional)
+    Output: np.array aligned with L.data with the payments made over every edge (largest creditor strategy)
+    """
+    # No copies (L is a CSR-matrix already)
+    L_csr = L if getattr(L, 'format', None) == 'csr' else sparse.csr_matrix(L)
+    if out is None:
+        out = np.empty_like(L_csr.data, dtype=np.float64)
+    
+    cdef bint pay_remaining_money_c
+    pay_remaining_money_c = 1 if pay_remaining_money else 0
+    
+    if last_first not in ['first', 'last']:
+        raise Exception(f'Wrong order-way ({last_first})')
+    
+    cdef const cnp.float64_t[:] total_payables_view = np.asarray(total_payables, dtype=np.float64)
+    cdef const cnp.float64_t[:] incomings_view = np.asarray(incomings, dtype=np.float64)
+    
+    # The virtual sink node
+    cdef bint has_sink = outflows is not None
+    if not has_sink:
+        outflows, sink_positions, sink_out = np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0)
+    
+    # indptr and indices are int32 or int64 (no copies), the kernel is compiled for either
+    _edge_payments(L_csr.indptr, L_csr.indices, L_csr.data, total_payables_view, incomings_view,
+                   pay_remaining_money_c, out, has_sink, np.asarray(outflows, dtype=np.float64),
+                   np.asarray(sink_positions, dtype=np.int64), sink_out)
+    return out
+
+def _edge_payments(const indptr_t[:] indptr,
+                   const indices_t[:] indices,
+                   const cnp.float64_t[:] data,
+                   const cnp.float64_t[:] total_payables,
+                   const cnp.float64_t[:] incomings,
+                   bint pay_remaining_money,
+                   cnp.float64_t[:] out,
+                   bint has_sink,
+                   const cnp.float64_t[:] outflows,
+                   const cnp.int64_t[:] sink_positions,
+                   cnp.float64_t[:] sink_out):
+    # Without the GIL, thus simulations in other threads can run at the same time
+    with nogil:
+        payments_largest_creditor(indptr, indices, data, total_payables, incomings, pay_remaining_money, out,
+                                  has_sink, outflows, sink_positions, sink_out)
+
 cpdef sort_L_cython(L, ascending_descending='ascending'):
     L_csr = sparse.csr_matrix(L)
     
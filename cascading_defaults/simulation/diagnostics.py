@@ -0,0 +1,138 @@
+from collections import deque
+import hashlib
+
+import numpy as np
+
+_actions = ['stop', 'report', 'accelerate']
+
+
+class ConvergenceMonitor:
+
+    def __init__(self, cycles=True, stagnation=True, action='stop', max_period=100, window=100,
+                 min_improvement=1e-2, decimals=None, max_accelerations=3):
+        """
+        Cheap diagnostics of the stages of a simulation, for runs that don't converge within rtol: the state cycles,
+        or the residual (see StageView) doesn't decrease anymore.
+        Inputs:
+        cycles: bool, detect exact cycles by a hash of the state (reserves and exogenous cashflows) of every stage,
+                only the hashes of the last max_period stages are kept
+        stagnation: bool, detect stagnation: the smallest residual of the last window/2 stages improved less than
+                    min_improvement (relative) on the one of the window/2 stages before
+        action: str, what to do when detected:
+                'stop': terminate the run
+                'report': record it (convergence_events of the simulation) and continue
+                'accelerate': replace the reserves of a cycle by their average over one period (this keeps the total
+                              of the reserves), at most max_accelerations times, after that stop. Stagnation is only
+                              reported
+        decimals: int, round the state to decimals before hashing, to detect cycles that only differ by rounding
+        """
+        if action not in _actions:
+            raise Exception(f'Unknown action {action}, choose from {_actions}.')
+        self.cycles = cycles
+        self.stagnation = stagnation
+        self.action = action
+        self.max_period = max_period
+        self.window = window
+        self.min_improvement = min_improvement
+        self.decimals = decimals
+        self.max_accelerations = max_accelerations
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the stages seen, for a new run.
+        """
+        self.hashes = {}
+        self.hash_order = deque()
+        self.residuals = deque(maxlen=self.window)
+        self.events = []
+        self.period = None
+        self.accelerations = 0
+        self.stagnating = False
+        # The cycle that is being averaged: (stages left, sum of the reserves)
+        self.averaging = None
+
+    def fingerprint(self, *arrays):
+        digest = hashlib.blake2b(digest_size=16)
+        for array in arrays:
+            if self.decimals is not None:
+                array = np.round(array, self.decimals)
+            digest.update(np.ascontiguousarray(array).view(np.uint8))
+        return digest.digest()
+
+    def _detect_cycle(self, stage, state):
+        key = self.fingerprint(*state)
+        first_stage = self.hashes.get(key)
+        self.hashes[key] = stage
+        self.hash_order.append(key)
+        if len(self.hash_order) > self.max_period:
+            old_key = self.hash_order.popleft()
+            if self.hashes.get(old_key, stage) <= stage - self.max_period:
+                del self.hashes[old_key]
+        if first_stage is None:
+            return None
+        return stage - first_stage
+
+    def _detect_stagnation(self, residual):
+        self.residuals.append(residual)
+        if len(self.residuals) < self.window:
+            return False
+        residuals = np.array(self.residuals)
+        half = self.window // 2
+        older, newer = residuals[:half].min(), residuals[half:].min()
+        return newer > 0 and newer >= older * (1 - self.min_improvement)
+
+    def update(self, stage, residual, reserves, *state):
+        """
+        Checks a stage, returns (action, reason): action None (continue), 'stop' or 'accelerate', reason 'cycle' or
+        'stagnation'. With 'accelerate', reserves are averaged over the cycle in place after one more period.
+        Inputs:
+        stage: int
+        residual: float, see StageView
+        reserves: np.array, the reserves after the stage
+        state: np.arrays that together with reserves determine the next stage (e.g. the exogenous cashflows)
+        """
+        if self.averaging is not None:
+            stages_left, reserves_sum = self.averaging
+            np.add(reserves_sum, reserves, out=reserves_sum)
+            if stages_left > 1:
+                self.averaging = (stages_left - 1, reserves_sum)
+                return None, None
+            np.divide(reserves_sum, self.period, out=reserves)
+            self.averaging = None
+            self.hashes.clear()
+            self.hash_order.clear()
+            self.residuals.clear()
+            self.events.append((stage, 'accelerated', self.period))
+            return 'accelerate', 'cycle'
+
+        if self.cycles:
+            period = self._detect_cycle(stage, (reserves,) + state)
+            if period is not None:
+                if self.action != 'report' or period != self.period:
+                    self.events.append((stage, 'cycle', period))
+                self.period = period
+                if self.action == 'stop' or (self.action == 'accelerate' and
+                                             self.accelerations >= self.max_accelerations):
+                    return 'stop', 'cycle'
+                if self.action == 'accelerate':
+                    # Sum the reserves over one period, starting with this stage
+                    self.accelerations += 1
+                    self.averaging = (period - 1, np.array(reserves)) if period > 1 else None
+                    if self.averaging is None:
+                        # A fixed point, nothing to average
+                        return 'stop', 'cycle'
+                    return None, None
+                # Report it once, the same cycle is detected again a period later
+                self.hashes.clear()
+                self.hash_order.clear()
+
+        if self.stagnation and self._detect_stagnation(residual):
+            if not self.stagnating:
+                self.events.append((stage, 'stagnation', residual))
+            self.stagnating = True
+            if self.action == 'stop':
+                return 'stop', 'stagnation'
+        else:
+            self.stagnating = False
+        return None, None
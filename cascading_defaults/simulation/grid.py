@@ -0,0 +1,117 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from cascading_defaults.simulation.simulation import Simulation
+from cascading_defaults.simulation.strategies import DefaultStrategy
+
+
+class _Progress:
+
+    def __init__(self, total, verbose=1):
+        """
+        Counts the finished runs of all threads and prints the progress, one thread at a time.
+        """
+        self.total = total
+        self.done = 0
+        self.verbose = verbose
+        self.lock = threading.Lock()
+
+    def update(self, label):
+        with self.lock:
+            self.done += 1
+            if self.verbose:
+                # A line per run, the simulations print their own lines in between
+                print(f'runs done: {self.done:<6}/ {self.total}, last: {label}', flush=True)
+
+
+class SimulationGrid:
+
+    def __init__(self, strategies, L, parameters=None, label_of_network='random_network', force_update_L=False):
+        """
+        A grid of simulations, every strategy for every set of parameters, run by a pool of threads in one process.
+        The prepared L (one per L_needed) and the plans are shared read-only by all the simulations, every simulation
+        has its own payments, reserves and histories. The memory of L thus doesn't grow with the number of threads.
+        The kernels release the GIL (the NumPy ones in the large operations), thus the threads run in parallel.
+        Inputs:
+        strategies: list of cascading_defaults.simulation.Strategy instances
+        L: scipy sparse edgelist
+        parameters: dict, label_of_run: dict of keyword arguments of Simulation (e.g. start_reserves,
+                    exogenous_cashflow, backend), default one run without label
+        """
+        self.strategies = list(strategies)
+        for strategy in self.strategies:
+            assert isinstance(strategy, DefaultStrategy), f'Strategy {strategy} is of type ' \
+                                                          f'{type(strategy)} and not of type {DefaultStrategy}.'
+        self.parameters = parameters if parameters is not None else {None: {}}
+        self.transaction_network = label_of_network
+
+        # Load right L (once per L_needed) and the plans (once per kind of plan), shared by all the threads
+        self.Ls = {}
+        self.plans = {}
+        for strategy in self.strategies:
+            L_needed = strategy.L_needed()
+            if L_needed not in self.Ls:
+                self.Ls[L_needed] = strategy.select_right_L(L, label_of_network, force_update_L).tocsr()
+            if (strategy.plan_class, L_needed) not in self.plans:
+                self.plans[(strategy.plan_class, L_needed)] = strategy.plan(self.Ls[L_needed])
+
+        self.simulations = {}
+        self.has_run = False
+
+    def setup(self):
+        """
+        Returns the simulations of the grid by (strategy label, label_of_run). These are set up in this thread, as
+        scipy can sort the indices of the shared L in place.
+        """
+        simulations = {}
+        for strategy in self.strategies:
+            L_needed = strategy.L_needed()
+            for label_of_run, kwargs in self.parameters.items():
+                # The shared plan is of L without exogenous outflows, runs with outflows get their own (cached) plan
+                plan = self.plans[(strategy.plan_class, L_needed)] if kwargs.get('exogenous_outflow') is None else None
+                simulations[(strategy.label, label_of_run)] = Simulation(
+                    strategy, self.Ls[L_needed], label_of_run=label_of_run, label_of_network=self.transaction_network,
+                    L_is_prepared=True, plan=plan, **kwargs
+                )
+        return simulations
+
+    def run(self, threads=None, rtol=5e-2, max_iter=None, save=False, verbose=1):
+        """
+        Runs all simulations of the grid on threads threads (default all cores). The results are stored in
+        self.simulations and summarised in self.results (pd.DataFrame, one row per simulation).
+        """
+        print(f'Running {len(self.strategies)} strategies x {len(self.parameters)} parameters.')
+        self.simulations = self.setup()
+        progress = _Progress(len(self.simulations), verbose=verbose)
+
+        def run_simulation(key):
+            simulation = self.simulations[key]
+            simulation.run(rtol=rtol, max_iter=max_iter, save=save, verbose=0)
+            progress.update(simulation.label)
+            return key
+
+        with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as pool:
+            futures = [pool.submit(run_simulation, key) for key in self.simulations]
+            for future in as_completed(futures):
+                future.result()
+
+        self.results = pd.DataFrame([
+            {
+                'strategy': strategy_label,
+                'label_of_run': label_of_run,
+                'defaults': len(simulation.defaulted_nodes),
+                'stages': len(simulation.size_p),
+                'size_p': simulation.size_p[-1] if len(simulation.size_p) else np.nan,
+                'size_p_relative': simulation.size_p_relative[-1] if len(simulation.size_p_relative) else np.nan
+            }
+            for (strategy_label, label_of_run), simulation in self.simulations.items()
+        ]).set_index(['strategy', 'label_of_run'])
+        self.has_run = True
+
+        print('Done with the grid.')
+
+        return self
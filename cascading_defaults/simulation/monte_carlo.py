@@ -0,0 +1,147 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+from cascading_defaults.simulation.batch import clear_batch
+from cascading_defaults.simulation.strategies import DefaultStrategy
+
+# Shared with the worker processes (set once per worker, not pickled per batch)
+_worker_state = {}
+
+
+def _init_worker(strategy, L, reserves_distribution, exogenous_distribution, seed, rtol, max_iter,
+                 exogenous_outflow=None):
+    _worker_state.update(strategy=strategy, L=L, reserves_distribution=reserves_distribution,
+                         exogenous_distribution=exogenous_distribution, seed=seed, rtol=rtol, max_iter=max_iter,
+                         exogenous_outflow=exogenous_outflow)
+
+
+def draw(distribution, rng, N):
+    """
+    Draws an np.array with shape (N,) from a distribution, which can be:
+    float or np.array: a constant
+    tuple (name, kwargs): a method of np.random.Generator, e.g. ('lognormal', {'mean': 0, 'sigma': 1})
+    callable: distribution(rng, N)
+    """
+    if callable(distribution):
+        return np.asarray(distribution(rng, N), dtype=np.float64)
+    if isinstance(distribution, tuple):
+        name, kwargs = distribution
+        return getattr(rng, name)(size=N, **kwargs).astype(np.float64)
+    return np.broadcast_to(np.asarray(distribution, dtype=np.float64), (N,))
+
+
+def scenario_rng(seed, scenario):
+    """
+    The random number generator of a scenario, independent of how the scenarios are batched.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(scenario,)))
+
+
+def _run_scenarios(scenarios):
+    """
+    Runs a batch of scenarios and reduces them to their statistics.
+    """
+    state = _worker_state
+    N = state['L'].shape[0]
+    B = len(scenarios)
+    reserves = np.empty((N, B))
+    exogenous_cashflows = np.empty((N, B))
+    for b, scenario in enumerate(scenarios):
+        rng = scenario_rng(state['seed'], scenario)
+        reserves[:, b] = draw(state['reserves_distribution'], rng, N)
+        exogenous_cashflows[:, b] = draw(state['exogenous_distribution'], rng, N)
+    results = clear_batch(state['strategy'], state['L'], reserves, exogenous_cashflows=exogenous_cashflows,
+                          rtol=state['rtol'], max_iter=state['max_iter'], exogenous_outflows=state['exogenous_outflow'])
+    defaulted = results['default_stage'] > 0
+    size_p_relative = results['size_p'] / results['total_flow']
+    return scenarios, defaulted.sum(axis=0), defaulted.sum(axis=1), size_p_relative, results['stages']
+
+
+class MonteCarlo:
+
+    def __init__(self, strategy, L, reserves_distribution=0., exogenous_distribution=0.,
+                 label_of_network='random_network', force_update_L=False, exogenous_outflow=None):
+        """
+        Monte Carlo over the start reserves and exogenous cashflows of the simulation. Only the statistics of the
+        scenarios are kept, not the runs themselves.
+        Inputs:
+        strategy: cascading_defaults.simulation.Strategy instance
+        L: scipy sparse edgelist
+        reserves_distribution: distribution of the start reserves (see draw)
+        exogenous_distribution: distribution of the exogenous cashflows (see draw), only used with has_exogenous
+        exogenous_outflow: np.array with shape (1,N), what the nodes owe the outside world (see Simulation)
+        """
+        assert isinstance(strategy, DefaultStrategy), f'Strategy {strategy} is of type ' \
+                                                      f'{type(strategy)} and not of type {DefaultStrategy}.'
+        self.strategy = strategy
+        self.label = f'MonteCarlo_{self.strategy.label}'
+        self.transaction_network = label_of_network
+
+        # Load right L (once, for all the scenarios)
+        self.L = self.strategy.select_right_L(L, label_of_network, force_update_L).tocsr()
+        self.N = self.L.shape[0]
+
+        self.reserves_distribution = reserves_distribution
+        self.exogenous_distribution = exogenous_distribution
+        self.exogenous_outflow = exogenous_outflow
+
+        self.has_run = False
+
+    def run(self, n_scenarios=1000, batch_size=64, processes=1, seed=0, rtol=5e-2, max_iter=None, verbose=1):
+        """
+        Runs n_scenarios scenarios in batches of batch_size, on processes cores (None is all).
+        Scenario i always draws from the same random stream, whatever the batching.
+        """
+        verboseprint = print if verbose else lambda *a, **k: None
+        print(f'Running {self.label}.')
+
+        self.n_scenarios = n_scenarios
+        self.seed = seed
+
+        # The statistics
+        self.default_count_histogram = np.zeros(self.N+1, dtype=np.int64)
+        self.default_counts_per_node = np.zeros(self.N, dtype=np.int64)
+        self.size_p_relative = np.zeros(n_scenarios)
+        self.stages = np.zeros(n_scenarios, dtype=np.int32)
+
+        batches = [np.arange(i, min(i+batch_size, n_scenarios)) for i in range(0, n_scenarios, batch_size)]
+        processes = processes or os.cpu_count()
+        initargs = (self.strategy, self.L, self.reserves_distribution, self.exogenous_distribution, seed, rtol,
+                    max_iter, self.exogenous_outflow)
+
+        done = 0
+        if processes == 1 or len(batches) <= 1:
+            _init_worker(*initargs)
+            outputs = map(_run_scenarios, batches)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=initargs)
+            outputs = pool.imap_unordered(_run_scenarios, batches)
+        try:
+            for scenarios, default_counts, defaults_per_node, size_p_relative, stages in outputs:
+                self.default_count_histogram += np.bincount(default_counts, minlength=self.N+1)
+                self.default_counts_per_node += defaults_per_node
+                self.size_p_relative[scenarios] = size_p_relative
+                self.stages[scenarios] = stages
+                done += len(scenarios)
+                verboseprint(f'\rscenarios done: {done:<8}/ {n_scenarios}', end='')
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        verboseprint('')
+
+        self.default_probability = self.default_counts_per_node / n_scenarios
+        self.has_run = True
+
+        print(f'Done with {self.label}.')
+
+        return self
+
+    def quantiles(self, q=(0.01, 0.05, 0.5, 0.95, 0.99)):
+        """
+        Quantiles of the eventual size of the economy (size_p_relative) over the scenarios.
+        """
+        return np.quantile(self.size_p_relative, q)
@@ -0,0 +1,225 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import threading
+
+import numpy as np
+
+from cascading_defaults.simulation.workspace import Workspace
+
+# Commands of the coordinator to the workers
+_STOP, _STAGE = 0, 1
+
+
+def _shared_array(shape, dtype, name=None):
+    """
+    Returns (SharedMemory, np.array on it), a new block when name is None and else the existing block name.
+    """
+    if name is None:
+        nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+        memory = shared_memory.SharedMemory(create=True, size=nbytes)
+    else:
+        # The workers share the resource tracker of the coordinator, which unlinks the block
+        memory = shared_memory.SharedMemory(name=name)
+    return memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+
+def _partition_boundaries(cumulative_counts, partitions):
+    """
+    Returns the boundaries (partitions+1 rows or columns) that split cumulative_counts (an indptr) evenly.
+    """
+    targets = np.arange(1, partitions) * (cumulative_counts[-1] / partitions)
+    inner = np.searchsorted(cumulative_counts, targets, side='left')
+    return np.concatenate([[0], np.maximum.accumulate(inner), [len(cumulative_counts)-1]]).astype(np.intp)
+
+
+class _ColumnSums:
+    """
+    Column sums of the columns start to stop, in the order (and thus with the rounding) of Workspace.column_sums.
+    """
+
+    def __init__(self, indices, start, stop):
+        positions = np.flatnonzero((indices >= start) & (indices < stop))
+        columns = indices[positions]
+        self.order = positions[np.argsort(columns, kind='stable')]
+        counts = np.bincount(columns - start, minlength=stop - start)
+        self.nonempty_columns = np.flatnonzero(counts)
+        self.column_starts = (np.cumsum(counts) - counts)[self.nonempty_columns].astype(np.intp)
+        self.edge_buffer = np.empty(len(self.order))
+        self.sums_buffer = np.empty(len(self.nonempty_columns))
+
+    def __call__(self, data, out):
+        out.fill(0.)
+        if len(self.column_starts):
+            np.take(data, self.order, out=self.edge_buffer)
+            np.add.reduceat(self.edge_buffer, self.column_starts, out=self.sums_buffer)
+            out[self.nonempty_columns] = self.sums_buffer
+        return out
+
+
+def _partition_worker(partition, strategy, plan, rows, columns, backend, names, shapes, dtypes, barrier):
+    """
+    The stages of one partition: the payments and total payments of the rows (rows), and the total receiving of the
+    columns (columns), in between the barriers of the coordinator.
+    """
+    memories, arrays = {}, {}
+    try:
+        for key, name in names.items():
+            memories[key], arrays[key] = _shared_array(shapes[key], dtypes[key], name=name)
+        buffers = [arrays['p_data_0'], arrays['p_data_1']]
+        control, rtol = arrays['control'], arrays['rtol']
+
+        start, stop = rows
+        first_edge, last_edge = int(plan.L.indptr[start]), int(plan.L.indptr[stop])
+        partition_plan = plan.partition(start, stop)
+        workspace = Workspace(partition_plan, payments=False)
+        column_sums = _ColumnSums(plan.L.indices, *columns)
+        # The payments to the outside world of the previous stage
+        previous_sink = np.empty(stop - start)
+
+        while True:
+            barrier.wait()
+            if control[0] == _STOP:
+                break
+            out = buffers[control[1]][first_edge:last_edge]
+            previous = buffers[1 - control[1]][first_edge:last_edge]
+
+            # Step 1
+            # Payments and total payments of the rows of the partition
+            sink_out = None
+            if partition_plan.outflows is not None:
+                np.copyto(previous_sink, arrays['sink_payments'][start:stop])
+                sink_out = arrays['sink_payments'][start:stop]
+            strategy.edge_payments(partition_plan, arrays['incomings'][start:stop], backend=backend, out=out,
+                                   workspace=workspace, sink_out=sink_out)
+            workspace.row_sums(out, out=arrays['total_payments'][start:stop])
+            if sink_out is not None:
+                arrays['total_payments'][start:stop] += sink_out
+            barrier.wait()
+
+            # Step 2
+            # Total receiving of the columns of the partition (all payments are written now), and whether the
+            # payments of the rows changed
+            column_sums(buffers[control[1]], out=arrays['total_receiving'][columns[0]:columns[1]])
+            converged = workspace.allclose(out, previous, rtol=rtol[0])
+            if sink_out is not None:
+                converged = converged and workspace.allclose(sink_out, previous_sink, rtol=rtol[0])
+            arrays['converged'][partition] = converged
+            barrier.wait()
+    except Exception:
+        barrier.abort()
+        raise
+    finally:
+        arrays.clear()
+        for memory in memories.values():
+            memory.close()
+
+
+class PartitionedClearing:
+
+    def __init__(self, strategy, plan, processes, backend=None, rtol=5e-2, start_method=None, verbose=1):
+        """
+        Clears the stages of one simulation over processes worker processes. Every worker computes the payments of a
+        block of rows (and to the outside world) and the receiving of a block of columns, the payments and the totals
+        (N-length vectors) are exchanged through shared memory. The results are identical to those of one process,
+        as every sum is taken in the same order.
+        Inputs:
+        strategy: cascading_defaults.simulation.Strategy instance
+        plan: StrategyPlan of the prepared L (not low-memory)
+        processes: int, number of worker processes
+        rtol: float, convergence of the payments of every edge (see Simulation.run)
+        start_method: str, of multiprocessing, default 'fork' when available (the plan is then shared copy-on-write,
+                      instead of pickled to every worker)
+        """
+        assert plan.rows is not None, 'Partitioned clearing needs a plan that is not low-memory or out-of-core.'
+        verboseprint = print if verbose else lambda *a, **k: None
+        self.plan = plan
+        N, nnz = plan.N, plan.L.nnz
+        processes = max(1, min(processes, N))
+
+        # Partitions with about the same number of edges, by rows (payments) and by columns (receiving)
+        self.row_boundaries = _partition_boundaries(plan.L.indptr, processes)
+        column_counts = np.concatenate([[0], np.cumsum(np.bincount(plan.L.indices, minlength=N))])
+        self.column_boundaries = _partition_boundaries(column_counts, processes)
+
+        shapes = {
+            'p_data_0': (nnz,), 'p_data_1': (nnz,), 'incomings': (N,), 'total_payments': (N,),
+            'total_receiving': (N,), 'sink_payments': (N,), 'converged': (processes,), 'control': (2,), 'rtol': (1,)
+        }
+        dtypes = {key: {'converged': bool, 'control': np.int64}.get(key, np.float64) for key in shapes}
+        self.memories, self.arrays = {}, {}
+        for key, shape in shapes.items():
+            self.memories[key], self.arrays[key] = _shared_array(shape, dtypes[key])
+        self.arrays['rtol'][0] = rtol
+        if plan.outflows is not None:
+            self.arrays['sink_payments'][:] = plan.outflows
+        self.buffers = [self.arrays['p_data_0'], self.arrays['p_data_1']]
+        names = {key: memory.name for key, memory in self.memories.items()}
+
+        if start_method is None and 'fork' in multiprocessing.get_all_start_methods():
+            start_method = 'fork'
+        context = multiprocessing.get_context(start_method)
+        self.barrier = context.Barrier(processes + 1)
+        verboseprint(f'Starting {processes} partitions.')
+        self.workers = [
+            context.Process(target=_partition_worker, daemon=True,
+                            args=(partition, strategy, plan,
+                                  tuple(self.row_boundaries[partition:partition+2]),
+                                  tuple(self.column_boundaries[partition:partition+2]),
+                                  backend, names, shapes, dtypes, self.barrier))
+            for partition in range(processes)
+        ]
+        for worker in self.workers:
+            worker.start()
+        self.converged = False
+
+    def _buffer_index(self, buffer):
+        for index, shared_buffer in enumerate(self.buffers):
+            if buffer is shared_buffer:
+                return index
+        raise Exception('Payments have to be written into one of the buffers of PartitionedClearing.')
+
+    def _wait(self):
+        try:
+            self.barrier.wait()
+        except threading.BrokenBarrierError:
+            self.close()
+            raise Exception('A worker of the partitioned clearing failed.')
+
+    def clear_stage(self, incomings, out, total_payments, total_receiving, sink_out=None):
+        """
+        One stage: the payments for incomings are written into out (one of buffers), the total payments and total
+        receiving into total_payments and total_receiving, and the payments to the outside world into sink_out (with
+        exogenous outflows). Sets converged, whether no payment changed.
+        """
+        control = self.arrays['control']
+        control[0], control[1] = _STAGE, self._buffer_index(out)
+        self.arrays['incomings'][:] = incomings
+        for _ in range(3):
+            self._wait()
+        total_payments[:] = self.arrays['total_payments']
+        total_receiving[:] = self.arrays['total_receiving']
+        if sink_out is not None:
+            sink_out[:] = self.arrays['sink_payments']
+        self.converged = bool(self.arrays['converged'].all())
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory, the buffers can't be used anymore.
+        """
+        if not self.memories:
+            return
+        self.arrays['control'][0] = _STOP
+        try:
+            self.barrier.wait(timeout=10)
+        except threading.BrokenBarrierError:
+            pass
+        for worker in self.workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self.buffers = []
+        self.arrays.clear()
+        for memory in self.memories.values():
+            memory.close()
+            memory.unlink()
+        self.memories = {}
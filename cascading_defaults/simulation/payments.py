@@ -0,0 +1,223 @@
+import numpy as np
+
+
+def payments_largest_creditor(plan, incomings, pay_remaining_money, out=None, workspace=None, sink_out=None):
+    """
+    Pure NumPy version of payments_largest_creditor in defaults.pyx, for one or a batch of scenarios at once.
+    Inputs:
+    plan: LargestCreditorPlan of the (row-wise sorted) prepared L
+    incomings: np.array with shape (N,), or (B,N) for B scenarios
+    pay_remaining_money: bool, pay what is left to the first creditor that can't be paid in full
+    out: np.array aligned with plan.L.data to write the payments in, (B,nnz) for B scenarios
+    workspace: Workspace of which the buffers are used, instead of allocating temporaries (one scenario only)
+    sink_out: np.array with the shape of incomings to write the payments to the outside world in (plans with
+              exogenous outflows)
+    Output: np.array aligned with plan.L.data with the payments made over every edge, (B,nnz) for B scenarios
+    """
+    L = plan.L
+    if incomings.ndim > 1:
+        workspace = None
+    if out is None:
+        out = np.empty(incomings.shape[:-1] + (L.nnz,), dtype=np.float64)
+    if plan.outflows is not None and sink_out is None:
+        sink_out = np.empty(incomings.shape)
+    if plan.row_blocks is None:
+        sink_indices = None
+        if plan.outflows is not None and workspace is not None and workspace.plan is plan:
+            # Set up at first use, these only depend on the plan
+            if workspace.sink_indices is None:
+                workspace.sink_indices = sink_index(L.indptr, plan.sink_positions)
+            sink_indices = workspace.sink_indices
+        _largest_creditor_edges(L.data, L.indptr, incomings, plan.total_payables_array, pay_remaining_money, out,
+                                workspace, cumulative_data=plan.cumulative_data, rows=plan.rows,
+                                row_start=plan.row_start, outflows=plan.outflows, sink_positions=plan.sink_positions,
+                                sink_cumulative=plan.sink_cumulative, sink_out=sink_out, sink_indices=sink_indices)
+        return out
+
+    # Out-of-core, stream through L in blocks of rows (the rows are independent)
+    for start, stop, first_edge, last_edge in plan.blocks():
+        sink = {}
+        if plan.outflows is not None:
+            sink = {'outflows': plan.outflows[start:stop],
+                    'sink_positions': plan.sink_positions[start:stop] - first_edge,
+                    'sink_out': sink_out[..., start:stop]}
+        _largest_creditor_edges(L.data[first_edge:last_edge], L.indptr[start:stop+1] - first_edge,
+                                incomings[..., start:stop], plan.total_payables_array[start:stop],
+                                pay_remaining_money, out[..., first_edge:last_edge], workspace, **sink)
+    return out
+
+
+def row_cumsum(data, indptr, out=None, outflows=None, sink_positions=None, long_row=None):
+    """
+    Cumulative sums of data within every row of indptr: the running total of the row, added in the order of the
+    edges like the compiled kernels do (thus bit-identical to their running totals, unlike differences of one
+    cumulative sum over all edges).
+    Inputs:
+    data, indptr: of a CSR-matrix
+    out: np.array with the shape of data, to write the cumulative sums in
+    outflows, sink_positions: np.arrays with shape (N,), a virtual edge of outflows before edge sink_positions in
+                              every row (see LargestCreditorPlan), which is part of the running totals after it
+    long_row: int, rows with more edges than this get a cumsum of their own, the others are summed together one
+              edge at a time (default about the square root of nnz)
+    Outputs:
+    out, and with outflows the cumulative sums up to and including the virtual edge (np.array with shape (N,))
+    """
+    N, nnz = len(indptr) - 1, len(data)
+    if out is None:
+        out = np.empty(nnz, dtype=np.float64)
+    if outflows is not None:
+        # The virtual edges as an edge of their own, the i-th row gets i extra edges before it
+        sink = sink_positions + np.arange(N)
+        is_edge = np.ones(nnz + N, dtype=bool)
+        is_edge[sink] = False
+        extended = np.empty(nnz + N, dtype=np.float64)
+        extended[sink] = outflows
+        extended[is_edge] = data
+        row_cumsum(extended, indptr + np.arange(N+1), out=extended, long_row=long_row)
+        out[...] = extended[is_edge]
+        return out, extended[sink]
+
+    np.copyto(out, data)
+    if not nnz:
+        return out
+    counts = np.diff(indptr)
+    if long_row is None:
+        long_row = max(64, int(np.sqrt(nnz)))
+    for row in np.flatnonzero(counts > long_row):
+        np.cumsum(out[indptr[row]:indptr[row+1]], out=out[indptr[row]:indptr[row+1]])
+
+    # The k-th edge of the short rows with more than k edges, the longest rows first
+    short = np.flatnonzero((counts > 1) & (counts <= long_row))
+    order = np.argsort(-counts[short], kind='stable')
+    starts, lengths = indptr[short[order]].astype(np.intp), counts[short[order]]
+    for k in range(1, int(lengths[0]) if len(lengths) else 0):
+        positions = starts[:np.searchsorted(-lengths, -k, side='left')] + k
+        out[positions] += out[positions - 1]
+    return out
+
+
+def sink_index(indptr, sink_positions):
+    """
+    The edges around the virtual edges to the outside world of every row, these only depend on the plan.
+    Outputs:
+    no_before: np.array of bools with shape (N,), the virtual edge is the first of its row
+    before: np.array with shape (N,), the edge before the virtual edge (0 when there is none)
+    after_rows, after_positions: np.arrays, the rows with an edge after the virtual edge, and that edge
+    """
+    no_before = sink_positions <= indptr[:-1]
+    before = np.maximum(sink_positions - 1, 0).astype(np.intp)
+    after_rows = np.flatnonzero(sink_positions < indptr[1:])
+    after_positions = sink_positions[after_rows].astype(np.intp)
+    return no_before, before, after_rows, after_positions
+
+
+def _largest_creditor_edges(data, indptr, incomings, total_payables, pay_remaining_money, out, workspace=None,
+                            cumulative_data=None, rows=None, row_start=None, outflows=None, sink_positions=None,
+                            sink_cumulative=None, sink_out=None, sink_indices=None):
+    """
+    The kernel of payments_largest_creditor for the rows of indptr. The arrays of the plan that are not passed are
+    computed here (low-memory and out-of-core plans). With outflows, every row has a virtual edge to the outside
+    world before edge sink_positions (of which the payments are written into sink_out). The scenarios of a batch are
+    along the first axis of incomings, out and sink_out.
+    """
+    N, nnz = len(indptr) - 1, len(data)
+    batch = incomings.shape[:-1]
+    if workspace is not None:
+        target, pays_all, payed_in_full = workspace.float_N[:N], workspace.bool_N[:N], workspace.bool_nnz[:nnz]
+        target_of_edge = workspace.float_nnz[:nnz] if rows is not None else None
+    else:
+        target, pays_all = np.empty(batch + (N,)), np.empty(batch + (N,), dtype=bool)
+        payed_in_full = np.empty(batch + (nnz,), dtype=bool)
+        target_of_edge = None
+    if outflows is not None and workspace is not None:
+        sink_payed_in_full, sink_partial, sink_before = workspace.bool_N_2[:N], workspace.bool_N_3[:N], \
+            workspace.float_N_2[:N]
+    elif outflows is not None:
+        sink_payed_in_full, sink_partial = np.empty(batch + (N,), dtype=bool), np.empty(batch + (N,), dtype=bool)
+        sink_before = np.empty(N)
+    if cumulative_data is None:
+        cumulative_data = workspace.float_nnz_2[:nnz] if workspace is not None else None
+        if outflows is not None:
+            cumulative_data, sink_cumulative = row_cumsum(data, indptr, out=cumulative_data, outflows=outflows,
+                                                          sink_positions=sink_positions)
+        else:
+            cumulative_data = row_cumsum(data, indptr, out=cumulative_data)
+    if outflows is not None and sink_indices is None:
+        sink_indices = sink_index(indptr, sink_positions)
+
+    # Step 1
+    # Companies that can pay all their creditors
+    np.greater_equal(incomings, total_payables, out=pays_all)
+
+    # Step 2
+    # For the others, an edge is paid in full as long as the running total of the row stays below the incoming cash
+    np.copyto(target, incomings)
+    np.copyto(target, np.inf, where=pays_all)
+    if rows is not None:
+        target_of_edge = np.take(target, rows, axis=-1, out=target_of_edge)
+    else:
+        target_of_edge = np.repeat(target, np.diff(indptr), axis=-1)
+    np.less(cumulative_data, target_of_edge, out=payed_in_full)
+    np.multiply(data, payed_in_full, out=out)
+    if outflows is not None:
+        np.less(sink_cumulative, target, out=sink_payed_in_full)
+        np.multiply(outflows, sink_payed_in_full, out=sink_out)
+
+    # Step 3
+    # The first edge of a row that is not paid in full gets what is left: incoming - the running total before it
+    if pay_remaining_money and outflows is not None:
+        # The sink node when the edge before it (if any) is paid in full
+        no_before, before = sink_indices[:2]
+        if nnz:
+            np.take(payed_in_full, before, axis=-1, out=sink_partial)
+            np.logical_or(sink_partial, no_before, out=sink_partial)
+            np.take(cumulative_data, before, out=sink_before)
+            np.copyto(sink_before, 0., where=no_before)
+        else:
+            sink_partial.fill(True)
+            sink_before.fill(0.)
+        np.greater(sink_partial, sink_payed_in_full, out=sink_partial)
+        np.subtract(incomings, sink_before, out=target)
+        np.copyto(sink_out, target, where=sink_partial)
+    if pay_remaining_money and nnz:
+        partial = workspace.bool_nnz_2[:nnz] if workspace is not None else np.empty(batch + (nnz,), dtype=bool)
+        partial[..., 0] = True
+        partial[..., 1:] = payed_in_full[..., :-1]
+        if row_start is not None:
+            np.logical_or(partial, row_start, out=partial)
+        else:
+            # The starts of the empty rows are those of the next row (or nnz)
+            partial[..., indptr[:np.searchsorted(indptr, nnz)]] = True
+        if outflows is not None:
+            # The edge after the sink node follows the sink node
+            after_rows, after_positions = sink_indices[2:]
+            if workspace is not None:
+                partial[after_positions] = np.take(sink_payed_in_full, after_rows,
+                                                   out=workspace.bool_N_3[:len(after_rows)])
+            else:
+                partial[..., after_positions] = sink_payed_in_full[..., after_rows]
+        np.greater(partial, payed_in_full, out=partial)  # partial and not payed_in_full
+
+        if workspace is not None and rows is not None and row_start is not None:
+            # Over all edges, in the buffers: target_of_edge is the incoming cash of the row of the partial edges,
+            # minus the running total before the edge when it's not the first of its row (or after the sink node)
+            np.greater(partial, row_start, out=payed_in_full)
+            np.subtract(target_of_edge[1:], cumulative_data[:-1], out=target_of_edge[1:], where=payed_in_full[1:])
+            if outflows is not None:
+                remaining, sink_totals = workspace.float_N_2[:len(after_rows)], workspace.float_N_3[:len(after_rows)]
+                np.take(incomings, after_rows, out=remaining)
+                np.subtract(remaining, np.take(sink_cumulative, after_rows, out=sink_totals), out=remaining)
+                target_of_edge[after_positions] = remaining
+            np.copyto(out, target_of_edge, where=partial)
+            return out
+
+        # At most one edge per row (and scenario)
+        where = np.nonzero(partial)
+        edges = where[-1]
+        edge_rows = rows[edges] if rows is not None else np.searchsorted(indptr, edges, side='right') - 1
+        before = np.where(edges > indptr[edge_rows], cumulative_data[np.maximum(edges - 1, 0)], 0.)
+        if outflows is not None:
+            before = np.where(edges == sink_positions[edge_rows], sink_cumulative[edge_rows], before)
+        out[where] = incomings[where[:-1] + (edge_rows,)] - before
+
+    return out
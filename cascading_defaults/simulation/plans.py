@@ -0,0 +1,313 @@
+import numpy as np
+from scipy import sparse
+
+from .payments import row_cumsum
+from ..utils import row_blocks
+
+
+class StrategyPlan:
+
+    def __init__(self, L, total_payables_array=None, total_receivables_array=None, low_memory=False,
+                 block_size=None, exogenous_outflows=None, **precomputed):
+        """
+        Everything a strategy precomputes for one prepared L. A plan is immutable, thus one strategy object can
+        drive many simulations (and networks) with it.
+        Inputs:
+        L: scipy sparse CSR matrix, as returned by strategy.select_right_L
+        total_payables_array, total_receivables_array: np.arrays with shape (N,), of the edges of L, computed when not
+                                                       passed
+        exogenous_outflows: np.array with shape (N,), what every node owes the outside world (a virtual sink node
+                            that is not part of L), None is nothing. These are part of the total payables
+        low_memory: bool, keep no arrays of size nnz besides L itself (these are recomputed when needed)
+        block_size: int, out-of-core: the kernels stream through L (e.g. memory-mapped) in blocks of rows with about
+                    block_size edges, with scratch of the size of a block only. Implies low_memory
+        precomputed: structure of the strategy that is already known
+        """
+        self.L = sparse.csr_matrix(L)
+        self.N = self.L.shape[0]
+        self.low_memory = low_memory or block_size is not None
+
+        # Blocks of rows (boundaries), None is one block
+        self.row_blocks = None if block_size is None else row_blocks(self.L.indptr, block_size)
+        if self.row_blocks is None:
+            self.max_block_nnz = self.L.nnz
+        else:
+            self.max_block_nnz = int(np.diff(self.L.indptr[self.row_blocks]).max(initial=0))
+
+        # The row (debtor) of every edge, or only the number of edges per row
+        self.row_counts = np.diff(self.L.indptr).astype(np.intp)
+        self.rows = None if self.low_memory else np.repeat(np.arange(self.N, dtype=np.intp), self.row_counts)
+
+        if total_payables_array is None:
+            total_payables_array = np.array(self.L.sum(axis=1)).flatten()
+        if total_receivables_array is None:
+            total_receivables_array = np.array(self.L.sum(axis=0)).flatten()
+        self.total_payables_array = np.array(total_payables_array, dtype=np.float64)
+        self.total_receivables_array = np.array(total_receivables_array, dtype=np.float64)
+
+        # The virtual sink node
+        self.outflows = None
+        if exogenous_outflows is not None:
+            self.outflows = np.array(exogenous_outflows, dtype=np.float64).flatten()
+            assert self.outflows.shape == (self.N,), f'exogenous_outflows has shape {self.outflows.shape}, not ' \
+                                                     f'({self.N},).'
+            self.total_payables_array += self.outflows
+
+        self.fingerprint = None
+
+    @classmethod
+    def estimate_nbytes(cls, N, nnz, index_itemsize=4, low_memory=False):
+        """
+        Returns the (approximate) number of bytes of a plan, without L.
+        """
+        return 3*N*8 + (0 if low_memory else nnz*8)
+
+    def edge_values(self, values, out=None):
+        """
+        Returns values (np.array with shape (N,)) of the rows, for every edge, in out when given.
+        Low-memory plans have no rows, there a new array is returned (and out is not used).
+        """
+        if self.rows is not None:
+            return np.take(values, self.rows, out=out)
+        return np.repeat(values, self.row_counts)
+
+    def blocks(self):
+        """
+        Yields (first row, last row + 1, first edge, last edge + 1) of every block of rows.
+        """
+        if self.row_blocks is None:
+            yield 0, self.N, 0, self.L.nnz
+            return
+        indptr = self.L.indptr
+        for start, stop in zip(self.row_blocks[:-1], self.row_blocks[1:]):
+            yield start, stop, int(indptr[start]), int(indptr[stop])
+
+    def partition(self, start, stop):
+        """
+        Returns the plan of the rows start to stop, of which the arrays are views on the arrays of this plan (thus the
+        kernels give exactly the same payments for these rows). Used by the partitioned clearing.
+        """
+        first_edge, last_edge = int(self.L.indptr[start]), int(self.L.indptr[stop])
+        plan = object.__new__(type(self))
+        # Past __setattr__, the partition isn't frozen
+        attributes = plan.__dict__
+        attributes.update(self.__dict__)
+        attributes.pop('_frozen', None)
+        attributes.update(
+            L=self._partition_matrix(self.L, start, stop),
+            N=stop - start,
+            row_counts=self.row_counts[start:stop],
+            rows=None if self.rows is None else self.rows[first_edge:last_edge] - start,
+            total_payables_array=self.total_payables_array[start:stop],
+            outflows=None if self.outflows is None else self.outflows[start:stop],
+            row_blocks=None,
+            max_block_nnz=last_edge - first_edge,
+            fingerprint=None
+        )
+        self._partition(attributes, start, stop, first_edge, last_edge)
+        return plan
+
+    def _partition(self, attributes, start, stop, first_edge, last_edge):
+        pass
+
+    def patch(self, L, splice, total_receivables_array=None):
+        """
+        Returns the plan of L, which differs from the L of this plan in the rows splice.rows only (see SnapshotSeries).
+        The arrays of the other rows are copied, those of the changed rows come from a plan of these rows only, thus
+        besides copying this takes time proportional to the changed edges.
+        Inputs:
+        L: scipy sparse CSR matrix, the L of this plan with the rows spliced
+        splice: RowSplice from the L of this plan to L
+        total_receivables_array: np.array with shape (N,), of L, computed when not passed
+        """
+        assert self.row_blocks is None, 'Out-of-core plans can\'t be patched, compile a new one instead.'
+        rows = splice.rows
+        changed = sparse.csr_matrix((L.data[splice.positions], L.indices[splice.positions], splice.offsets),
+                                    shape=(len(rows), L.shape[1]))
+        sub = type(self)(changed, total_receivables_array=np.zeros(L.shape[1]), low_memory=self.low_memory,
+                         exogenous_outflows=None if self.outflows is None else self.outflows[rows],
+                         **self._patch_arguments())
+
+        plan = object.__new__(type(self))
+        # Past __setattr__, frozen at the end like this plan
+        attributes = plan.__dict__
+        attributes.update(self.__dict__)
+        attributes.pop('_frozen', None)
+        row_counts = np.array(self.row_counts)
+        row_counts[rows] = sub.row_counts
+        total_payables_array = np.array(self.total_payables_array)
+        total_payables_array[rows] = sub.total_payables_array
+        if total_receivables_array is None:
+            total_receivables_array = np.array(L.sum(axis=0)).flatten()
+        attributes.update(
+            L=sparse.csr_matrix(L),
+            max_block_nnz=L.nnz,
+            row_counts=row_counts,
+            rows=None if self.rows is None else splice.splice(self.rows, rows[sub.rows]),
+            total_payables_array=total_payables_array,
+            total_receivables_array=np.array(total_receivables_array, dtype=np.float64),
+            fingerprint=None
+        )
+        self._patch(attributes, sub, splice)
+        return plan.freeze() if getattr(self, '_frozen', False) else plan
+
+    def _patch_arguments(self):
+        # The keyword arguments of the plan of the changed rows
+        return {}
+
+    def _patch(self, attributes, sub, splice):
+        pass
+
+    @staticmethod
+    def _partition_matrix(matrix, start, stop):
+        first_edge, last_edge = int(matrix.indptr[start]), int(matrix.indptr[stop])
+        return sparse.csr_matrix((matrix.data[first_edge:last_edge], matrix.indices[first_edge:last_edge],
+                                  matrix.indptr[start:stop+1] - first_edge), shape=(stop - start, matrix.shape[1]),
+                                 copy=False)
+
+    def freeze(self):
+        """
+        Makes the arrays of the plan read-only, after which no attributes can be set.
+        The sparse matrices are left writeable, as scipy sorts their indices in place when needed.
+        """
+        for value in self.__dict__.values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+        self._frozen = True
+        return self
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError(f'{type(self).__name__} is immutable, can\'t set {name}.')
+        super().__setattr__(name, value)
+
+
+class EisenbergNoePlan(StrategyPlan):
+
+    def __init__(self, L, total_payables_array=None, total_receivables_array=None, relative_liabilities_data=None,
+                 low_memory=False, block_size=None, exogenous_outflows=None, **precomputed):
+        super().__init__(L, total_payables_array, total_receivables_array, low_memory=low_memory,
+                         block_size=block_size, exogenous_outflows=exogenous_outflows)
+
+        # 1/p_i-bar, the liabilities normalised per debtor are L.data * multiplier of the row
+        self.multiplier = np.divide(1., self.total_payables_array, out=np.zeros_like(self.total_payables_array),
+                                    where=self.total_payables_array != 0)
+        if self.low_memory:
+            self.relative_liabilities_matrix = self.relative_liabilities_transposed = None
+            return
+
+        # The liabilities normalised per debtor, with the sparsity structure of L
+        if relative_liabilities_data is None:
+            relative_liabilities_data = self.L.data * self.multiplier[self.rows]
+        self.relative_liabilities_matrix = sparse.csr_matrix(
+            (np.array(relative_liabilities_data, dtype=np.float64), self.L.indices.copy(), self.L.indptr.copy()),
+            shape=self.L.shape
+        )
+
+        # For the receiving side, (column) sums of the payments
+        self.relative_liabilities_transposed = self.relative_liabilities_matrix.T.tocsr()
+
+    def _partition(self, attributes, start, stop, first_edge, last_edge):
+        attributes['multiplier'] = self.multiplier[start:stop]
+        if self.relative_liabilities_matrix is not None:
+            attributes['relative_liabilities_matrix'] = self._partition_matrix(self.relative_liabilities_matrix,
+                                                                               start, stop)
+        attributes['relative_liabilities_transposed'] = None
+
+    def _patch(self, attributes, sub, splice):
+        multiplier = np.array(self.multiplier)
+        multiplier[splice.rows] = sub.multiplier
+        attributes['multiplier'] = multiplier
+        if self.relative_liabilities_matrix is not None:
+            L = attributes['L']
+            attributes['relative_liabilities_matrix'] = sparse.csr_matrix(
+                (splice.splice(self.relative_liabilities_matrix.data, sub.relative_liabilities_matrix.data),
+                 L.indices.copy(), L.indptr.copy()), shape=L.shape)
+        # The transpose would be rebuilt as a whole, the batches use L.T instead (see EisenbergNoe.batch_payments)
+        attributes['relative_liabilities_transposed'] = None
+
+    @classmethod
+    def estimate_nbytes(cls, N, nnz, index_itemsize=4, low_memory=False):
+        nbytes = super().estimate_nbytes(N, nnz, index_itemsize, low_memory) + N*8
+        if not low_memory:
+            # The relative liabilities and their transpose
+            nbytes += 2*(nnz*(8+index_itemsize) + (N+1)*index_itemsize)
+        return nbytes
+
+
+class LargestCreditorPlan(StrategyPlan):
+
+    def __init__(self, L, total_payables_array=None, total_receivables_array=None, low_memory=False,
+                 block_size=None, exogenous_outflows=None, descending=True, **precomputed):
+        """
+        descending: bool, the rows of L are sorted descending (else ascending), for the place of the virtual sink
+                    node in the rows
+        """
+        super().__init__(L, total_payables_array, total_receivables_array, low_memory=low_memory,
+                         block_size=block_size, exogenous_outflows=exogenous_outflows)
+        self.descending = descending
+
+        # The obligation to the outside world is paid in the order of the row as well: sink_positions is the edge
+        # before which it comes (ties first, as if it was node 0 of the row)
+        self.sink_positions = self.sink_cumulative = None
+        if self.outflows is not None:
+            self.sink_positions = np.empty(self.N, dtype=np.int64)
+            for start, stop, first_edge, last_edge in self.blocks():
+                rows = np.repeat(np.arange(stop - start), self.row_counts[start:stop])
+                data, outflows = self.L.data[first_edge:last_edge], self.outflows[start:stop]
+                before = data > outflows[rows] if descending else data < outflows[rows]
+                self.sink_positions[start:stop] = self.L.indptr[start:stop] + np.bincount(rows, weights=before,
+                                                                                          minlength=stop-start)
+
+        if self.low_memory:
+            # Recomputed by the NumPy kernel when needed (the compiled kernels loop over the rows instead)
+            self.cumulative_data = self.row_start = None
+            return
+
+        # The running totals of the (row-wise sorted) payables within every row, with the obligation to the outside
+        # world in the running totals after it
+        if self.outflows is not None:
+            self.cumulative_data, self.sink_cumulative = row_cumsum(self.L.data, self.L.indptr, outflows=self.outflows,
+                                                                    sink_positions=self.sink_positions)
+        else:
+            self.cumulative_data = row_cumsum(self.L.data, self.L.indptr)
+
+        # Whether an edge is the first of its row
+        self.row_start = np.zeros(self.L.nnz, dtype=bool)
+        self.row_start[self.L.indptr[:-1][self.row_counts > 0]] = True
+
+    def _partition(self, attributes, start, stop, first_edge, last_edge):
+        if self.sink_positions is not None:
+            attributes['sink_positions'] = self.sink_positions[start:stop] - first_edge
+        if self.cumulative_data is None:
+            return
+        if self.sink_cumulative is not None:
+            attributes['sink_cumulative'] = self.sink_cumulative[start:stop]
+        attributes['cumulative_data'] = self.cumulative_data[first_edge:last_edge]
+        attributes['row_start'] = self.row_start[first_edge:last_edge]
+
+    def _patch_arguments(self):
+        return {'descending': self.descending}
+
+    def _patch(self, attributes, sub, splice):
+        rows = splice.rows
+        if self.sink_positions is not None:
+            # The rows that didn't change moved with their first edge
+            sink_positions = self.sink_positions + (splice.indptr[:-1] - splice.old_indptr[:-1])
+            sink_positions[rows] = sub.sink_positions - splice.offsets[:-1] + splice.indptr[rows]
+            attributes['sink_positions'] = sink_positions
+        if self.sink_cumulative is not None:
+            sink_cumulative = np.array(self.sink_cumulative)
+            sink_cumulative[rows] = sub.sink_cumulative
+            attributes['sink_cumulative'] = sink_cumulative
+        if self.cumulative_data is not None:
+            attributes['cumulative_data'] = splice.splice(self.cumulative_data, sub.cumulative_data)
+            attributes['row_start'] = splice.splice(self.row_start, sub.row_start)
+
+    @classmethod
+    def estimate_nbytes(cls, N, nnz, index_itemsize=4, low_memory=False):
+        nbytes = super().estimate_nbytes(N, nnz, index_itemsize, low_memory) + N*8
+        if not low_memory:
+            # cumulative_data and row_start
+            nbytes += nnz*9
+        return nbytes
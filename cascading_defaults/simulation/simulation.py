@@ -1,29 +1,79 @@
+import os
+
 import numpy as np
+from scipy import sparse
 
-from cascading_defaults.simulation.strategies import DefaultStrategy
-from cascading_defaults.utils import save_contents, load_contents
+from cascading_defaults.simulation.cache import result_cache
+from cascading_defaults.simulation.catalog import catalog, catalog_row
+from cascading_defaults.simulation.partitioned import PartitionedClearing
+from cascading_defaults.simulation.strategies import DefaultStrategy, EisenbergNoe
+from cascading_defaults.simulation.workspace import Workspace
+from cascading_defaults.utils import save_contents, load_contents, nbytes, format_bytes, background_saver
 from .. import plt  # This plt has nice settings :)
 
 DTYPE = np.float64
 
+
+class StageView:
+    __slots__ = ('stage', 'new_defaults', 'n_defaulted', 'sum_payments', 'sum_reserves', 'sum_payed_to_exogenous',
+                 'size_p', 'size_p_relative', 'residual', 'converged')
+
+    def __init__(self, **values):
+        """
+        Read-only summary of a stage of a simulation (see Simulation.iter_stages).
+        stage: int
+        new_defaults: np.array (read-only), the nodes that defaulted in this stage
+        n_defaulted: int, the number of nodes that defaulted up to and including this stage
+        sum_payments, sum_reserves, sum_payed_to_exogenous: float, the totals over all nodes
+        size_p, size_p_relative: float, the total payments over all edges, and relative to the total flow
+        residual: float, the largest change of the total payments of a node since the previous stage
+        converged: bool, the payments didn't change anymore (within rtol)
+        """
+        for name, value in values.items():
+            if isinstance(value, np.ndarray):
+                value = value.view()
+                value.flags.writeable = False
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is read-only, can\'t set {name}.')
+
+    def __repr__(self):
+        return (f'StageView(stage={self.stage}, new defaults={len(self.new_defaults)}, '
+                f'defaulted={self.n_defaulted}, size_p={self.size_p:1.2e}, residual={self.residual:1.2e})')
+
+
 class Simulation:
     available_strategies = ['EisenbergNoe', 'LargestCreditorLast', 'LargestCreditorFirst', 'LargestCreditorLastX',
                             'LargestCreditorFirstX', 'RobinHood', 'RobinHoodX', 'BlackHole', 'BlackHoleX']
         
     def __init__(self, strategy, L, label_of_run=None, exogenous_cashflow=np.zeros(0), start_reserves=0,
-                 label_of_network='random_network', force_update_L=False):
+                 label_of_network='random_network', force_update_L=False, L_is_prepared=False, plan=None,
+                 backend=None, low_memory=False, memory_budget=None, out_of_core=False, block_size=2**20,
+                 exogenous_outflow=None):
         """
         Inputs:
         strategy: cascading_defaults.simulation.Strategy instance
         L: scipy sparse edgelist
         label: str, label for the simulation
         start_reserves: np.array with shape = (1,N) or float
-        exogenous_cashflow: np.array with shape (1,N)
+        exogenous_cashflow: np.array with shape (1,N), what the nodes receive from the outside world (has_exogenous),
+                            downscaled to the total exogenous_outflow (unscaled without outflows)
+        exogenous_outflow: np.array with shape (1,N), what the nodes owe the outside world (has_exogenous). The outside
+                           world is a virtual sink node: it's not part of L, the kernels pay it like a creditor
+        L_is_prepared: bool, L is already processed for the strategy (skips select_right_L)
+        plan: StrategyPlan for L, default strategy.plan(L)
+        backend: str, name of the backend of the payment kernels (see backends.py), default the one of the strategy
+        low_memory: bool, keep only what the strategy needs: one payments array of size nnz, no precomputed arrays of
+                    size nnz in the plan, and convergence checked on the total payments and receiving of every node
+        memory_budget: int, bytes, switches to low_memory when the estimated footprint exceeds it (see estimate_memory)
+        out_of_core: bool, L (and the payments) are memory-mapped from disk and the kernels stream through them in
+                     blocks of rows of about block_size edges, for networks that don't fit in memory. Implies low_memory
         """
         self.transaction_network = label_of_network
 
         # For saving
-        self.skip_at_save = []
+        self.skip_at_save = ['plan', 'workspace']
         self.skip_at_load = []
         
         assert isinstance(strategy, DefaultStrategy), f'Strategy {strategy} is of type ' \
@@ -31,6 +81,7 @@ class Simulation:
         
         # Creditors payment strategy
         self.strategy = strategy
+        self.backend = backend
         
         # Set label
         self.label_of_run = label_of_run
@@ -40,10 +91,23 @@ class Simulation:
         print(f'Setting up Simulation for {self.label}.')
         
         # Load right L
-        self.L = self.strategy.select_right_L(L, label_of_network, force_update_L)
+        if L_is_prepared:
+            self.L = L
+        else:
+            self.L = self.strategy.select_right_L(L, label_of_network, force_update_L, mmap=out_of_core)
         
         self.N = self.L.shape[0]
-        self.all_internal_nodes = np.array(list(set(np.array(self.L.nonzero()).flatten())))
+        
+        # Memory
+        self.out_of_core = out_of_core
+        self.block_size = block_size if out_of_core else None
+        self.low_memory = low_memory or out_of_core
+        self.memory_budget = memory_budget
+        self.memory_peaks = {}
+        if memory_budget is not None:
+            self._apply_memory_budget()
+        
+        self.workspace = None
 
         # Relative liabilities matrix
         self.relative_liabilities_matrix = None
@@ -57,21 +121,45 @@ class Simulation:
         else:
             self.reserves = np.full(self.N, start_reserves)
         
-        # Find p_i-bar (Equation (1) in Eisenberg and Noe [1])
-        self.total_payables_vector = self.L.sum(axis=1)
-        self.total_payables_array = np.array(self.total_payables_vector).flatten()
-        
-        # Total receivable cash
-        self.total_receivables_vector = self.L.sum(axis=0)
-        self.total_receivables_array = np.array(self.total_receivables_vector).flatten()
-        
-        # Exogenous
-        if not self.strategy.has_exogenous:
-            self.exogenous_cashflows = np.zeros(self.N)
+        # Exogenous: what the nodes owe to and receive from the outside world, as N-length vectors
+        self.exogenous_outflows = None
+        self.exogenous_cashflows = np.zeros(self.N)
+        if self.strategy.has_exogenous:
+            self.exogenous_outflows = np.zeros(self.N) if exogenous_outflow is None else \
+                np.array(exogenous_outflow, dtype=DTYPE).flatten()
+            exogenous_cashflow = np.array(exogenous_cashflow, dtype=DTYPE).flatten()
+            if exogenous_cashflow.sum() > 0:
+                # Downscaled to equal everything payed to exo. Without outflows these come in unscaled, and only once:
+                # every stage they follow what is payed to exo (see the stages)
+                self.exogenous_cashflows = exogenous_cashflow
+                if self.exogenous_outflows.sum() > 0:
+                    self.exogenous_cashflows = exogenous_cashflow * (self.exogenous_outflows.sum()/
+                                                                     exogenous_cashflow.sum())
+        
+        # Everything the strategy precomputes for L (and the exogenous outflows)
+        self.plan = plan if plan is not None else self.strategy.plan(self.L, low_memory=self.low_memory,
+                                                                     block_size=self.block_size,
+                                                                     exogenous_outflows=self.exogenous_outflows)
+        if self.exogenous_outflows is not None and self.exogenous_outflows.any():
+            assert self.plan.outflows is not None and np.array_equal(self.plan.outflows, self.exogenous_outflows), \
+                'The plan is not of these exogenous outflows.'
+        
+        # Find p_i-bar (Equation (1) in Eisenberg and Noe [1]), and the total receivable cash. A plan that is passed
+        # has these already (e.g. patched by SnapshotSeries), without a pass over the edges
+        if plan is not None:
+            self.total_payables_array = np.array(self.plan.total_payables_array)
+            if self.exogenous_outflows is not None and self.plan.outflows is None:
+                self.total_payables_array += self.exogenous_outflows
+            self.total_receivables_array = np.array(self.plan.total_receivables_array)
         else:
-            sum_payed_to_exogenous = self.total_receivables_array[0]
-            # Downscaled to equal everything payed to exo
-            self.exogenous_cashflows = exogenous_cashflow * (sum_payed_to_exogenous/exogenous_cashflow.sum())
+            self.total_payables_array = np.array(self.L.sum(axis=1)).flatten()
+            if self.exogenous_outflows is not None:
+                self.total_payables_array += self.exogenous_outflows
+            self.total_receivables_array = np.array(self.L.sum(axis=0)).flatten()
+        
+        # Nodes with an obligation (payables are positive), without a pass over the edges
+        self.all_internal_nodes = np.flatnonzero((self.total_payables_array != 0) |
+                                                 (self.total_receivables_array != 0))
         
         # Total equity of the firm is
         self.total_equities_array = np.max([np.zeros(self.N),
@@ -85,14 +173,89 @@ class Simulation:
         
         # Set starting 'reserves' (i.e. available money)
         self.reserves = self.reserves + self.total_receiving_array + self.exogenous_cashflows
-        self.reserves[0] = 0  # Sinknode 0 doesn't take part in economy
         self.total_flow = self.reserves.sum()
         self.total_incoming = self.reserves + self.exogenous_cashflows
             
+        # Why the run terminated, and what the ConvergenceMonitor detected
+        self.termination_reason = None
+        self.cycle_period = None
+        self.convergence_events = []
+        
         # Let know whether has run or not
         self.has_run = False
         self.has_done_post = False
         self.loaded = False
+    
+    def estimate_memory(self, low_memory=None):
+        """
+        Returns the estimated peak memory (bytes) per component of a run, a dict with keys 'L', 'plan', 'payments',
+        'workspace' and 'state'. The histories are not included, they grow with the number of stages.
+        """
+        if low_memory is None:
+            low_memory = self.low_memory
+        N, nnz = self.N, self.L.nnz
+        index_itemsize = self.L.indices.dtype.itemsize
+        matrix_nbytes = nnz*(8 + index_itemsize) + (N+1)*index_itemsize
+        if self.out_of_core:
+            # L and the payments are memory-mapped, the scratch has the size of a block
+            return {
+                'L': 0,
+                'plan': self.strategy.plan_class.estimate_nbytes(N, 0, index_itemsize, True),
+                'payments': 0,
+                'workspace': Workspace.estimate_nbytes(N, min(nnz, 2*self.block_size), True),
+                'state': 12*N*8
+            }
+        return {
+            'L': matrix_nbytes,
+            'plan': self.strategy.plan_class.estimate_nbytes(N, nnz, index_itemsize, low_memory),
+            # p, and previous_p besides it when not low_memory
+            'payments': matrix_nbytes if low_memory else 2*matrix_nbytes,
+            'workspace': Workspace.estimate_nbytes(N, nnz, low_memory),
+            'state': 12*N*8
+        }
+    
+    def _apply_memory_budget(self):
+        estimate = sum(self.estimate_memory(low_memory=False).values())
+        if not self.low_memory and estimate > self.memory_budget:
+            print(f'Estimated memory {format_bytes(estimate)} exceeds the budget of '
+                  f'{format_bytes(self.memory_budget)}, switching to low_memory.')
+            self.low_memory = True
+        estimate = sum(self.estimate_memory(low_memory=True).values())
+        if estimate > self.memory_budget:
+            raise Exception(f'Estimated memory {format_bytes(estimate)} in low_memory mode exceeds the budget of '
+                            f'{format_bytes(self.memory_budget)}, consider out_of_core.')
+    
+    def _track_memory(self):
+        """
+        Updates the peak memory per component (memory_peaks), every array is counted once.
+        """
+        seen = set()
+        components = {
+            'L': [self.L],
+            'plan': [self.plan],
+            'payments': [self.p, getattr(self, 'previous_p', None)],
+            'workspace': [self.workspace],
+            'state': [self.reserves, self.total_payments_array, self.total_receiving_array, self.total_incoming,
+                      self.exogenous_cashflows, self.exogenous_outflows, self.equities, self.total_payables_array,
+                      self.total_receivables_array, self.total_equities_array, self.all_internal_nodes],
+            'histories': [self.equities_history, self.reserves_history, self.total_reserves_history,
+                          self.total_available_money_history, self.exo_history, self.all_defaults,
+                          self.defaulted_nodes, self.size_p, self.size_p_relative]
+        }
+        for component, objects in components.items():
+            self.memory_peaks[component] = max(self.memory_peaks.get(component, 0), nbytes(objects, seen))
+        return self.memory_peaks
+    
+    def memory_report(self):
+        """
+        Prints the peak memory per component of the last run, and returns memory_peaks.
+        """
+        mode = ' (low_memory)' if self.low_memory else ''
+        print(f'Peak memory of {self.label}{mode}:')
+        for component, peak in self.memory_peaks.items():
+            print(f'{component:<10} {format_bytes(peak):>12}')
+        print(f'{"total":<10} {format_bytes(sum(self.memory_peaks.values())):>12}')
+        return self.memory_peaks
         
     def _defaulting_nodes(self):
         """
@@ -109,15 +272,59 @@ class Simulation:
         
         return new_defaults
     
-    def _actual_run(self, rtol, max_iter=None, verbose=1):
+    def _clear_stage(self, workspace, engine=None):
+        """
+        Calculates the payments p_ij of a stage (into the buffer of the previous stage, except in low_memory mode),
+        and how much every node pays and receives.
+        """
+        if self.low_memory:
+            self.strategy.edge_payments(self.plan, self.total_incoming, backend=self.backend,
+                                        out=workspace.p_data, workspace=workspace, sink_out=workspace.sink_payments)
+        elif engine is not None:
+            engine.clear_stage(self.total_incoming, workspace.previous_p_data, self.total_payments_array,
+                               self.total_receiving_array, sink_out=workspace.previous_sink_payments)
+            workspace.swap()
+            self.p.data, self.previous_p.data = workspace.p_data, workspace.previous_p_data
+            return
+        else:
+            self.strategy.edge_payments(self.plan, self.total_incoming, backend=self.backend,
+                                        out=workspace.previous_p_data, workspace=workspace,
+                                        sink_out=workspace.previous_sink_payments)
+            workspace.swap()
+            self.p.data, self.previous_p.data = workspace.p_data, workspace.previous_p_data
+        workspace.row_sums(workspace.p_data, out=self.total_payments_array)
+        if workspace.sink_payments is not None:
+            np.add(self.total_payments_array, workspace.sink_payments, out=self.total_payments_array)
+        workspace.column_sums(workspace.p_data, out=self.total_receiving_array)
+    
+    def _actual_run(self, rtol, max_iter=None, verbose=1, processes=1, monitor=None, recorder=None, accelerator=None):
         verboseprint = print if verbose else lambda *a, **k: None
         if self.loaded:
             self.has_run = True
             verboseprint('Not running, old files were loaded')
             return
+        for _ in self._stages(rtol, max_iter, verbose=verbose, processes=processes, monitor=monitor,
+                              recorder=recorder, accelerator=accelerator):
+            pass
+        return self
+    
+    def _stages(self, rtol, max_iter=None, verbose=1, processes=1, keep_history=True, monitor=None, recorder=None,
+                accelerator=None):
+        """
+        The fictitious default algorithm, a generator that yields a StageView after every stage. The simulation is
+        wrapped up when the stages are done, or when the consumer stops early (at the last stage yielded).
+        keep_history: bool, keep the histories (all_defaults, size_p, reserves_history, ...) of the stages
+        monitor: ConvergenceMonitor, detects cycles and stagnation of the stages
+        recorder: TrajectoryRecorder, records the payments, reserves and defaults of every stage
+        accelerator: AndersonAccelerator, extrapolates the reserves of the next stage (only with build_reserves)
+        """
+        verboseprint = print if verbose else lambda *a, **k: None
         # Start the algorithm
         stage = 1
         terminate = False
+        self.termination_reason = None
+        if monitor is not None:
+            monitor.reset()
         self.defaulted_nodes = []
         self.all_defaults = {}
         self.equities_history = []
@@ -126,104 +333,271 @@ class Simulation:
         self.total_available_money_history = []
         self.exo_history = []
         
-        np.random.seed(0)
-        self.random_save_nodes = np.random.randint(0, self.N, size=100)
+        # The same nodes as np.random.seed(0), without changing the global state (shared by threads)
+        self.random_save_nodes = np.random.RandomState(0).randint(0, self.N, size=100)
         
         # Total equities of all nodes
         self.equities = np.array(self.reserves - self.total_payables_array, dtype=DTYPE)
-        self.equities_history.append(self.equities[self.random_save_nodes])
-        
-        while not terminate:   
-            # Pay what you can (from reserves)
-            ## Update reserves
-            # Receive money
-            # Update reserves
-            # sum(reserves[-1]) == sum(reserves[0])
-            
-            # This is the quantity used in _payments_matrix()
-            self.total_incoming = self.reserves # In this 'economy', you can pay from your reserves and exogenous
+        if keep_history:
+            self.equities_history.append(self.equities[self.random_save_nodes])
+        
+        # All buffers of the stages, the stages themselves don't allocate arrays of size N or nnz
+        low_memory = self.low_memory
+        workspace = self.workspace = Workspace(self.plan, low_memory=low_memory)
+        if self.p is not None:
+            # Warm start (start_p), the payments the first stage is compared with
+            workspace.p_data[:] = self.p.data
+            if workspace.sink_payments is not None and self.exogenous_payments is not None:
+                np.copyto(workspace.sink_payments, self.exogenous_payments)
+        
+        # Partitioned over processes, the payments and their sums are then done by the workers
+        engine = None
+        if processes != 1:
+            assert not low_memory, 'Partitioned clearing (processes) is not available in low_memory mode.'
+            engine = PartitionedClearing(self.strategy, self.plan, processes or os.cpu_count(), backend=self.backend,
+                                         rtol=rtol, verbose=verbose)
+            engine.buffers[0][:] = workspace.p_data
+            workspace.p_data, workspace.previous_p_data = engine.buffers
+        
+        if low_memory:
+            # Only the payments of the current stage are kept, p is set up after the run
+            self.p = self.previous_p = None
+            workspace.row_sums(workspace.p_data, out=workspace.previous_total_payments)
+            if workspace.sink_payments is not None:
+                workspace.previous_total_payments += workspace.sink_payments
+            workspace.column_sums(workspace.p_data, out=workspace.previous_total_receiving)
+        else:
+            self.p = sparse.csr_matrix((workspace.p_data, self.plan.L.indices.copy(), self.plan.L.indptr.copy()),
+                                       shape=self.L.shape)
+            self.previous_p = sparse.csr_matrix((workspace.previous_p_data, self.plan.L.indices.copy(),
+                                                 self.plan.L.indptr.copy()), shape=self.L.shape)
+        self.total_payments_array = np.zeros(self.N)
+        self.total_receiving_array = np.zeros(self.N)
+        self.reserves = np.array(self.reserves, dtype=DTYPE)
+        self.exogenous_cashflows = np.array(self.exogenous_cashflows, dtype=DTYPE)
+        
+        # Total payments of the previous stage, for the residual of the stages
+        previous_total_payments = workspace.row_sums(workspace.p_data, out=np.empty(self.N))
+        if workspace.sink_payments is not None:
+            previous_total_payments += workspace.sink_payments
+        self._track_memory()
+        if recorder is not None:
+            recorder.start(self.plan.L, workspace.p_data, self.reserves, workspace.defaulted)
+        if not self.strategy.build_reserves:
+            accelerator = None
+        if accelerator is not None:
+            accelerator.reset(self.reserves, rtol)
+        # The new defaults of the stages without any (most of them), not allocated every stage
+        no_defaults = np.zeros(0, dtype=np.intp)
+        no_defaults.flags.writeable = False
+        
+        completed = False
+        try:
+            while not terminate:   
+                # Pay what you can (from reserves)
+                ## Update reserves
+                # Receive money
+                # Update reserves
+                # sum(reserves[-1]) == sum(reserves[0])
             
-            # Calculate the payments p_ij
-            self.p = self.strategy.payments_matrix(self) 
+                # This is the quantity used in _payments_matrix()
+                self.total_incoming = self.reserves # In this 'economy', you can pay from your reserves and exogenous
             
-            # Calculate how much you pay
-            total_payments = self.p.sum(axis=1)
-            self.total_payments_array = np.array(total_payments).flatten()
+                # Calculate the payments p_ij, and how much you pay and receive
+                self._clear_stage(workspace, engine)
             
-            # Pay the money from your reserves
-            if self.strategy.build_reserves:
-                # Node 0 is ignored
-                self.reserves[1:] = self.reserves[1:] - self.total_payments_array[1:]
-                self.total_reserves_history.append(self.reserves[1:].sum())
+                # Pay the money from your reserves
+                if self.strategy.build_reserves:
+                    np.subtract(self.reserves, self.total_payments_array, out=self.reserves)
+                    if keep_history:
+                        self.total_reserves_history.append(self.reserves.sum())
             
-            # 'Receive' money
-            total_receiving = self.p.sum(axis=0)
-            self.total_receiving_array = np.array(total_receiving).flatten()
-            sum_payed_to_exogenous = self.total_receiving_array[0]
+                # 'Receive' money, the payments to the outside world are in the total payments already
+                sum_payed_to_exogenous = workspace.sink_payments.sum() if workspace.sink_payments is not None else 0.
             
-            # Decrease total exogenous available in a EisenbergNoe-ish way
-            if self.strategy.has_exogenous:
-                ratio = (sum_payed_to_exogenous/self.exogenous_cashflows.sum())
-                self.exogenous_cashflows = self.exogenous_cashflows * ratio
-                self.exo_history.append(self.exogenous_cashflows[1:].sum())
+                # Decrease total exogenous available in a EisenbergNoe-ish way
+                if self.strategy.has_exogenous:
+                    sum_exogenous_cashflows = self.exogenous_cashflows.sum()
+                    if sum_exogenous_cashflows > 0:
+                        ratio = (sum_payed_to_exogenous/sum_exogenous_cashflows)
+                        np.multiply(self.exogenous_cashflows, ratio, out=self.exogenous_cashflows)
+                    if keep_history:
+                        self.exo_history.append(self.exogenous_cashflows.sum())
             
-            # Add the received money to your reserves
-            if self.strategy.build_reserves:
-                # Node 0 is ignored
-                self.reserves[1:] = self.reserves[1:] + self.total_receiving_array[1:] + self.exogenous_cashflows[1:]
-                self.reserves_history.append(self.reserves[self.random_save_nodes])
-                self.total_available_money_history.append(self.reserves[1:].sum())
+                # Add the received money to your reserves
+                if self.strategy.build_reserves:
+                    np.add(self.reserves, self.total_receiving_array, out=self.reserves)
+                    np.add(self.reserves, self.exogenous_cashflows, out=self.reserves)
+                    if accelerator is not None:
+                        # The piece of the stages: the edges paid in full matter unless payments are pro rata
+                        paid_in_full = None
+                        if not isinstance(self.strategy, EisenbergNoe):
+                            # Into a scratch buffer unless out-of-core (the buffers have the size of a block)
+                            paid_in_full = np.greater_equal(
+                                workspace.p_data, self.plan.L.data,
+                                out=workspace.bool_nnz if workspace.scratch_nnz == workspace.nnz else None)
+                        cashflows = self.exogenous_cashflows if self.strategy.has_exogenous else None
+                        acceleration = accelerator.update(stage, self.reserves, self.total_payables_array,
+                                                          paid_in_full, cashflows)
+                        if acceleration == 'accelerated':
+                            workspace.keep_payments()
+                        elif acceleration == 'rejected':
+                            # The reserves are set back to the end of the previous stage, thus the payments as well:
+                            # this stage doesn't count (no defaults, convergence check, monitor or record)
+                            workspace.restore_payments()
+                            if not low_memory:
+                                self.p.data, self.previous_p.data = workspace.p_data, workspace.previous_p_data
+                            if keep_history:
+                                self.total_reserves_history.pop()
+                                if self.strategy.has_exogenous:
+                                    self.exo_history.pop()
+                            continue
+                    if keep_history:
+                        self.reserves_history.append(self.reserves[self.random_save_nodes])
+                        self.total_available_money_history.append(self.reserves.sum())
             
-            # Total equities of all nodes
-            self.equities = np.array(self.total_incoming - self.total_payables_array, dtype=DTYPE)
-            self.equities_history.append(self.equities[self.random_save_nodes])
+                # Total equities of all nodes
+                np.subtract(self.total_incoming, self.total_payables_array, out=self.equities)
+                if keep_history:
+                    self.equities_history.append(self.equities[self.random_save_nodes])
             
-            # A node is default when the obligations exceed the incoming cash
-            self.defaults = self._defaulting_nodes()
+                # A node is default when the obligations exceed the incoming cash (and it didn't default before)
+                np.greater(self.total_payables_array, self.total_payments_array, out=workspace.defaulting)
+                np.greater(workspace.defaulting, workspace.defaulted, out=workspace.new_defaults)
+                np.logical_or(workspace.defaulted, workspace.new_defaults, out=workspace.defaulted)
+                self.defaults = np.flatnonzero(workspace.new_defaults) if workspace.new_defaults.any() else no_defaults
             
-            self.all_defaults[stage] = self.defaults
-            self.defaulted_nodes.extend(self.defaults)
+                if keep_history:
+                    self.all_defaults[stage] = self.defaults
+                    self.defaulted_nodes.extend(self.defaults)
+                if recorder is not None:
+                    recorder.record(stage, workspace.p_data, self.reserves, workspace.defaulted)
             
-            # Display process
-            sum_reserves = np.sum(self.reserves[1:])
-            sum_payments = np.sum(self.total_payments_array[1:])
-            verboseprint(
-                f'\rstage: {stage:<4}, defaults: {len(self.defaults):<6}, sum reserves: {sum_reserves:1.2e}, '
-                f'sum payments: {sum_payments:1.2e}, total flow: {100*sum_payments/sum_reserves:6.3f}%, sum payed to '
-                f'exogenous: {sum_payed_to_exogenous:1.2e} sum exogenous cashflows: '
-                f'{self.exogenous_cashflows.sum():1.2e}', end=''
-            )
+                # Display process
+                sum_reserves = np.sum(self.reserves)
+                sum_payments = np.sum(self.total_payments_array)
+                verboseprint(
+                    f'\rstage: {stage:<4}, defaults: {len(self.defaults):<6}, sum reserves: {sum_reserves:1.2e}, '
+                    f'sum payments: {sum_payments:1.2e}, total flow: {100*sum_payments/sum_reserves:6.3f}%, sum payed to '
+                    f'exogenous: {sum_payed_to_exogenous:1.2e} sum exogenous cashflows: '
+                    f'{self.exogenous_cashflows.sum():1.2e}', end=''
+                )
             
-            # Wrap up the stage
-            self.size_p.append(self.p.sum())
-            self.size_p_relative.append(self.size_p[-1]/self.total_flow)
+                # Wrap up the stage
+                size_p = workspace.p_data.sum() + sum_payed_to_exogenous
+                if keep_history:
+                    self.size_p.append(size_p)
+                    self.size_p_relative.append(size_p/self.total_flow)
             
-            # Terminate if the p vector doesn't change anymore
-            if np.allclose(self.p.data, self.previous_p.data, rtol=rtol):
-                terminate = True            
+                # Terminate if the p vector (or in low_memory mode, the total payments and receiving) doesn't change anymore
+                if low_memory:
+                    terminate = workspace.converged(self.total_payments_array, self.total_receiving_array, rtol=rtol)
+                elif engine is not None:
+                    terminate = engine.converged
+                elif workspace.allclose(self.p.data, self.previous_p.data, rtol=rtol):
+                    terminate = workspace.sink_payments is None or \
+                        workspace.allclose(workspace.sink_payments, workspace.previous_sink_payments, rtol=rtol)
+                converged = terminate
+                if converged:
+                    self.termination_reason = 'converged'
+                
+                # The largest change of the total payments of a node
+                np.subtract(self.total_payments_array, previous_total_payments, out=previous_total_payments)
+                np.abs(previous_total_payments, out=previous_total_payments)
+                residual = float(previous_total_payments.max()) if self.N else 0.
+                np.copyto(previous_total_payments, self.total_payments_array)
+                
+                # Cycles and stagnation, the next stage only depends on the reserves (and exogenous cashflows)
+                if monitor is not None and not terminate:
+                    state = (self.exogenous_cashflows,) if self.strategy.has_exogenous else ()
+                    action, reason = monitor.update(stage, residual, self.reserves, *state)
+                    if action == 'stop':
+                        terminate = True
+                        self.termination_reason = reason
+                    elif action == 'accelerate' and accelerator is not None:
+                        accelerator.restart(self.reserves)
             
-            stage += 1
-            if stage > self.N:
-                terminate = True
-            if max_iter and stage >= max_iter:
-                terminate = True
-            self.previous_p.data = self.p.data
-        del self.previous_ps_to_check
+                if stage == 1:
+                    self._track_memory()  # The scratch buffers are in use now
+                stage += 1
+                if stage > self.N and not terminate:
+                    terminate = True
+                    self.termination_reason = 'max_stages'
+                if max_iter and stage >= max_iter and not terminate:
+                    terminate = True
+                    self.termination_reason = 'max_iter'
+                
+                yield StageView(stage=stage-1, new_defaults=self.defaults, n_defaulted=int(workspace.defaulted.sum()),
+                                sum_payments=sum_payments, sum_reserves=sum_reserves,
+                                sum_payed_to_exogenous=sum_payed_to_exogenous, size_p=size_p,
+                                size_p_relative=size_p/self.total_flow, residual=residual, converged=converged)
+            completed = True
+        except GeneratorExit:
+            # Stopped by the consumer, the simulation is wrapped up at the last stage. When that stage ended the run
+            # anyway (e.g. it converged), its termination_reason is kept
+            completed = True
+            if not terminate:
+                self.termination_reason = 'stopped'
+            raise
+        finally:
+            if recorder is not None:
+                recorder.close()
+            if monitor is not None:
+                self.cycle_period = monitor.period
+                self.convergence_events = monitor.events
+            if accelerator is not None:
+                self.acceleration = accelerator.report()
+                self.acceleration_events = accelerator.events
+            if engine is not None:
+                # Out of the shared memory
+                workspace.p_data, workspace.previous_p_data = workspace.p_data.copy(), workspace.previous_p_data.copy()
+                self.p.data, self.previous_p.data = workspace.p_data, workspace.previous_p_data
+                engine.close()
+            if completed:
+                self._wrap_up(workspace, keep_history)
+    
+    def _wrap_up(self, workspace, keep_history=True):
         self.has_run = True
+        if not keep_history:
+            self.defaulted_nodes = list(np.flatnonzero(workspace.defaulted))
         
         # Calculate how much you pay
-        total_payments = self.p.sum(axis=1)
-        self.total_payments_array = np.array(total_payments).flatten()
+        workspace.row_sums(workspace.p_data, out=self.total_payments_array)
+        self.exogenous_payments = None
+        if workspace.sink_payments is not None:
+            self.exogenous_payments = np.array(workspace.sink_payments)
+            np.add(self.total_payments_array, self.exogenous_payments, out=self.total_payments_array)
+        
+        if self.low_memory:
+            workspace.release_scratch()
+            self.p = workspace.payments_matrix()
+        self._track_memory()
 
         # The difference of payments and receiving, you keep in your pockets
         if self.strategy.build_reserves:
             self.reserves = self.reserves - self.total_payments_array
             
         self.defaults = self._defaulting_nodes()
-        
-        return self
+    
+    def iter_stages(self, rtol=5e-2, max_iter=None, verbose=0, start_p=None, start_exogenous_payments=None,
+                    keep_history=False, monitor=None, recorder=None, accelerator=None):
+        """
+        Runs the simulation stage by stage, a generator of a read-only StageView per stage (new defaults, totals,
+        residual), e.g. for online statistics or own stopping rules: breaking out of the loop stops the simulation at
+        that stage (termination_reason 'stopped', unless that stage ended the run anyway). Without keep_history nothing
+        is stored per stage, and there's no post processing (see run).
+        start_p, start_exogenous_payments: see run
+        monitor: ConvergenceMonitor (see run)
+        recorder: TrajectoryRecorder (see run)
+        accelerator: AndersonAccelerator (see run)
+        """
+        self._start(start_p, start_exogenous_payments)
+        self.size_p = []
+        self.size_p_relative = []
+        return self._stages(rtol, max_iter, verbose=verbose, keep_history=keep_history, monitor=monitor,
+                            recorder=recorder, accelerator=accelerator)
             
-    def _post_run(self, save, verbose=1):
+    def _post_run(self, save, verbose=1, background_save=False):
         verboseprint = print if verbose else lambda *a, **k: None
         if self.loaded:
             self.has_run = True
@@ -233,7 +607,7 @@ class Simulation:
         # Wrap up simulation
         verboseprint('\n')
 
-        all_nodes = np.array(list(set(np.array(self.L.nonzero()).flatten())))
+        all_nodes = self.all_internal_nodes
         
         # Set stage 0 as all the never-defaulted nodes
         self.all_defaults[0] = np.setdiff1d(all_nodes, self.defaulted_nodes)
@@ -255,24 +629,75 @@ class Simulation:
         
         # Save the object
         if save:
-            self.save(verbose=verbose)
+            self.save(verbose=verbose, background=background_save)
         
         self.has_done_post = True
         
-    def run(self, rtol=5e-2, max_iter=None, save=False, verbose=1, actual_run=True):
+    def _start(self, start_p=None, start_exogenous_payments=None):
+        # Clearing vector, without start_p the workspace starts at L (the assumption that it's just the network of
+        # obligations)
+        assert start_p is None or not self.strategy.build_reserves, \
+            'start_p is only available without build_reserves, the stages then only depend on the start reserves.'
+        assert start_p is None or start_p.nnz == self.L.nnz, 'start_p does not have the sparsity structure of L.'
+        self.p = start_p
+        self.previous_p = None
+        self.exogenous_payments = None
+        if start_p is not None and start_exogenous_payments is not None:
+            self.exogenous_payments = np.array(start_exogenous_payments, dtype=DTYPE)
+
+    def run(self, rtol=5e-2, max_iter=None, save=False, verbose=1, actual_run=True, start_p=None,
+            start_exogenous_payments=None, processes=1, monitor=None, recorder=None, background_save=False,
+            cache=None, accelerator=None):
+        """
+        start_p: scipy sparse matrix with the sparsity structure of L, the payments the first stage is compared with
+                 for convergence (default L), e.g. the payments of a run with other start reserves. Only without
+                 build_reserves: the payments of every stage then follow from the start reserves, thus these are the
+                 same as those of a cold run, and the run converges in the first stage when they're close to start_p
+        start_exogenous_payments: np.array with shape (N,), the payments to the outside world that go with start_p
+                                  (default exogenous_outflow)
+        processes: int, clear the stages partitioned over this many processes (None is all cores), with the same
+                   results as one process (see PartitionedClearing)
+        monitor: ConvergenceMonitor, stops (or reports, or accelerates) runs that cycle or stagnate instead of running
+                 up to max_iter. Why the run terminated is in termination_reason ('converged', 'max_iter',
+                 'max_stages', 'cycle', 'stagnation' or 'stopped'), the events of the monitor in convergence_events
+        recorder: TrajectoryRecorder, stores the changes of p, the reserves and the defaults of every stage on disk,
+                  to reconstruct any stage afterwards (see Trajectory)
+        background_save: bool, with save the files are written in the background while the next simulation runs,
+                         cascading_defaults.utils.wait_for_saves() waits until they're written
+        cache: ResultCache, or True for the default one (simulations/cache), loads the results when a run with the same
+               inputs (L, strategy, backend, reserves, exogenous cashflows, rtol, max_iter and code) was cached, and
+               else runs and caches the results. Not used with a recorder
+        accelerator: AndersonAccelerator, with build_reserves the stages are Anderson mixed (fewer stages for the same
+                     rtol), the statistics are then in acceleration (compare_acceleration measures the stages saved).
+                     The payments converge to the same ones, the defaults per stage follow the accelerated stages.
+                     The stages of rejected steps are set back and not counted (they are counted in acceleration)
+        """
         print(f'Running {self.label}.')
+        
+        # Results of the same inputs
+        key = None
+        if cache is True:
+            cache = result_cache()
+        if cache and actual_run and recorder is None:
+            key = cache.key(self, rtol, max_iter, start_p=start_p, start_exogenous_payments=start_exogenous_payments,
+                            monitor=monitor, accelerator=accelerator)
+            if cache.get(key, self, verbose=0):
+                print(f'Done with {self.label} (cached).')
+                return self
                 
-        # Clearing vector
-        self.p = self.L.copy()  # Start with the assumption that it's just the network of obligations
-        self.previous_p = self.p.copy()
+        self._start(start_p, start_exogenous_payments)
+        if self.p is None and not actual_run:
+            self.p = self.L.copy()
         
         self.size_p = []
         self.size_p_relative = []
-        self.previous_ps_to_check = None#[]
         
         if actual_run:
-            self._actual_run(rtol, max_iter, verbose=verbose)
-            self._post_run(save, verbose=verbose)
+            self._actual_run(rtol, max_iter, verbose=verbose, processes=processes, monitor=monitor,
+                             recorder=recorder, accelerator=accelerator)
+            self._post_run(save, verbose=verbose, background_save=background_save)
+            if key is not None:
+                cache.put(key, self)
         
         print(f'Done with {self.label}.')
         
@@ -296,11 +721,15 @@ class Simulation:
         print(self.L.getcol(node))
         print(f'Total receivables: {self.L.getcol(node).sum()}')
         print(f'Exogenous cashflow: {self.exogenous_cashflows[node]:.2f}')
+        if self.exogenous_outflows is not None:
+            print(f'Exogenous outflow: {self.exogenous_outflows[node]:.2f}')
         print(f'Total receiving: {self.L.getcol(node).sum() + self.exogenous_cashflows[node]:.2f}')
         print('\n\nClearing vector:')
         print('Outgoing:')
         print(self.p.getrow(node))
-        print(f'Total Outgoing: {self.p.getrow(node).sum()}')
+        if getattr(self, 'exogenous_payments', None) is not None:
+            print(f'Payed to exogenous: {self.exogenous_payments[node]:.2f}')
+        print(f'Total Outgoing: {self.total_payments_array[node]}')
         print('\nIncoming:')
         print(self.p.getcol(node))
         print(f'Total receivables: {self.p.getcol(node).sum()}')
@@ -311,7 +740,7 @@ class Simulation:
         fig, ax1 = plt.subplots(figsize=(25,5))
         
         p_line = ax1.plot(self.size_p, label='$\|p^*\|$', color='g')
-        L_line = ax1.plot(np.full(len(self.size_p), self.L.sum()), label='total flow', color='b')
+        L_line = ax1.plot(np.full(len(self.size_p), self.total_payables_array.sum()), label='total flow', color='b')
         ax1.set_ylabel('total flow (EUR)')
         ax1.set_xlabel('iteration')
         ax1.set_ylim(0)
@@ -337,13 +766,25 @@ class Simulation:
         plt.title(self.clearing_vector_title)
         plt.show()
         
-    def save(self, upperfolder=None, save_clearing_vector_as_nx=False, verbose=0, remove_existing=True):
+    def save(self, upperfolder=None, save_clearing_vector_as_nx=False, verbose=0, remove_existing=True,
+             background=False):
+        """
+        The simulation is recorded in the catalog of the saved simulations (see Catalog).
+        background: bool, write the files in a background thread (see AsyncSaver), the simulation can change after
+                    this returns
+        """
 
         if not upperfolder:
             upperfolder = f'simulations/{self.transaction_network}/{self.label_of_run}/{self.strategy.label}'
- 
+        row = catalog_row(self, upperfolder)
+        
+        if background:
+            background_saver().save(self, upperfolder=upperfolder, verbose=verbose, label_seperate_folder=False,
+                                    remove_existing=remove_existing, on_saved=lambda: catalog().record(row))
+            return
         save_contents(self, upperfolder=upperfolder, verbose=verbose, label_seperate_folder=False,
                       remove_existing=remove_existing)
+        catalog().record(row)
         
     def load(self, upperfolder=None, verbose=0, attributes=None):
         if not upperfolder:
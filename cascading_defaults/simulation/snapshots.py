@@ -0,0 +1,149 @@
+import numpy as np
+from scipy import sparse
+
+from cascading_defaults.simulation.simulation import Simulation
+from cascading_defaults.simulation.strategies import DefaultStrategy
+from cascading_defaults.utils import RowSplice
+
+
+def _row_positions(indptr, rows):
+    """
+    Returns the positions in the data of a CSR-matrix of all the edges in rows, and the number of edges per row.
+    """
+    counts = indptr[rows+1] - indptr[rows]
+    offsets = np.cumsum(counts) - counts
+    return np.arange(counts.sum()) + np.repeat(indptr[rows] - offsets, counts), counts
+
+
+class SnapshotSeries:
+
+    def __init__(self, strategy, L, exogenous_cashflow=np.zeros(0), start_reserves=0,
+                 label_of_network='random_network', exogenous_outflow=None):
+        """
+        A series of (daily) snapshots of one transaction network. Only day 0 is processed for the strategy as a
+        whole, after that update() patches the prepared L, its totals and the plan (e.g. the relative liabilities and
+        the running totals of the sorted rows) in the changed rows only. The clearing of every day starts cold, like a
+        simulation of the day on its own: with build_reserves the stationary state depends on the stages before it,
+        thus starting from the previous day would change the results.
+        Inputs:
+        strategy: cascading_defaults.simulation.Strategy instance
+        L: scipy sparse edgelist of day 0
+        start_reserves: np.array with shape = (1,N) or float
+        exogenous_cashflow: np.array with shape (1,N)
+        exogenous_outflow: np.array with shape (1,N), what the nodes owe the outside world (see Simulation)
+        """
+        assert isinstance(strategy, DefaultStrategy), f'Strategy {strategy} is of type ' \
+                                                      f'{type(strategy)} and not of type {DefaultStrategy}.'
+        self.strategy = strategy
+        self.label_of_network = label_of_network
+        self.start_reserves = start_reserves
+        self.exogenous_cashflow = exogenous_cashflow
+        self.exogenous_outflow = None
+        if strategy.has_exogenous and exogenous_outflow is not None:
+            self.exogenous_outflow = np.array(exogenous_outflow, dtype=np.float64).flatten()
+
+        print(f'Creating {self.strategy.L_needed()} for day 0.')
+        L = sparse.csr_matrix(L, dtype=np.float64, copy=True)
+        L.sum_duplicates()
+        self.L = sparse.csr_matrix(self.strategy.process_L_for_strategy(L))
+        self.N = self.L.shape[0]
+
+        self.total_payables_array = np.array(self.L.sum(axis=1)).flatten()
+        self.total_receivables_array = np.array(self.L.sum(axis=0)).flatten()
+        self.plan = self.strategy.compile_plan(self.L, total_payables_array=self.total_payables_array,
+                                               total_receivables_array=self.total_receivables_array,
+                                               exogenous_outflows=self.exogenous_outflow)
+
+        self.day = 0
+        self.simulation = None
+
+    def update(self, insertions=None, deletions=None, weight_changes=None):
+        """
+        Moves the series to the next day by changing edges of L.
+        Inputs:
+        insertions: tuple (rows, cols, weights) of new edges, the weights of duplicate edges are summed
+        deletions: tuple (rows, cols) of removed edges
+        weight_changes: tuple (rows, cols, weights) with the new weights of existing edges
+        """
+        N = self.N
+        L = self.L
+        changes = [change for change in (insertions, deletions, weight_changes) if change is not None]
+        self.day += 1
+        if not changes:
+            return self
+
+        # Step 1
+        # The current edges of all rows with a change
+        touched = np.unique(np.concatenate([np.asarray(change[0], dtype=np.int64) for change in changes]))
+        old_positions, old_counts = _row_positions(L.indptr, touched)
+        rows = np.repeat(touched, old_counts)
+        cols = L.indices[old_positions].astype(np.int64)
+        data = L.data[old_positions].copy()
+        old_cols, old_data = cols, data
+
+        # Step 2
+        # Apply the changes on these rows
+        keys = rows*N + cols
+        if deletions is not None:
+            keep = ~np.isin(keys, np.asarray(deletions[0], dtype=np.int64)*N + np.asarray(deletions[1]))
+            rows, cols, data, keys = rows[keep], cols[keep], data[keep], keys[keep]
+        if weight_changes is not None:
+            change_keys = np.asarray(weight_changes[0], dtype=np.int64)*N + np.asarray(weight_changes[1])
+            argsort = np.argsort(keys)
+            found = np.searchsorted(keys, change_keys, sorter=argsort)
+            found = argsort[np.minimum(found, len(keys)-1)] if len(keys) else found
+            if (not len(keys)) or np.any(keys[found] != change_keys):
+                raise Exception('Weight changes of edges that are not in L, pass these as insertions.')
+            data[found] = weight_changes[2]
+        if insertions is not None:
+            insertion_keys = np.asarray(insertions[0], dtype=np.int64)*N + np.asarray(insertions[1])
+            if np.any(np.isin(insertion_keys, keys)):
+                raise Exception('Insertions of edges that are already in L, pass these as weight_changes.')
+            # Duplicate insertions are summed (like the duplicates of L of day 0), thus every edge is in L once
+            insertion_keys, inverse = np.unique(insertion_keys, return_inverse=True)
+            weights = np.bincount(inverse, weights=np.asarray(insertions[2], dtype=np.float64),
+                                  minlength=len(insertion_keys))
+            rows = np.concatenate([rows, insertion_keys // N])
+            cols = np.concatenate([cols, insertion_keys % N])
+            data = np.concatenate([data, weights])
+        nonzero = data != 0
+        rows, cols, data = rows[nonzero], cols[nonzero], data[nonzero]
+
+        # Step 3
+        # Order the edges within the rows like the strategy does
+        order = self.strategy.edge_order(rows, cols, data)
+        rows, cols, data = rows[order], cols[order], data[order]
+
+        # Step 4
+        # Splice the new rows into L, the other rows are copied as they are
+        new_counts = np.bincount(np.searchsorted(touched, rows), minlength=len(touched))
+        splice = RowSplice(L.indptr, touched, new_counts)
+        indices = splice.splice(L.indices, cols.astype(L.indices.dtype))
+        self.L = sparse.csr_matrix((splice.splice(L.data, data), indices, splice.indptr), shape=L.shape, copy=False)
+
+        # Step 5
+        # Patch the totals of the changed edges, and the plan in the changed rows
+        np.subtract.at(self.total_receivables_array, old_cols, old_data)
+        np.add.at(self.total_receivables_array, cols, data)
+        payables = np.zeros(len(touched))
+        nonempty = new_counts > 0
+        if nonempty.any():
+            payables[nonempty] = np.add.reduceat(data, splice.offsets[:-1][nonempty])
+        self.total_payables_array[touched] = payables
+        self.plan = self.plan.patch(self.L, splice, total_receivables_array=self.total_receivables_array)
+
+        return self
+
+    def run(self, label_of_run=None, **kwargs):
+        """
+        Runs the simulation of the current day on the patched plan, kwargs are passed to Simulation.run.
+        """
+        if not label_of_run:
+            label_of_run = f'day{self.day}'
+        self.simulation = Simulation(self.strategy, self.L, label_of_run=label_of_run,
+                                     exogenous_cashflow=self.exogenous_cashflow, start_reserves=self.start_reserves,
+                                     label_of_network=self.label_of_network, L_is_prepared=True, plan=self.plan,
+                                     exogenous_outflow=self.exogenous_outflow)
+        self.simulation.run(**kwargs)
+
+        return self.simulation
@@ -1,15 +1,30 @@
+from collections import OrderedDict
+import hashlib
 import os
+import threading
 
 import numpy as np
 from scipy import sparse
 
 import cascading_defaults
-from cython_defaults import cython_payments
-from cython_sorting import sort_L_cython
+from .backends import get_backend
+from .payments import payments_largest_creditor
+from .plans import StrategyPlan, EisenbergNoePlan, LargestCreditorPlan
+from .workspace import Workspace
 from .. import current_dir
+from ..utils import fingerprint, save_memmap_csr, load_memmap_csr
+
+# The caches of plans are shared by the simulations in all threads (see SimulationGrid)
+_plans_lock = threading.RLock()
 
 
 class DefaultStrategy:
+    plan_class = StrategyPlan
+    max_cached_plans = 4
+    # Name of the backend of the kernels (see backends.py), None is the globally selected one
+    backend = None
+    # Whether process_L_for_strategy treats every row on its own, then L can be processed in blocks of rows
+    row_local_processing = True
     
     def __init__(self, build_reserves, pay_remaining_money, has_exogenous):
         # Characteristics
@@ -21,6 +36,15 @@ class DefaultStrategy:
         
         # Label
         self.label = self.create_strategy_label()
+        
+        # Plans per prepared L, by fingerprint of L
+        self.plans = OrderedDict()
+        
+    def __getstate__(self):
+        # The plans are rebuilt when needed, don't pickle them (saving, multiprocessing)
+        state = self.__dict__.copy()
+        state['plans'] = OrderedDict()
+        return state
     
     def create_strategy_label(self):
         """
@@ -32,11 +56,18 @@ class DefaultStrategy:
         self.label = f'{self.strategy}{X}{R}-{exo_label}'
         return self.label
     
-    def select_right_L(self, L, transaction_network='random_network', force_update_L=False, save_right_L=True):
+    def select_right_L(self, L, transaction_network='random_network', force_update_L=False, save_right_L=True,
+                       mmap=False):
         """
         Returns the right L
+        mmap: bool, L is stored as .npy files (see save_memmap_csr) and returned memory-mapped (read-only)
         """
         L_needed = self.L_needed()
+        if L is None and L_needed != 'L':
+            # The L of the network itself (e.g. written by SyntheticNetwork.save)
+            L = self._saved_L(transaction_network, mmap)
+        if mmap:
+            return self._select_right_memmap_L(L, L_needed, transaction_network, force_update_L)
         
         path_to_L = f'transactionnetworks/{transaction_network}/{L_needed}.npz'
         path_to_L = os.path.join(current_dir, path_to_L)
@@ -59,22 +90,146 @@ class DefaultStrategy:
         
         return L
     
-    def L_needed(self):
-        if self.has_exogenous:
-            return 'L_sinknode'
+    def _saved_L(self, transaction_network, mmap=False):
+        path_to_L = os.path.join(current_dir, f'transactionnetworks/{transaction_network}/L')
+        if os.path.exists(os.path.join(path_to_L, 'data.npy')):
+            return load_memmap_csr(path_to_L)
+        if not mmap and os.path.exists(f'{path_to_L}.npz'):
+            with open(f'{path_to_L}.npz', 'rb') as file:
+                return sparse.load_npz(file)
+        raise Exception(f'No L given and no L saved for {transaction_network}.')
+    
+    def _select_right_memmap_L(self, L, L_needed, transaction_network, force_update_L):
+        path_to_L = os.path.join(current_dir, f'transactionnetworks/{transaction_network}/{L_needed}')
+        safe_path_to_L = path_to_L.replace(os.getcwd(), '~')
+        if (not force_update_L) and os.path.exists(os.path.join(path_to_L, 'data.npy')):
+            print(f'Loading memory-mapped {L_needed} from {safe_path_to_L}.')
+            return load_memmap_csr(path_to_L)
+        
+        print(f'Creating {L_needed}.')
+        if self.row_local_processing:
+            # Streams through L (which can be memory-mapped itself), a block of rows at a time
+            save_memmap_csr(L, path_to_L, transform=self.process_L_for_strategy)
         else:
-            return 'L'
+            save_memmap_csr(self.process_L_for_strategy(sparse.csr_matrix(L, copy=True)), path_to_L)
+        return load_memmap_csr(path_to_L)
     
-    def process_L_for_strategy(self, L):
+    def L_needed(self):
+        # The outside world is a virtual sink node (exogenous outflows of the plan), not part of L
+        return 'L'
+    
+    def process_L_for_strategy(self, L, backend=None):
         return L
+    
+    def edge_order(self, rows, indices, data):
+        """
+        Returns the order (np.array of positions) in which edges are stored within the rows of the prepared L,
+        used to patch rows of L without processing the whole matrix again.
+        """
+        return np.lexsort((indices, rows))
+    
+    def plan_arguments(self):
+        """
+        Returns the keyword arguments of the plan_class that depend on the strategy.
+        """
+        return {}
+    
+    def compile_plan(self, L, **precomputed):
+        """
+        Returns a new (frozen) plan of the strategy for a prepared L.
+        """
+        return self.plan_class(L, **precomputed, **self.plan_arguments()).freeze()
+    
+    def plan(self, L, low_memory=False, block_size=None, exogenous_outflows=None):
+        """
+        Returns the plan of the strategy for a prepared L, cached by the fingerprint of L.
+        low_memory: bool, a plan without precomputed arrays of size nnz (see StrategyPlan)
+        block_size: int, an out-of-core plan that streams through L in blocks of rows (see StrategyPlan)
+        exogenous_outflows: np.array with shape (N,), the obligations to the outside world (see StrategyPlan)
+        """
+        key = fingerprint(L)
+        if low_memory:
+            key = f'{key}-low_memory'
+        if block_size is not None:
+            key = f'{key}-blocks_{block_size}'
+        if exogenous_outflows is not None:
+            exogenous_outflows = np.array(exogenous_outflows, dtype=np.float64).flatten()
+            key = f'{key}-outflows_{hashlib.blake2b(exogenous_outflows.tobytes(), digest_size=8).hexdigest()}'
+        with _plans_lock:
+            if not hasattr(self, 'plans'):
+                self.plans = OrderedDict()
+            if key in self.plans:
+                self.plans.move_to_end(key)
+                return self.plans[key]
+            # Compiled once, threads that need the same plan wait for it
+            plan = self.plan_class(L, low_memory=low_memory, block_size=block_size,
+                                   exogenous_outflows=exogenous_outflows, **self.plan_arguments())
+            plan.fingerprint = key
+            self.plans[key] = plan.freeze()
+            while len(self.plans) > self.max_cached_plans:
+                self.plans.popitem(last=False)
+        return plan
+    
+    def simulation_plan(self, simulation):
+        """
+        Returns the plan of a simulation, or compiles it (for simulations without one, e.g. loaded ones).
+        """
+        if getattr(simulation, 'plan', None) is not None:
+            return simulation.plan
+        return self.plan(simulation.L, low_memory=getattr(simulation, 'low_memory', False),
+                         block_size=getattr(simulation, 'block_size', None),
+                         exogenous_outflows=getattr(simulation, 'exogenous_outflows', None))
+
+    def get_backend(self, backend=None, simulation=None):
+        """
+        Returns the backend for a call: the one passed, else the one of the simulation, else the one of the strategy.
+        """
+        return get_backend(backend or getattr(simulation, 'backend', None) or self.backend)
 
     def payments_matrix(self, simulation):
         if not hasattr(self, 'simulation_checked'):
             assert isinstance(simulation, cascading_defaults.simulation.simulation.Simulation), f'Simulation {simulation} is of type {type(simulation)} and not of type {cascading_defaults.simulation.simulation.Simulation}.'
             self.simulation_checked = True
+            
+    def edge_payments(self, plan, incomings, backend=None, out=None, workspace=None, sink_out=None):
+        """
+        Returns the payments p_ij as an np.array aligned with plan.L.data, for one vector of incomings.
+        When given, the payments are written into out and the buffers of workspace (Workspace) are used. With
+        exogenous outflows in the plan, the payments to the outside world are written into sink_out (shape (N,)).
+        """
+        raise NotImplementedError(f'Strategy {self.strategy} has no edge_payments.')
+    
+    def batch_payments(self, plan, incomings, backend=None, workspace=None):
+        """
+        Payments for a batch of scenarios at once.
+        Inputs:
+        plan: StrategyPlan of the prepared L (see plan)
+        incomings: np.array with shape (N,B), one column per scenario
+        backend: str, name of the backend (see backends.py)
+        workspace: Workspace for plan
+        Outputs:
+        total_payments, total_receiving and exogenous_payments (to the outside world), all np.array with shape (N,B)
+        """
+        if workspace is None:
+            workspace = Workspace(plan)
+        total_payments = np.empty_like(incomings)
+        total_receiving = np.empty_like(incomings)
+        exogenous_payments = np.zeros_like(incomings)
+        for b in range(incomings.shape[1]):
+            # Summed like Simulation does, so that rounding (and thus defaults) are the same
+            self.edge_payments(plan, incomings[:, b], backend, out=workspace.p_data, workspace=workspace,
+                               sink_out=workspace.sink_payments)
+            total_payments[:, b] = workspace.row_sums(workspace.p_data, out=workspace.float_N)
+            total_receiving[:, b] = workspace.column_sums(workspace.p_data, out=workspace.float_N)
+            if plan.outflows is not None:
+                total_payments[:, b] += workspace.sink_payments
+                exogenous_payments[:, b] = workspace.sink_payments
+        return total_payments, total_receiving, exogenous_payments
     
     
 class EisenbergNoe(DefaultStrategy):
+    plan_class = EisenbergNoePlan
+    row_local_processing = False
     
     def __init__(self, build_reserves, pay_remaining_money, has_exogenous):
         self.strategy = 'EisenbergNoe'
@@ -82,48 +237,65 @@ class EisenbergNoe(DefaultStrategy):
         super().__init__(build_reserves, pay_remaining_money, has_exogenous)
         
     def L_needed(self):
-        if self.has_exogenous:
-            return 'L_sinknode_EisenbergNoe'
-        else:
-            return 'L_EisenbergNoe'
-        
-    def process_L_for_strategy(self, L):
-        # Find p_i-bar (Equation (1) in Eisenberg and Noe [1])
-        total_payables_vector = L.sum(axis=1)
-        
-        # Total receivable cash
-        total_receivables_vector = L.sum(axis=0)
-        
-        # Correct for zero liabilities
-        L[np.argwhere(total_payables_vector==0), np.argwhere(total_payables_vector==0)] = 0
+        return 'L_EisenbergNoe'
         
+    def process_L_for_strategy(self, L, backend=None):
+        # Nothing to correct for zero liabilities: these rows have no entries, and their relative liabilities are 0 in
+        # the plan (see EisenbergNoePlan)
         return L
         
     def payments_matrix(self, simulation):
         super().payments_matrix(simulation)
         
-        if not hasattr(self, 'relative_liabilities_matrix'):
-            self.relative_liabilities_matrix = self.init_relative_liabilities_matrix(simulation)
+        plan = self.simulation_plan(simulation)
         
         total_dollar_payments = np.minimum(simulation.total_incoming, simulation.total_payables_array).reshape((-1,1))
         # Calculate new payment matrix
         # This is the incoming cash divided over all the nodes it has an obligation to
         # Multiply is an element-wise (column) multiplication
-        return self.relative_liabilities_matrix.multiply(total_dollar_payments)
-            
-    def init_relative_liabilities_matrix(self, simulation):
-        ones = np.ones((simulation.L.shape[0],1))
-        
-        multiplier = np.divide(ones, simulation.total_payables_vector, out=np.zeros_like(ones), where=simulation.total_payables_vector != 0)
-        
-        self.relative_liabilities_matrix = simulation.L.multiply(multiplier).tocsr()  # Note that multiply is column-wise
-        
-        # Correct for zero liabilities
-        self.relative_liabilities_matrix[np.argwhere(simulation.total_payables_vector==0), np.argwhere(simulation.total_payables_vector==0)] = 1
-        
-        return self.relative_liabilities_matrix
+        if plan.relative_liabilities_matrix is None:
+            # Low-memory plan
+            return sparse.csr_matrix((self.edge_payments(plan, simulation.total_incoming), plan.L.indices.copy(),
+                                      plan.L.indptr.copy()), shape=plan.L.shape)
+        return plan.relative_liabilities_matrix.multiply(total_dollar_payments)
+    
+    def edge_payments(self, plan, incomings, backend=None, out=None, workspace=None, sink_out=None):
+        total_dollar_payments = np.minimum(incomings, plan.total_payables_array,
+                                           out=workspace.float_N if workspace is not None else None)
+        if out is None:
+            out = np.empty(plan.L.nnz)
+        if plan.outflows is not None and sink_out is not None:
+            # Pro rata to the outside world as well
+            np.multiply(plan.outflows, plan.multiplier, out=sink_out)
+            np.multiply(sink_out, total_dollar_payments, out=sink_out)
+        if plan.relative_liabilities_matrix is None:
+            # Low-memory plan, p_ij = L_ij / p_i-bar * min(incoming, p_i-bar) (per block of rows when out-of-core),
+            # in the order of the relative liabilities, thus with the same rounding
+            for start, stop, first_edge, last_edge in plan.blocks():
+                counts = plan.row_counts[start:stop]
+                out_block = out[first_edge:last_edge]
+                np.multiply(plan.L.data[first_edge:last_edge], np.repeat(plan.multiplier[start:stop], counts),
+                            out=out_block)
+                np.multiply(out_block, np.repeat(total_dollar_payments[start:stop], counts), out=out_block)
+            return out
+        plan.edge_values(total_dollar_payments, out=out)
+        return np.multiply(out, plan.relative_liabilities_matrix.data, out=out)
+    
+    def batch_payments(self, plan, incomings, backend=None, workspace=None):
+        # Every node pays min(incoming, payables), divided pro rata over its creditors. Thus the receiving
+        # side is one sparse product for the whole batch, instead of a loop over the scenarios
+        total_payments = np.minimum(incomings, plan.total_payables_array.reshape((-1,1)))
+        exogenous_payments = np.zeros_like(total_payments)
+        if plan.outflows is not None:
+            exogenous_payments = total_payments * (plan.outflows * plan.multiplier).reshape((-1,1))
+        if plan.relative_liabilities_transposed is None:
+            # Low-memory plan
+            return (total_payments, np.asarray(plan.L.T @ (total_payments * plan.multiplier.reshape((-1,1)))),
+                    exogenous_payments)
+        return total_payments, np.asarray(plan.relative_liabilities_transposed @ total_payments), exogenous_payments
 
 class LargestCreditor(DefaultStrategy):
+    plan_class = LargestCreditorPlan
     
     def L_needed(self):
         if self.last_first == 'first':
@@ -132,20 +304,52 @@ class LargestCreditor(DefaultStrategy):
             self.ascending_descending = 'ascending'
         else:
             raise Exception(f'{self.last_first} not a valid ordering')
-        if self.has_exogenous:
-            return f'L_sinknode_sorted_{self.ascending_descending}'
-        else:
-            return f'L_sorted_{self.ascending_descending}'
+        return f'L_sorted_{self.ascending_descending}'
         
-    def process_L_for_strategy(self, L):
-        L_sorted = sort_L_cython(L, ascending_descending=self.ascending_descending)
+    def process_L_for_strategy(self, L, backend=None):
+        self.L_needed()  # Sets ascending_descending
+        L_sorted = self.get_backend(backend).sort_L(L, ascending_descending=self.ascending_descending)
         
         return L_sorted
     
+    def plan_arguments(self):
+        self.L_needed()  # Sets ascending_descending
+        return {'descending': self.ascending_descending == 'descending'}
+    
+    def edge_order(self, rows, indices, data):
+        self.L_needed()  # Sets ascending_descending
+        if self.ascending_descending == 'descending':
+            data = -data
+        # Ties by the column, like sort_L of the backends
+        return np.lexsort((indices, data, rows))
+
+    def batch_payments(self, plan, incomings, backend=None, workspace=None):
+        # The NumPy kernel on all scenarios at once (the compiled kernels run one scenario at a time), summed like
+        # Simulation does, so that rounding (and thus defaults) are the same
+        if workspace is None:
+            workspace = Workspace(plan)
+        scenarios = np.ascontiguousarray(incomings.T)
+        sink_out = np.empty_like(scenarios) if plan.outflows is not None else None
+        payments = payments_largest_creditor(plan, scenarios, self.pay_remaining_money, sink_out=sink_out)
+        total_payments = workspace.row_sums(payments, out=np.empty_like(scenarios))
+        total_receiving = workspace.column_sums(payments, out=np.empty_like(scenarios))
+        exogenous_payments = np.zeros_like(scenarios)
+        if plan.outflows is not None:
+            total_payments += sink_out
+            exogenous_payments = sink_out
+        return total_payments.T, total_receiving.T, exogenous_payments.T
+    
     def payments_matrix(self, simulation):
         super().payments_matrix(simulation)
         
-        return cython_payments(simulation, strategy='largest_creditor', last_first=self.last_first, pay_remaining_money=self.pay_remaining_money)
+        plan = self.simulation_plan(simulation)
+        amounts_payed = self.get_backend(simulation=simulation).payments_largest_creditor(
+            plan, simulation.total_incoming, self.pay_remaining_money)
+        return sparse.csr_matrix((amounts_payed, plan.L.indices.copy(), plan.L.indptr.copy()), shape=plan.L.shape)
+    
+    def edge_payments(self, plan, incomings, backend=None, out=None, workspace=None, sink_out=None):
+        return self.get_backend(backend).payments_largest_creditor(plan, incomings, self.pay_remaining_money,
+                                                                   out=out, workspace=workspace, sink_out=sink_out)
     
     
 class LargestCreditorFirst(LargestCreditor):
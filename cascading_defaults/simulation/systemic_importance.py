@@ -0,0 +1,167 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+from cascading_defaults.simulation.batch import clear_batch
+from cascading_defaults.simulation.strategies import DefaultStrategy
+
+# Shared with the worker processes (set once per worker, not pickled per batch)
+_worker_state = {}
+
+
+def _init_worker(strategy, L, start_reserves, exogenous_cashflow, rtol, max_iter, exogenous_outflow=None,
+                 baseline_defaulted=None):
+    _worker_state.update(strategy=strategy, L=L, start_reserves=start_reserves,
+                         exogenous_cashflow=exogenous_cashflow, rtol=rtol, max_iter=max_iter,
+                         exogenous_outflow=exogenous_outflow, baseline_defaulted=baseline_defaulted)
+
+
+def _run_scenarios(failed_nodes):
+    """
+    Runs a batch of single-node failure scenarios. Returns the per-scenario results, without the (N,B) arrays: the
+    defaults, and the defaults caused (the nodes that don't default in the baseline, without the failed node itself).
+    """
+    state = _worker_state
+    B = len(failed_nodes)
+    reserves = np.tile(state['start_reserves'].reshape((-1,1)), (1, B))
+    exogenous_cashflows = np.tile(state['exogenous_cashflow'].reshape((-1,1)), (1, B))
+    results = clear_batch(state['strategy'], state['L'], reserves, exogenous_cashflows=exogenous_cashflows,
+                          failed_nodes=failed_nodes, rtol=state['rtol'], max_iter=state['max_iter'],
+                          exogenous_outflows=state['exogenous_outflow'])
+    defaulted = results['default_stage'] > 0
+    defaults = defaulted.sum(axis=0)
+    defaulted[failed_nodes, np.arange(B)] = False
+    if state['baseline_defaulted'] is not None:
+        defaulted &= ~state['baseline_defaulted'].reshape((-1,1))
+    return failed_nodes, results['size_p'], defaults, defaulted.sum(axis=0), results['stages']
+
+
+class SystemicImportance:
+
+    def __init__(self, strategy, L, exogenous_cashflow=np.zeros(0), start_reserves=0,
+                 label_of_network='random_network', force_update_L=False, exogenous_outflow=None):
+        """
+        Ranks every node by the cascade it triggers when it fails: the defaults it causes and the flow that is lost.
+        L is prepared once for the strategy and shared by all the scenarios.
+        Inputs:
+        strategy: cascading_defaults.simulation.Strategy instance
+        L: scipy sparse edgelist
+        start_reserves: np.array with shape = (1,N) or float
+        exogenous_cashflow: np.array with shape (1,N)
+        exogenous_outflow: np.array with shape (1,N), what the nodes owe the outside world (see Simulation)
+        """
+        assert isinstance(strategy, DefaultStrategy), f'Strategy {strategy} is of type ' \
+                                                      f'{type(strategy)} and not of type {DefaultStrategy}.'
+        self.strategy = strategy
+        self.label = f'SystemicImportance_{self.strategy.label}'
+        self.transaction_network = label_of_network
+
+        # Load right L (once, for all the scenarios)
+        self.L = self.strategy.select_right_L(L, label_of_network, force_update_L).tocsr()
+        self.N = self.L.shape[0]
+
+        if isinstance(start_reserves, np.ndarray):
+            self.start_reserves = np.array(start_reserves, dtype=np.float64).flatten()
+        else:
+            self.start_reserves = np.full(self.N, start_reserves, dtype=np.float64)
+
+        if self.strategy.has_exogenous:
+            self.exogenous_cashflow = np.array(exogenous_cashflow, dtype=np.float64).flatten()
+            self.exogenous_outflow = np.zeros(self.N) if exogenous_outflow is None else \
+                np.array(exogenous_outflow, dtype=np.float64).flatten()
+        else:
+            self.exogenous_cashflow = np.zeros(self.N)
+            self.exogenous_outflow = None
+
+        self.total_payables_array = np.array(self.L.sum(axis=1)).flatten()
+        if self.exogenous_outflow is not None:
+            self.total_payables_array += self.exogenous_outflow
+
+        self.has_run = False
+
+    def select_nodes(self, nodes=None, sample=None, top_k=None, seed=0):
+        """
+        Returns the nodes to shock.
+        nodes: list of nodes, default all nodes with obligations
+        sample: int (number of nodes) or float (fraction of nodes), a random sample of the nodes
+        top_k: int, only the k nodes with the largest total payables
+        """
+        if nodes is None:
+            nodes = np.flatnonzero(self.total_payables_array)
+        nodes = np.asarray(nodes)
+        if top_k:
+            # Failures of nodes with small obligations can't cause large cascades, skip those
+            order = np.argsort(self.total_payables_array[nodes], kind='stable')[::-1]
+            nodes = nodes[order[:top_k]]
+        if sample:
+            size = sample if isinstance(sample, (int, np.integer)) else int(round(sample*len(nodes)))
+            rng = np.random.default_rng(seed)
+            nodes = np.sort(rng.choice(nodes, size=min(size, len(nodes)), replace=False))
+        return nodes
+
+    def run(self, nodes=None, sample=None, top_k=None, batch_size=64, processes=None, rtol=5e-2, max_iter=None,
+            seed=0, verbose=1):
+        """
+        Runs all single-node failure scenarios, batch_size scenarios per batch, on processes cores (default all).
+        The results are stored in self.results (pd.DataFrame, one row per shocked node), sorted by flow lost.
+        """
+        verboseprint = print if verbose else lambda *a, **k: None
+        print(f'Running {self.label}.')
+
+        nodes = self.select_nodes(nodes, sample=sample, top_k=top_k, seed=seed)
+
+        # The baseline: nobody fails
+        baseline = clear_batch(self.strategy, self.L, self.start_reserves.reshape((-1,1)),
+                               exogenous_cashflows=self.exogenous_cashflow.reshape((-1,1)), rtol=rtol,
+                               max_iter=max_iter, exogenous_outflows=self.exogenous_outflow)
+        self.baseline_size_p = baseline['size_p'][0]
+        self.baseline_defaulted = baseline['default_stage'][:, 0] > 0
+        self.baseline_defaults = int(self.baseline_defaulted.sum())
+
+        batches = [nodes[i:i+batch_size] for i in range(0, len(nodes), batch_size)]
+        processes = processes or os.cpu_count()
+        initargs = (self.strategy, self.L, self.start_reserves, self.exogenous_cashflow, rtol, max_iter,
+                    self.exogenous_outflow, self.baseline_defaulted)
+        _init_worker(*initargs)
+
+        outputs = []
+        if processes == 1 or len(batches) <= 1:
+            for batch in batches:
+                outputs.append(_run_scenarios(batch))
+                verboseprint(f'\rscenarios done: {sum(len(o[0]) for o in outputs):<8}/ {len(nodes)}', end='')
+        else:
+            with multiprocessing.Pool(processes, initializer=_init_worker, initargs=initargs) as pool:
+                for output in pool.imap_unordered(_run_scenarios, batches):
+                    outputs.append(output)
+                    verboseprint(f'\rscenarios done: {sum(len(o[0]) for o in outputs):<8}/ {len(nodes)}', end='')
+        verboseprint('')
+
+        if outputs:
+            failed_nodes, size_p, defaults, defaults_caused, stages = (np.concatenate(o) for o in zip(*outputs))
+        else:
+            failed_nodes, size_p, defaults, defaults_caused, stages = (
+                np.zeros(0, dtype=int), np.zeros(0), np.zeros(0, dtype=int), np.zeros(0, dtype=int),
+                np.zeros(0, dtype=int))
+
+        self.results = (
+            pd.DataFrame({
+                'node': failed_nodes,
+                'total_payables': self.total_payables_array[failed_nodes],
+                'defaults': defaults,
+                'defaults_caused': defaults_caused,
+                'flow': size_p,
+                'flow_lost': self.baseline_size_p - size_p,
+                'flow_lost_relative': (self.baseline_size_p - size_p)/self.baseline_size_p
+                                      if self.baseline_size_p else np.zeros(len(size_p)),
+                'stages': stages
+            })
+            .set_index('node')
+            .sort_values(['flow_lost', 'defaults_caused'], ascending=False)
+        )
+        self.has_run = True
+
+        print(f'Done with {self.label}.')
+
+        return self
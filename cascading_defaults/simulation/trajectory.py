@@ -0,0 +1,230 @@
+import os
+import pickle
+
+import numpy as np
+from scipy import sparse
+
+from .. import current_dir
+
+
+def _changes(new, old):
+    """
+    Returns the positions where new differs from old, and the new values there. When most values changed, all
+    values are returned, without positions (dense is True).
+    """
+    positions = np.flatnonzero(new != old)
+    if 2*len(positions) > len(new):
+        return positions[:0], np.array(new), True
+    return positions, new[positions], False
+
+
+class TrajectoryRecorder:
+
+    def __init__(self, folder, keyframe_interval=100, chunk_stages=50, compress=True):
+        """
+        Records the payments (p), reserves and defaults of every stage of a simulation to disk. Per stage only the
+        edges (and nodes) of which the value changed are stored, in chunks of chunk_stages stages, with a full copy
+        (keyframe) every keyframe_interval stages. Any stage can then be reconstructed from the keyframe before it
+        (see Trajectory).
+        Inputs:
+        folder: str, relative to the current directory, the existing log in it is replaced
+        keyframe_interval: int, stages between the keyframes
+        chunk_stages: int, stages per file of changes
+        compress: bool, store the files compressed (np.savez_compressed)
+        """
+        self.folder = folder
+        self.path = os.path.join(current_dir, folder)
+        self.keyframe_interval = keyframe_interval
+        self.chunk_stages = chunk_stages
+        self.compress = compress
+        self.recording = False
+
+    def _save(self, filename, **arrays):
+        save = np.savez_compressed if self.compress else np.savez
+        with open(os.path.join(self.path, filename), 'wb') as file:
+            save(file, **arrays)
+
+    def _write_index(self):
+        with open(os.path.join(self.path, 'index.pkl'), 'wb') as file:
+            pickle.dump(self.index, file)
+
+    def start(self, L, p_data, reserves, defaulted):
+        """
+        Starts the log with stage 0, the state before the first stage.
+        Inputs:
+        L: scipy sparse CSR matrix, the prepared L of which p_data are the payments
+        p_data: np.array aligned with L.data
+        reserves: np.array with shape (N,)
+        defaulted: np.array of bools with shape (N,)
+        """
+        os.makedirs(self.path, exist_ok=True)
+        for filename in os.listdir(self.path):
+            if filename.endswith('.npz') or filename == 'index.pkl':
+                os.remove(os.path.join(self.path, filename))
+        self._save('structure.npz', indices=np.asarray(L.indices), indptr=np.asarray(L.indptr),
+                   shape=np.array(L.shape))
+
+        self.index_dtype = np.int32 if max(L.nnz, L.shape[0]) < 2**31 else np.int64
+        self.last_p = np.array(p_data, dtype=np.float64)
+        self.last_reserves = np.array(reserves, dtype=np.float64)
+        self.last_defaulted = np.array(defaulted, dtype=bool)
+        self.index = {'keyframes': [], 'chunks': [], 'stages': 0, 'keyframe_interval': self.keyframe_interval}
+        self._keyframe(0)
+        self._new_chunk()
+        self.recording = True
+
+    def _keyframe(self, stage):
+        self._save(f'keyframe_{stage:07d}.npz', p_data=self.last_p, reserves=self.last_reserves,
+                   defaulted=np.flatnonzero(self.last_defaulted).astype(self.index_dtype))
+        self.index['keyframes'].append(stage)
+
+    def _new_chunk(self):
+        self.chunk = {name: [] for name in ('stages', 'p_positions', 'p_values', 'p_dense', 'reserves_positions',
+                                            'reserves_values', 'reserves_dense', 'new_defaults')}
+
+    def _write_chunk(self):
+        stages = self.chunk['stages']
+        if not stages:
+            return
+        arrays = {'stages': np.array(stages, dtype=np.int64), 'p_dense': np.array(self.chunk['p_dense']),
+                  'reserves_dense': np.array(self.chunk['reserves_dense'])}
+        for name in ('p', 'reserves', 'new_defaults'):
+            keys = (f'{name}_positions', f'{name}_values') if name != 'new_defaults' else ('new_defaults',)
+            for key in keys:
+                parts = self.chunk[key]
+                # Per array, the dense stages have values without positions
+                counts = [len(part) for part in parts]
+                arrays[f'{key}_offsets'] = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+                dtype = np.float64 if key.endswith('values') else self.index_dtype
+                arrays[key] = np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype=dtype)
+        self._save(f'chunk_{stages[0]:07d}.npz', **arrays)
+        self.index['chunks'].append((stages[0], stages[-1]))
+        self._write_index()
+        self._new_chunk()
+
+    def record(self, stage, p_data, reserves, defaulted):
+        """
+        Records the changes of a stage (stages are numbered 1, 2, ... in order).
+        """
+        p_positions, p_values, p_dense = _changes(p_data, self.last_p)
+        reserves_positions, reserves_values, reserves_dense = _changes(reserves, self.last_reserves)
+        new_defaults = np.flatnonzero(defaulted & ~self.last_defaulted)
+        np.copyto(self.last_p, p_data)
+        np.copyto(self.last_reserves, reserves)
+        self.last_defaulted[new_defaults] = True
+
+        chunk = self.chunk
+        chunk['stages'].append(stage)
+        chunk['p_positions'].append(p_positions.astype(self.index_dtype))
+        chunk['p_values'].append(p_values)
+        chunk['p_dense'].append(p_dense)
+        chunk['reserves_positions'].append(reserves_positions.astype(self.index_dtype))
+        chunk['reserves_values'].append(reserves_values)
+        chunk['reserves_dense'].append(reserves_dense)
+        chunk['new_defaults'].append(new_defaults.astype(self.index_dtype))
+        self.index['stages'] = stage
+
+        # The changes up to a keyframe are in the chunks before it
+        if stage % self.keyframe_interval == 0:
+            self._write_chunk()
+            self._keyframe(stage)
+        elif len(chunk['stages']) >= self.chunk_stages:
+            self._write_chunk()
+
+    def close(self):
+        """
+        Writes the last chunk and the index, the log is complete.
+        """
+        if not self.recording:
+            return
+        self._write_chunk()
+        self._write_index()
+        self.last_p = self.last_reserves = self.last_defaulted = None
+        self.recording = False
+
+
+class Trajectory:
+
+    def __init__(self, folder):
+        """
+        Reads the log of a TrajectoryRecorder: the payments, reserves and defaults of any stage.
+        Inputs:
+        folder: str, relative to the current directory
+        """
+        self.path = os.path.join(current_dir, folder)
+        with open(os.path.join(self.path, 'index.pkl'), 'rb') as file:
+            self.index = pickle.load(file)
+        with np.load(os.path.join(self.path, 'structure.npz')) as structure:
+            self.indices, self.indptr = structure['indices'], structure['indptr']
+            self.shape = tuple(structure['shape'])
+        self.stages = self.index['stages']
+        self.keyframes = np.array(self.index['keyframes'])
+        self.chunk_starts = np.array([first for first, last in self.index['chunks']], dtype=np.int64)
+        self._cached_chunk = (None, None)
+
+    def _load(self, filename):
+        with np.load(os.path.join(self.path, filename)) as file:
+            return {key: file[key] for key in file.files}
+
+    def _chunk(self, start):
+        # The last chunk is kept, as replay reads the stages of a chunk one after another
+        if self._cached_chunk[0] != start:
+            self._cached_chunk = (start, self._load(f'chunk_{start:07d}.npz'))
+        return self._cached_chunk[1]
+
+    def _apply(self, stage, p_data, reserves, defaulted):
+        chunk_start = self.chunk_starts[np.searchsorted(self.chunk_starts, stage, side='right') - 1]
+        chunk = self._chunk(chunk_start)
+        i = stage - chunk['stages'][0]
+        for name, values in (('p', p_data), ('reserves', reserves)):
+            first, last = chunk[f'{name}_values_offsets'][i:i+2]
+            if chunk[f'{name}_dense'][i]:
+                values[:] = chunk[f'{name}_values'][first:last]
+            else:
+                first_position, last_position = chunk[f'{name}_positions_offsets'][i:i+2]
+                values[chunk[f'{name}_positions'][first_position:last_position]] = chunk[f'{name}_values'][first:last]
+        first, last = chunk['new_defaults_offsets'][i:i+2]
+        defaulted[chunk['new_defaults'][first:last]] = True
+
+    def replay(self, start=0, stop=None):
+        """
+        Generator of (stage, p_data, reserves, defaulted) for the stages start up to and including stop (default the
+        last). The arrays are updated in place from stage to stage, copy them to keep them.
+        """
+        stop = self.stages if stop is None else min(stop, self.stages)
+        if not 0 <= start <= stop:
+            raise Exception(f'Stages {start} to {stop} are not in the trajectory (0 to {self.stages}).')
+        keyframe = self.keyframes[np.searchsorted(self.keyframes, start, side='right') - 1]
+        state = self._load(f'keyframe_{keyframe:07d}.npz')
+        p_data, reserves = state['p_data'], state['reserves']
+        defaulted = np.zeros(self.shape[0], dtype=bool)
+        defaulted[state['defaulted']] = True
+        for stage in range(keyframe + 1, start + 1):
+            self._apply(stage, p_data, reserves, defaulted)
+        yield start, p_data, reserves, defaulted
+        for stage in range(start + 1, stop + 1):
+            self._apply(stage, p_data, reserves, defaulted)
+            yield stage, p_data, reserves, defaulted
+
+    def state(self, stage):
+        """
+        Returns p (scipy sparse CSR matrix), reserves (np.array) and the defaulted nodes (np.array) after stage.
+        """
+        _, p_data, reserves, defaulted = next(self.replay(stage, stage))
+        p = sparse.csr_matrix((p_data, self.indices.copy(), self.indptr.copy()), shape=self.shape)
+        return p, reserves, np.flatnonzero(defaulted)
+
+    def payments(self, stage):
+        return self.state(stage)[0]
+
+    def reserves(self, stage):
+        return self.state(stage)[1]
+
+    def defaults(self, stage):
+        return self.state(stage)[2]
+
+    def nbytes(self):
+        """
+        Returns the number of bytes of the log on disk.
+        """
+        return sum(os.path.getsize(os.path.join(self.path, filename)) for filename in os.listdir(self.path))
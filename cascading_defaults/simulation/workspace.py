@@ -0,0 +1,230 @@
+import tempfile
+
+import numpy as np
+from scipy import sparse
+
+# Scratch buffers of the kernels, by name: (length, dtype). These are allocated at first use only, thus a
+# strategy (or backend) that doesn't need one doesn't pay for it
+_scratch_buffers = {
+    'float_N': ('N', np.float64),
+    'float_N_2': ('N', np.float64),
+    'float_N_3': ('N', np.float64),
+    'bool_N': ('N', bool),
+    'bool_N_2': ('N', bool),
+    'bool_N_3': ('N', bool),
+    'float_nnz': ('nnz', np.float64),
+    'float_nnz_2': ('nnz', np.float64),
+    'bool_nnz': ('nnz', bool),
+    'bool_nnz_2': ('nnz', bool),
+}
+
+
+class Workspace:
+
+    def __init__(self, plan, low_memory=False, payments=True):
+        """
+        Preallocated buffers for the stages of a simulation on one plan. The kernels write into these (out=) and the
+        reductions are done in place, thus a stage allocates nothing proportional to N or nnz.
+        Inputs:
+        plan: StrategyPlan of the prepared L, with an out-of-core plan (row_blocks) the payments are memory-mapped to a
+              temporary file and the scratch buffers have the size of a block of rows
+        low_memory: bool, keep only the payments of the current stage, convergence is then checked on the total
+                    payments and receiving (N-length vectors) instead of on the payments of every edge
+        payments: bool, allocate the buffers of the payments (p_data and previous_p_data), not when these are elsewhere
+        """
+        self.plan = plan
+        self.N = N = plan.N
+        self.nnz = nnz = plan.L.nnz
+        self.scratch_nnz = plan.max_block_nnz
+        self.out_of_core = plan.row_blocks is not None
+        self.low_memory = low_memory or self.out_of_core
+
+        # Payments of the current and the previous stage (swapped every stage)
+        if not payments:
+            self.p_data = None
+        elif self.out_of_core:
+            # An anonymous file, removed when the payments aren't used anymore
+            self.p_data = np.memmap(tempfile.TemporaryFile(), dtype=np.float64, mode='w+', shape=(nnz,))
+            for start, stop, first_edge, last_edge in plan.blocks():
+                self.p_data[first_edge:last_edge] = plan.L.data[first_edge:last_edge]
+        else:
+            self.p_data = np.array(plan.L.data, dtype=np.float64)
+        self.previous_p_data = None if self.low_memory or not payments else np.empty(nnz)
+
+        # Payments to the outside world (the virtual sink node of the exogenous outflows), swapped with the payments
+        self.sink_payments = self.previous_sink_payments = None
+        if plan.outflows is not None:
+            self.sink_payments = np.array(plan.outflows)
+            self.previous_sink_payments = None if self.low_memory else np.empty(N)
+
+        # Totals of the previous stage, for the convergence check in low-memory mode
+        self.previous_total_payments = np.zeros(N) if self.low_memory else None
+        self.previous_total_receiving = np.zeros(N) if self.low_memory else None
+
+        # Defaults
+        self.defaulting = np.zeros(N, dtype=bool)
+        self.new_defaults = np.zeros(N, dtype=bool)
+        self.defaulted = np.zeros(N, dtype=bool)
+
+        # Row sums like scipy does them (np.add.reduceat over the non-empty rows), so that the rounding equals the
+        # one of the total payables
+        self.nonempty_rows = np.flatnonzero(np.diff(plan.L.indptr))
+        self.row_starts = plan.L.indptr[self.nonempty_rows].astype(np.intp)
+        self.row_sums_buffer = np.empty(len(self.nonempty_rows))
+
+        # Column sums over the edges in transposed (CSC) order, set up at first use
+        self.transposed_order = None
+
+        # The edges around the virtual edges to the outside world (see payments.sink_index), set up at first use
+        self.sink_indices = None
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set yet
+        if name not in _scratch_buffers:
+            raise AttributeError(f'{type(self).__name__} has no attribute {name}.')
+        length, dtype = _scratch_buffers[name]
+        buffer = np.empty(self.N if length == 'N' else self.scratch_nnz, dtype=dtype)
+        setattr(self, name, buffer)
+        return buffer
+
+    @staticmethod
+    def estimate_nbytes(N, nnz, low_memory=False):
+        """
+        Returns an upper bound of the number of bytes of a workspace (all scratch buffers in use).
+        """
+        nbytes = 10*N*8
+        if low_memory:
+            # Payments, and the scratch of the NumPy kernels
+            return nbytes + 2*N*8 + nnz*(8 + 8 + 2)
+        # Payments of two stages, the scratch of the NumPy kernels and the transposed order
+        return nbytes + nnz*(2*8 + 2*8 + 2 + 8)
+
+    def release_scratch(self):
+        """
+        Frees the scratch buffers, they are allocated again when needed.
+        """
+        for name in list(_scratch_buffers) + ['kept_p_data', 'kept_sink_payments']:
+            self.__dict__.pop(name, None)
+        self.transposed_order = None
+        self.sink_indices = None
+
+    def payments_matrix(self):
+        """
+        Returns the payments (p_data) as a CSR-matrix with its own indices, as scipy sorts these in place. Out-of-core,
+        these are memory-mapped to a temporary file as well.
+        """
+        L = self.plan.L
+        if self.out_of_core:
+            indices = np.memmap(tempfile.TemporaryFile(), dtype=L.indices.dtype, mode='w+', shape=(self.nnz,))
+            for start, stop, first_edge, last_edge in self.plan.blocks():
+                indices[first_edge:last_edge] = L.indices[first_edge:last_edge]
+        else:
+            indices = L.indices.copy()
+        return sparse.csr_matrix((self.p_data, indices, np.array(L.indptr)), shape=L.shape, copy=False)
+
+    def swap(self):
+        """
+        The payments that were just calculated (in previous_p_data) become the current ones.
+        """
+        self.p_data, self.previous_p_data = self.previous_p_data, self.p_data
+        self.sink_payments, self.previous_sink_payments = self.previous_sink_payments, self.sink_payments
+
+    def keep_payments(self):
+        """
+        In low-memory mode, keeps a copy of the payments of this stage (and to the outside world), which
+        restore_payments sets back. Otherwise the payments of the previous stage are kept anyway.
+        """
+        if not self.low_memory:
+            return
+        if getattr(self, 'kept_p_data', None) is None:
+            self.kept_p_data = np.memmap(tempfile.TemporaryFile(), dtype=np.float64, mode='w+', shape=(self.nnz,)) \
+                if self.out_of_core else np.empty(self.nnz)
+        for start, stop, first_edge, last_edge in self.plan.blocks():
+            self.kept_p_data[first_edge:last_edge] = self.p_data[first_edge:last_edge]
+        self.kept_sink_payments = None if self.sink_payments is None else np.array(self.sink_payments)
+
+    def restore_payments(self):
+        """
+        Sets the payments back to those of the previous stage (those of keep_payments in low-memory mode), e.g. when
+        the stage is not used.
+        """
+        if not self.low_memory:
+            self.swap()
+            return
+        for start, stop, first_edge, last_edge in self.plan.blocks():
+            self.p_data[first_edge:last_edge] = self.kept_p_data[first_edge:last_edge]
+        if self.sink_payments is not None:
+            np.copyto(self.sink_payments, self.kept_sink_payments)
+
+    def row_sums(self, data, out):
+        """
+        Sums of data (aligned with the edges) per row into out, data with shape (B,nnz) gives the sums of B scenarios
+        (out with shape (B,N)).
+        """
+        out.fill(0.)
+        if len(self.row_starts):
+            if data.ndim > 1:
+                out[:, self.nonempty_rows] = np.add.reduceat(data, self.row_starts, axis=1)
+                return out
+            np.add.reduceat(data, self.row_starts, out=self.row_sums_buffer)
+            out[self.nonempty_rows] = self.row_sums_buffer
+        return out
+
+    def column_sums(self, data, out):
+        """
+        Sums of data (aligned with the edges) per column into out, like row_sums.
+        """
+        out.fill(0.)
+        if self.low_memory:
+            # Without the order of the edges in CSC (nnz indices more), bincount adds the edges in the order of the
+            # rows instead, thus the rounding can differ slightly from the sums in CSC order
+            for start, stop, first_edge, last_edge in self.plan.blocks():
+                indices = self.plan.L.indices[first_edge:last_edge]
+                if data.ndim > 1:
+                    for b in range(data.shape[0]):
+                        out[b] += np.bincount(indices, weights=data[b, first_edge:last_edge], minlength=self.N)
+                else:
+                    out += np.bincount(indices, weights=data[first_edge:last_edge], minlength=self.N)
+            return out
+        if self.transposed_order is None:
+            indices = self.plan.L.indices
+            self.transposed_order = np.argsort(indices, kind='stable')
+            counts = np.bincount(indices, minlength=self.plan.N)
+            self.nonempty_columns = np.flatnonzero(counts)
+            self.column_starts = (np.cumsum(counts) - counts)[self.nonempty_columns].astype(np.intp)
+            self.column_sums_buffer = np.empty(len(self.nonempty_columns))
+        if len(self.column_starts) and data.ndim > 1:
+            out[:, self.nonempty_columns] = np.add.reduceat(np.take(data, self.transposed_order, axis=1),
+                                                            self.column_starts, axis=1)
+        elif len(self.column_starts):
+            np.take(data, self.transposed_order, out=self.float_nnz_2)
+            np.add.reduceat(self.float_nnz_2, self.column_starts, out=self.column_sums_buffer)
+            out[self.nonempty_columns] = self.column_sums_buffer
+        return out
+
+    def allclose(self, a, b, rtol=1e-05, atol=1e-08):
+        """
+        np.allclose(a, b, rtol, atol) for N- or nnz-length arrays, without temporaries.
+        """
+        if a.shape[0] == self.N:
+            difference, tolerance, close = self.float_N_2, self.float_N_3, self.bool_N_2
+        else:
+            difference, tolerance, close = self.float_nnz, self.float_nnz_2, self.bool_nnz
+        np.subtract(a, b, out=difference)
+        np.abs(difference, out=difference)
+        np.abs(b, out=tolerance)
+        np.multiply(tolerance, rtol, out=tolerance)
+        np.add(tolerance, atol, out=tolerance)
+        np.less_equal(difference, tolerance, out=close)
+        return bool(close.all())
+
+    def converged(self, total_payments, total_receiving, rtol=1e-05):
+        """
+        Low-memory convergence check on the totals of the stage against those of the previous stage, after which the
+        totals are kept for the next stage.
+        """
+        converged = (self.allclose(total_payments, self.previous_total_payments, rtol=rtol) and
+                     self.allclose(total_receiving, self.previous_total_receiving, rtol=rtol))
+        np.copyto(self.previous_total_payments, total_payments)
+        np.copyto(self.previous_total_receiving, total_receiving)
+        return converged
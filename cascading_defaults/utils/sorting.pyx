@@ -2,11 +2,20 @@ cimport numpy as cnp
 import numpy as np
 from scipy import sparse
 
-cdef tuple sort_csr_matrix_rowwise(cnp.int32_t[:] indptr,
-                                    cnp.int32_t[:] indices,
-                                    cnp.float64_t[:] data,
-                                    cnp.int32_t order):
-    cdef cnp.int32_t[:] sorted_indices = np.empty_like(indices)
+# The index arrays of a CSR-matrix are int64 when it has 2**31 edges or more (indptr) or nodes (indices)
+ctypedef fused indptr_t:
+    cnp.int32_t
+    cnp.int64_t
+
+ctypedef fused indices_t:
+    cnp.int32_t
+    cnp.int64_t
+
+def sort_csr_matrix_rowwise(const indptr_t[:] indptr,
+                            const indices_t[:] indices,
+                            const cnp.float64_t[:] data,
+                            cnp.int32_t order):
+    cdef indices_t[:] sorted_indices = np.empty_like(indices)
     cdef cnp.float64_t[:] sorted_data = np.empty_like(data)
     
     cdef list argsort
@@ -14,7 +23,9 @@ cdef tuple sort_csr_matrix_rowwise(cnp.int32_t[:] indptr,
     cdef Py_ssize_t j
     
     for i in range(indptr.shape[0]-1):  # Iterate over all nodes
-        argsort = list(np.argsort(data[indptr[i]:indptr[i+1]]) + indptr[i])[::order]
+        # By the payables, ties by the column (like the NumPy backend)
+        argsort = list(np.lexsort((np.asarray(indices[indptr[i]:indptr[i+1]]),
+                                   order*np.asarray(data[indptr[i]:indptr[i+1]]))) + indptr[i])
         for j in range(len(argsort)):
             #print(f'i: {i}, j: {j}, argsort[j]: {argsort[j]}, data[argsort[j]]: 
             #{data[argsort[j]]}, j + indptr[i]: {j + indptr[i]}')
@@ -1,7 +1,15 @@
 from itertools import product
+import atexit
+import hashlib
+import io
 import os
+import queue
+import threading
+import uuid
+import numpy as np
 import pandas as pd
 import pickle
+from scipy import sparse
 from .. import current_dir
 import shutil
 
@@ -71,6 +79,130 @@ def save_contents(custom_object, upperfolder=None, label=None, remove_existing=T
         pickle.dump(type_of_object, file)
         
         
+class AsyncSaver:
+
+    def __init__(self, max_pending=4):
+        """
+        Saves objects like save_contents, but writes them in a background thread, thus computing goes on while the
+        files are written. An object is pickled (a snapshot) when save is called, and written into a temporary folder
+        that is renamed to its folder when complete, thus a folder never holds half of a save.
+        Inputs:
+        max_pending: int, saves that can wait to be written, after that save blocks until one is written
+        """
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.errors = []
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def save(self, custom_object, upperfolder=None, label=None, remove_existing=True, skip_at_save=[], verbose=0,
+             label_seperate_folder=True, on_saved=None):
+        """
+        Queues a save of all non-trivial attributes of an object, see save_contents.
+        on_saved: function without arguments, called (in the background thread) when the files are written
+        """
+        if hasattr(custom_object, 'label'):
+            label = custom_object.label
+        assert label, 'No valid label for the object'
+        
+        if upperfolder:
+            if label_seperate_folder:
+                path = os.path.join(current_dir, upperfolder, label)
+            else:
+                path = os.path.join(current_dir, upperfolder)
+        else:
+            path = os.path.join(current_dir, label)
+        
+        # The snapshot: every attribute pickled now, the object can change after this
+        skip_at_save = list(skip_at_save) + list(getattr(custom_object, 'skip_at_save', []))
+        files = {}
+        for attribute in custom_object.__dir__():
+            if attribute in skip_at_save:
+                continue
+            value = getattr(custom_object, attribute)
+            if 'method' not in str(type(value)) and '__' not in attribute:
+                if type(value) == pd.DataFrame:
+                    buffer = io.BytesIO()
+                    value.to_pickle(buffer, compression=None)
+                    files[f'{attribute}.df.pkl'] = buffer.getvalue()
+                else:
+                    files[f'{attribute}.pkl'] = pickle.dumps(value)
+        files['type.pkl'] = pickle.dumps(str(type(custom_object)))
+        
+        safe_path = path.replace(os.getcwd(), '~')
+        print(f'Saving to {safe_path}/ (in the background)')
+        self.queue.put((path, files, remove_existing, verbose, on_saved))
+
+    def _writer(self):
+        while True:
+            path, files, remove_existing, verbose, on_saved = self.queue.get()
+            try:
+                self._write(path, files, remove_existing, verbose)
+                if on_saved is not None:
+                    on_saved()
+            except Exception as error:
+                self.errors.append((path, error))
+            finally:
+                self.queue.task_done()
+
+    def _write(self, path, files, remove_existing, verbose):
+        verboseprint = print if verbose else lambda *a, **k: None
+        temporary_path = f'{path}.saving-{uuid.uuid4().hex}'
+        os.makedirs(temporary_path)
+        for filename, contents in files.items():
+            verboseprint(f'Saving {os.path.join(path, filename)}')
+            with open(os.path.join(temporary_path, filename), 'wb') as file:
+                file.write(contents)
+        
+        if os.path.exists(path) and not remove_existing:
+            # Only the files that don't exist yet are added
+            for filename in files:
+                if not os.path.exists(os.path.join(path, filename)):
+                    os.replace(os.path.join(temporary_path, filename), os.path.join(path, filename))
+            shutil.rmtree(temporary_path)
+        elif os.path.exists(path):
+            old_path = f'{path}.removing-{uuid.uuid4().hex}'
+            os.rename(path, old_path)
+            os.rename(temporary_path, path)
+            shutil.rmtree(old_path)
+        else:
+            os.rename(temporary_path, path)
+
+    def wait(self):
+        """
+        Blocks until all queued saves are written, raises an Exception when any of them failed.
+        """
+        self.queue.join()
+        if self.errors:
+            errors, self.errors = self.errors, []
+            raise Exception(f'Saving failed for {len(errors)} object(s): ' +
+                            ', '.join(f'{path} ({error!r})' for path, error in errors))
+
+    def flush(self):
+        self.wait()
+
+
+_background_saver = None
+
+
+def background_saver():
+    """
+    Returns the AsyncSaver shared by all background saves, the pending saves are written before Python exits.
+    """
+    global _background_saver
+    if _background_saver is None:
+        _background_saver = AsyncSaver()
+        atexit.register(_background_saver.wait)
+    return _background_saver
+
+
+def wait_for_saves():
+    """
+    Blocks until all background saves are written (see AsyncSaver.wait).
+    """
+    if _background_saver is not None:
+        _background_saver.wait()
+
+
 def load_contents(empty_object, upperfolder=None, label=None, skip_at_load=[], verbose=0, label_seperate_folder=True, attributes=None):
     """
     Loads all data from a folder into the 'empty object'
@@ -110,6 +242,8 @@ def load_contents(empty_object, upperfolder=None, label=None, skip_at_load=[], v
         for file in files_in_path_old:
             if os.path.split(file)[1].split('.')[0] in attributes:
                 files_in_path.append(file)
+        # In the order of the files
+        attributes = [os.path.split(f)[1].split('.')[0] for f in files_in_path]
     
     if 'skip_at_load' in attributes:
         file = files_in_path[attributes.index('skip_at_load')]
@@ -148,4 +282,188 @@ def select_simulations(simulations, selection):
         features = (type(strategy), strategy.build_reserves, strategy.pay_remaining_money, strategy.has_exogenous)
         if features in selection:
             selected[key] = simulation
-    return selected
\ No newline at end of file
+    return selected
+
+
+def fingerprint(L):
+    """
+    Returns a hash (hex str) of the shape, structure and values of a sparse matrix.
+    """
+    L = sparse.csr_matrix(L)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.array(L.shape, dtype=np.int64).tobytes())
+    for array in [L.indptr, L.indices, L.data]:
+        h.update(str(array.dtype).encode())
+        h.update(memoryview(np.ascontiguousarray(array)))
+    return h.hexdigest()
+
+
+def nbytes(obj, seen=None):
+    """
+    Returns the number of bytes of the np.arrays in obj (arrays, sparse matrices, lists, tuples, dicts and the
+    attributes of objects). Arrays shared between (or within) objects are counted once, for which seen (set) can be
+    passed along between calls. Memory-mapped arrays are not counted.
+    """
+    if seen is None:
+        seen = set()
+    if isinstance(obj, np.ndarray):
+        base = obj
+        while isinstance(base.base, np.ndarray):
+            base = base.base
+        if id(base) in seen or isinstance(base, np.memmap):
+            return 0
+        seen.add(id(base))
+        return base.nbytes
+    if sparse.issparse(obj):
+        return sum(nbytes(getattr(obj, name), seen) for name in ['data', 'indices', 'indptr', 'row', 'col']
+                   if hasattr(obj, name))
+    if isinstance(obj, (list, tuple)):
+        return sum(nbytes(value, seen) for value in obj)
+    if isinstance(obj, dict):
+        return sum(nbytes(value, seen) for value in obj.values())
+    if hasattr(obj, '__dict__') and not isinstance(obj, type):
+        if id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+        return sum(nbytes(value, seen) for value in vars(obj).values())
+    return 0
+
+
+def format_bytes(n):
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if abs(n) < 1024:
+            return f'{n:.1f} {unit}'
+        n /= 1024
+    return f'{n:.1f} TB'
+
+
+def row_blocks(indptr, block_size):
+    """
+    Returns the boundaries (np.array of rows) of consecutive blocks of rows of a CSR-matrix with about block_size
+    edges each (a row with more edges is a block of its own).
+    """
+    N = len(indptr) - 1
+    targets = np.arange(block_size, indptr[-1], block_size)
+    boundaries = np.searchsorted(indptr, targets, side='left')
+    return np.unique(np.concatenate([[0], boundaries, [N]])).astype(np.intp)
+
+
+class RowSplice:
+
+    def __init__(self, indptr, rows, counts):
+        """
+        Replaces the edges of some rows of a CSR-matrix. The other rows are copied as they are (contiguous slices
+        between the replaced rows), thus besides copying this takes time proportional to the edges of the replaced
+        rows only.
+        Inputs:
+        indptr: np.array, of the CSR-matrix
+        rows: np.array, the replaced rows (sorted, unique)
+        counts: np.array, the new number of edges of these rows
+        """
+        N = len(indptr) - 1
+        self.rows = np.asarray(rows, dtype=np.intp)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.old_indptr = indptr
+        shift = np.zeros(N+1, dtype=np.int64)
+        shift[self.rows+1] = self.counts - (indptr[self.rows+1] - indptr[self.rows])
+        self.indptr = indptr + np.cumsum(shift)
+        self.nnz = int(self.indptr[-1])
+        if self.indptr.dtype != indptr.dtype and self.nnz < np.iinfo(indptr.dtype).max:
+            self.indptr = self.indptr.astype(indptr.dtype)
+
+        # The rows in between the replaced rows: (first old edge, first new edge, number of edges)
+        first_rows, last_rows = np.concatenate([[0], self.rows+1]), np.concatenate([self.rows, [N]])
+        gaps = np.flatnonzero(indptr[last_rows] > indptr[first_rows])
+        self.gaps = list(zip(indptr[first_rows[gaps]].tolist(), self.indptr[first_rows[gaps]].tolist(),
+                             (indptr[last_rows[gaps]] - indptr[first_rows[gaps]]).tolist()))
+
+        # The new edges of the replaced rows, concatenated in the order of the rows: where they are in the new matrix
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+        self.positions = np.arange(self.offsets[-1]) + np.repeat(self.indptr[self.rows] - self.offsets[:-1],
+                                                                  self.counts)
+
+    def splice(self, old, new):
+        """
+        Returns the np.array aligned with the edges of the new matrix, of old (aligned with the edges of the old
+        matrix) for the rows that aren't replaced and new (the edges of the replaced rows) for the others.
+        """
+        out = np.empty(self.nnz, dtype=old.dtype)
+        for old_first, new_first, count in self.gaps:
+            out[new_first:new_first+count] = old[old_first:old_first+count]
+        out[self.positions] = new
+        return out
+
+
+def save_memmap_csr(L, folder, block_size=2**20, transform=None, verbose=0):
+    """
+    Saves a CSR-matrix as uncompressed .npy files (indptr, indices, data and shape) in folder, which
+    load_memmap_csr maps into memory. L is written in blocks of rows, thus L can be memory-mapped itself.
+    Inputs:
+    transform: function applied to every block of rows (CSR-matrix) before it's written, e.g. sorting the rows. It
+               can't change the number of edges of a row
+    """
+    verboseprint = print if verbose else lambda *a, **k: None
+    # No copy of a (memory-mapped) CSR-matrix, which would make int64 index arrays int32 when these fit
+    L = L if getattr(L, 'format', None) == 'csr' else sparse.csr_matrix(L)
+    os.makedirs(folder, exist_ok=True)
+    safe_path = folder.replace(os.getcwd(), '~')
+    print(f'Saving memory-mapped L to {safe_path}/')
+
+    np.save(os.path.join(folder, 'shape.npy'), np.array(L.shape, dtype=np.int64))
+    open_memmap = np.lib.format.open_memmap
+    # indptr and indices with the same dtype: int64 when either needs it
+    index_dtype = np.result_type(L.indptr.dtype, L.indices.dtype)
+    indptr = open_memmap(os.path.join(folder, 'indptr.npy'), mode='w+', dtype=index_dtype, shape=L.indptr.shape)
+    indices = open_memmap(os.path.join(folder, 'indices.npy'), mode='w+', dtype=index_dtype, shape=(L.nnz,))
+    data = open_memmap(os.path.join(folder, 'data.npy'), mode='w+', dtype=np.float64, shape=(L.nnz,))
+
+    indptr[:] = L.indptr
+    boundaries = row_blocks(L.indptr, block_size)
+    for n, (start, stop) in enumerate(zip(boundaries[:-1], boundaries[1:])):
+        verboseprint(f'\rblock: {n+1:<6}/ {len(boundaries)-1}', end='')
+        block = L[start:stop]
+        if transform is not None:
+            block = sparse.csr_matrix(transform(block))
+            if not np.array_equal(block.indptr, L.indptr[start:stop+1] - L.indptr[start]):
+                raise Exception('transform changed the number of edges of the rows.')
+        indices[L.indptr[start]:L.indptr[stop]] = block.indices
+        data[L.indptr[start]:L.indptr[stop]] = block.data
+    verboseprint('')
+
+    for array in [indptr, indices, data]:
+        array.flush()
+
+
+def load_memmap_csr(folder, mode='r'):
+    """
+    Returns the CSR-matrix that save_memmap_csr saved in folder, of which the arrays are memory-mapped (read-only with
+    mode='r'), thus only the pages in use are in memory. The index arrays keep their dtype (int64 for 2**31 edges or
+    nodes or more).
+    """
+    shape = tuple(int(n) for n in np.load(os.path.join(folder, 'shape.npy')))
+    data, indices, indptr = [np.load(os.path.join(folder, f'{name}.npy'), mmap_mode=mode)
+                             for name in ['data', 'indices', 'indptr']]
+    if indptr.dtype != indices.dtype and (indices.dtype == np.int64 or indptr[-1] < 2**31):
+        # Files of different dtypes, only indptr (N+1) is converted
+        indptr = np.asarray(indptr, dtype=indices.dtype)
+
+    # Not through the constructor, which copies int64 index arrays into memory as int32 when these fit
+    L = sparse.csr_matrix(shape, dtype=data.dtype)
+    L.data, L.indices, L.indptr = data, indices, indptr
+    return L
+
+
+def split_sink_node(L, sink=0):
+    """
+    Converts a network in which node sink is the outside world (the former L_sinknode networks) to the exogenous
+    outflows of Simulation: returns L without the edges of the sink node (same shape, the sink node is then an
+    isolated node) and the obligations of every node to the sink node (np.array with shape (N,)).
+    The obligations of the sink node itself are dropped, it never paid these (its reserves were 0).
+    """
+    L = sparse.csr_matrix(L, dtype=np.float64, copy=True)
+    exogenous_outflow = np.array(L[:, sink].toarray()).flatten()
+    exogenous_outflow[sink] = 0.
+    L = L.tocoo()
+    keep = (L.row != sink) & (L.col != sink)
+    L = sparse.csr_matrix((L.data[keep], (L.row[keep], L.col[keep])), shape=L.shape)
+    return L, exogenous_outflow
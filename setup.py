@@ -30,5 +30,8 @@ setup(
         'pandas',
         'scipy'
     ],
+    extras_require={
+        'numba': ['numba']
+    },
     version='0.0.1'
 )
\ No newline at end of file
@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+# The package keeps its files (prepared L's, simulations, the cache) relative to the current directory at import, thus
+# the tests run in a temporary directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='cascading_defaults_tests_'))
+
+from cascading_defaults.simulation.strategies import EisenbergNoe, LargestCreditorFirst, LargestCreditorLast  # noqa
+
+
+def random_network(N=120, density=0.04, seed=1):
+    """
+    Random obligations between N nodes, without self-loops.
+    """
+    L = sparse.random(N, N, density=density, random_state=seed, format='csr')*100
+    L = L - sparse.diags(L.diagonal())
+    L.eliminate_zeros()
+    return L.tocsr()
+
+
+@pytest.fixture
+def network():
+    return random_network()
+
+
+@pytest.fixture
+def label(request):
+    # A label of the network per test, as the prepared L's are stored by label
+    return request.node.name.replace('[', '_').replace(']', '').replace('-', '_')
+
+
+def all_strategies(has_exogenous=False):
+    return [EisenbergNoe(True, True, has_exogenous), LargestCreditorFirst(True, False, has_exogenous),
+            LargestCreditorLast(True, True, has_exogenous), LargestCreditorFirst(False, True, has_exogenous)]
+
+
+@pytest.fixture(params=range(4), ids=['EN', 'LCF', 'LCL_remaining', 'LCF_no_reserves'])
+def strategy(request):
+    return all_strategies()[request.param]
+
+
+@pytest.fixture(params=range(4), ids=['EN', 'LCF', 'LCL_remaining', 'LCF_no_reserves'])
+def exogenous_strategy(request):
+    return all_strategies(has_exogenous=True)[request.param]
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
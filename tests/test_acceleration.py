@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from cascading_defaults.networks import SyntheticNetwork
+from cascading_defaults.simulation import Simulation
+from cascading_defaults.simulation.acceleration import AndersonAccelerator, compare_acceleration
+from cascading_defaults.simulation.strategies import EisenbergNoe, LargestCreditorLast
+
+# Networks on which steps are taken and (with max_growth < 1) rejected
+cases = [(EisenbergNoe, 3), (EisenbergNoe, 2), (LargestCreditorLast, 0)]
+
+
+def _network(seed):
+    return SyntheticNetwork(150, mean_degree=6, seed=seed).generate()
+
+
+@pytest.mark.parametrize('Strategy, seed', cases)
+def test_same_defaults_as_plain(Strategy, seed, label):
+    strategy = Strategy(True, True, False)
+    comparison = compare_acceleration(strategy, _network(seed), AndersonAccelerator(max_growth=0.5), rtol=1e-8,
+                                      max_iter=5000, start_reserves=5., label_of_network=label, force_update_L=True)
+    plain, accelerated = comparison['simulations']['plain'], comparison['simulations']['accelerated']
+    assert comparison['termination_reasons'] == ('converged', 'converged')
+    report = accelerated.acceleration
+    assert report['accelerated'] > 0 and report['rejected'] > 0
+    # The stages of rejected steps don't count
+    assert len(accelerated.size_p) == report['stages'] - report['rejected']
+    assert comparison['accelerated_stages'] == report['stages']
+    assert sorted(accelerated.defaulted_nodes) == sorted(plain.defaulted_nodes)
+    assert len(set(accelerated.defaulted_nodes)) == len(accelerated.defaulted_nodes)
+    np.testing.assert_allclose(accelerated.total_payments_array, plain.total_payments_array, rtol=1e-6, atol=1e-6)
+
+
+@pytest.mark.parametrize('Strategy, seed', cases)
+def test_low_memory_equals_default(Strategy, seed, label):
+    # The payments of a rejected stage are set back by a copy in low-memory mode and by the buffers otherwise
+    simulations = {}
+    for low_memory in (False, True):
+        simulation = Simulation(Strategy(True, True, False), _network(seed), label_of_run='run', start_reserves=5.,
+                                label_of_network=label, force_update_L=not simulations, low_memory=low_memory)
+        simulations[low_memory] = simulation.run(rtol=1e-8, max_iter=5000, verbose=0,
+                                                 accelerator=AndersonAccelerator(max_growth=0.5))
+    default, low_memory = simulations[False], simulations[True]
+    assert low_memory.acceleration == default.acceleration
+    assert len(low_memory.size_p) == len(default.size_p)
+    np.testing.assert_allclose(low_memory.p.toarray(), default.p.toarray(), rtol=1e-9, atol=1e-9)
+    assert low_memory.defaulted_nodes == default.defaulted_nodes
+
+
+def test_money_kept(label):
+    # The reserves (without what is received in the last stage) and the payments add up to the start reserves,
+    # also after a rejected step
+    simulation = Simulation(EisenbergNoe(True, True, False), _network(3), label_of_run='run', start_reserves=5.,
+                            label_of_network=label, force_update_L=True)
+    total = simulation.reserves.sum()
+    simulation.run(rtol=1e-8, max_iter=5000, verbose=0, accelerator=AndersonAccelerator(max_growth=0.5))
+    assert simulation.acceleration['rejected'] > 0
+    assert simulation.reserves.sum() + simulation.total_payments_array.sum() == pytest.approx(total, rel=1e-9)
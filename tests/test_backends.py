@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from cascading_defaults.simulation import Simulation
+from cascading_defaults.simulation.backends import (available_backends, check_backends, get_backend, set_backend,
+                                                    backends)
+from cascading_defaults.simulation.strategies import LargestCreditorFirst, LargestCreditorLast
+
+
+def _with_ties(seed=0, N=60):
+    # Integer payables, thus many ties within the rows
+    L = sparse.random(N, N, density=0.2, random_state=seed, format='csr')
+    L.data = np.ceil(L.data*4)
+    return L
+
+
+def test_check_backends():
+    differences = check_backends(n_networks=2, N=80, atol=0.)
+    assert set(differences) == set(available_backends())
+
+
+@pytest.mark.parametrize('order', ['ascending', 'descending'])
+def test_sort_L_equal_with_ties(order):
+    L = _with_ties()
+    reference = backends['numpy'].sort_L(L, order)
+    for name in available_backends():
+        sorted_L = get_backend(name).sort_L(L, order)
+        for attribute in ('data', 'indices', 'indptr'):
+            np.testing.assert_array_equal(getattr(sorted_L, attribute), getattr(reference, attribute),
+                                          err_msg=f'{name} {attribute}')
+    # Ties by the column
+    for i in range(L.shape[0]):
+        row = slice(reference.indptr[i], reference.indptr[i+1])
+        keys = list(zip(reference.data[row] if order == 'ascending' else -reference.data[row], reference.indices[row]))
+        assert keys == sorted(keys)
+
+
+@pytest.mark.parametrize('order', ['ascending', 'descending'])
+def test_cython_sorts_equal(order):
+    cython_defaults = pytest.importorskip('cython_defaults')
+    L = _with_ties(seed=3)
+    reference = backends['numpy'].sort_L(L, order)
+    sorted_L = cython_defaults.sort_L_cython(L, order)
+    np.testing.assert_array_equal(sorted_L.indices, reference.indices)
+    np.testing.assert_array_equal(sorted_L.data, reference.data)
+
+
+@pytest.mark.parametrize('Strategy', [LargestCreditorFirst, LargestCreditorLast])
+def test_edge_order_equals_sort_L(Strategy):
+    strategy = Strategy(True, True, False)
+    L = _with_ties(seed=1)
+    sorted_L = strategy.process_L_for_strategy(L)
+    coo = L.tocoo()
+    rng = np.random.default_rng(0)
+    shuffle = rng.permutation(coo.nnz)
+    rows, cols, data = coo.row[shuffle], coo.col[shuffle], coo.data[shuffle]
+    order = strategy.edge_order(rows, cols, data)
+    np.testing.assert_array_equal(cols[order], sorted_L.indices)
+    np.testing.assert_array_equal(data[order], sorted_L.data)
+
+
+@pytest.mark.parametrize('Strategy', [LargestCreditorFirst, LargestCreditorLast])
+def test_simulations_equal_per_backend(Strategy, label):
+    L = _with_ties(seed=2)
+    results = {}
+    for name in available_backends():
+        strategy = Strategy(True, True, True)
+        simulation = Simulation(strategy, L, label_of_run=name, start_reserves=1., label_of_network=f'{label}_{name}',
+                                force_update_L=True, backend=name, exogenous_outflow=np.full(L.shape[0], 2.))
+        results[name] = simulation.run(rtol=1e-6, max_iter=300, verbose=0)
+    for name, simulation in results.items():
+        np.testing.assert_array_equal(simulation.total_payments_array, results['numpy'].total_payments_array)
+        assert simulation.defaulted_nodes == results['numpy'].defaulted_nodes
+
+
+def test_select_backend():
+    with pytest.raises(Exception, match='does not exist'):
+        get_backend('fortran')
+    try:
+        set_backend('numpy')
+        assert get_backend().name == 'numpy'
+    finally:
+        set_backend(None)
+    assert get_backend().name == available_backends()[0]
+
+
+def _with_index_dtype(L, indptr_dtype, indices_dtype):
+    # Not through the constructor, which makes the index arrays int32 when these fit
+    L = L.copy()
+    L.indptr, L.indices = L.indptr.astype(indptr_dtype), L.indices.astype(indices_dtype)
+    return L
+
+
+@pytest.mark.parametrize('index_dtypes', [(np.int64, np.int64), (np.int64, np.int32)])
+def test_cython_int64_indices(index_dtypes, rng):
+    cython_defaults = pytest.importorskip('cython_defaults')
+    L = backends['numpy'].sort_L(_with_ties(seed=4), 'descending')
+    total_payables = np.array(L.sum(axis=1)).flatten()
+    incomings = total_payables*rng.uniform(0, 1.2, L.shape[0])
+    outflows = rng.uniform(0, 2, L.shape[0])
+    sink_positions = L.indptr[1:].astype(np.int64)
+    reference = cython_defaults.cython_edge_payments(L, total_payables + outflows, incomings, pay_remaining_money=True,
+                                                     outflows=outflows, sink_positions=sink_positions,
+                                                     sink_out=np.empty(L.shape[0]))
+    L64 = _with_index_dtype(L, *index_dtypes)
+    sink_out = np.empty(L.shape[0])
+    payments = cython_defaults.cython_edge_payments(L64, total_payables + outflows, incomings,
+                                                    pay_remaining_money=True, outflows=outflows,
+                                                    sink_positions=sink_positions, sink_out=sink_out)
+    np.testing.assert_array_equal(payments, reference)
+    sorted_L = cython_defaults.sort_L_cython(L64, 'ascending')
+    np.testing.assert_array_equal(sorted_L.indices, backends['numpy'].sort_L(L, 'ascending').indices)
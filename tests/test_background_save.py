@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pytest
+
+from cascading_defaults import current_dir
+from cascading_defaults.simulation import Simulation
+from cascading_defaults.utils import load_contents, wait_for_saves
+from cascading_defaults.utils.utils import AsyncSaver
+
+
+class Results:
+
+    def __init__(self, label, values):
+        self.label = label
+        self.values = values
+
+
+def test_snapshot_at_save(label):
+    saver = AsyncSaver()
+    results = Results(label, np.arange(5.))
+    saver.save(results, upperfolder='saves')
+    # Changes after save are not in the files
+    results.values[:] = -1
+    saver.wait()
+
+    loaded = Results(label, None)
+    load_contents(loaded, upperfolder='saves')
+    np.testing.assert_array_equal(loaded.values, np.arange(5.))
+
+
+def test_replaces_the_folder(label):
+    saver = AsyncSaver()
+    saver.save(Results(label, np.zeros(3)), upperfolder='saves')
+    saver.wait()
+    path = os.path.join(current_dir, 'saves', label)
+    with open(os.path.join(path, 'old.pkl'), 'wb') as file:
+        file.write(b'')
+
+    saver.save(Results(label, np.ones(3)), upperfolder='saves')
+    saver.wait()
+    assert 'old.pkl' not in os.listdir(path)
+    # No temporary folders are left
+    assert [folder for folder in os.listdir(os.path.dirname(path)) if folder.startswith(label)] == [label]
+    loaded = Results(label, None)
+    load_contents(loaded, upperfolder='saves')
+    np.testing.assert_array_equal(loaded.values, np.ones(3))
+
+
+def test_errors_raise_at_wait(label):
+    saver = AsyncSaver()
+    # A file where the folder would go
+    os.makedirs(os.path.join(current_dir, 'saves'), exist_ok=True)
+    with open(os.path.join(current_dir, 'saves', f'{label}.file'), 'wb') as file:
+        file.write(b'')
+    saver.save(Results(label, np.zeros(3)), upperfolder=f'saves/{label}.file/x')
+    with pytest.raises(Exception, match='Saving failed'):
+        saver.wait()
+
+
+def test_background_save_equals_save(network, strategy, label):
+    simulation = Simulation(strategy, network, label_of_run='run', start_reserves=2., label_of_network=label,
+                            force_update_L=True).run(rtol=1e-8, max_iter=500, verbose=0)
+    simulation.save(upperfolder=f'saves/{label}/foreground')
+    simulation.save(upperfolder=f'saves/{label}/background', background=True)
+    wait_for_saves()
+    foreground, background = (sorted(os.listdir(os.path.join(current_dir, f'saves/{label}/{kind}')))
+                              for kind in ('foreground', 'background'))
+    assert foreground == background
+
+    loaded = Simulation(strategy, network, label_of_run='run', label_of_network=label)
+    loaded.load(upperfolder=f'saves/{label}/background')
+    np.testing.assert_array_equal(loaded.reserves, simulation.reserves)
+    np.testing.assert_array_equal(loaded.size_p, simulation.size_p)
+    assert loaded.defaulted_nodes == simulation.defaulted_nodes
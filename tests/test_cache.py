@@ -0,0 +1,67 @@
+import numpy as np
+
+from cascading_defaults.simulation import Simulation
+from cascading_defaults.simulation.cache import ResultCache
+
+
+def _run(strategy, network, label, cache, start_reserves=2., **kwargs):
+    simulation = Simulation(strategy, network, label_of_run='run', start_reserves=start_reserves,
+                            label_of_network=label, **kwargs)
+    return simulation.run(rtol=1e-8, max_iter=500, verbose=0, cache=cache)
+
+
+def test_hit_restores_identical_results(network, strategy, label):
+    cache = ResultCache(folder=f'cache/{label}')
+    ran = _run(strategy, network, label, cache, force_update_L=True)
+    assert not ran.loaded
+    cached = _run(strategy, network, label, cache)
+    assert cached.loaded and cached.has_run
+    assert (cached.p != ran.p).nnz == 0
+    for attribute in ('reserves', 'total_payments_array', 'size_p', 'size_p_relative', 'default_sequence'):
+        np.testing.assert_array_equal(getattr(cached, attribute), getattr(ran, attribute), err_msg=attribute)
+    assert cached.defaulted_nodes == ran.defaulted_nodes
+    assert cached.termination_reason == ran.termination_reason
+    assert sorted(cached.all_defaults) == sorted(ran.all_defaults)
+    for stage, defaults in ran.all_defaults.items():
+        np.testing.assert_array_equal(cached.all_defaults[stage], defaults)
+
+
+def test_other_inputs_miss(network, strategy, label, rng):
+    cache = ResultCache(folder=f'cache/{label}')
+    _run(strategy, network, label, cache, force_update_L=True)
+    assert not _run(strategy, network, label, cache, start_reserves=3.).loaded
+    other_network = network.copy()
+    other_network.data = other_network.data*rng.uniform(0.5, 1.5, network.nnz)
+    assert not _run(strategy, other_network, f'{label}_other', cache, force_update_L=True).loaded
+    # The index is kept on disk
+    assert len(ResultCache(folder=f'cache/{label}').index) == 3
+
+
+def test_least_recently_used_removed(network, strategy, label):
+    cache = ResultCache(folder=f'cache/{label}')
+    _run(strategy, network, label, cache, force_update_L=True)
+    cache.max_bytes = next(iter(cache.index.values()))
+    _run(strategy, network, label, cache, start_reserves=3.)
+    assert len(cache.index) == 1
+    assert not _run(strategy, network, label, cache).loaded
+
+    cache.clear()
+    assert len(cache.index) == 0
+
+
+def test_backend_and_code_in_key(network, label, monkeypatch):
+    from cascading_defaults.simulation import cache as cache_module
+    from cascading_defaults.simulation.backends import available_backends
+    from cascading_defaults.simulation.strategies import LargestCreditorFirst
+    strategy = LargestCreditorFirst(True, True, False)
+    keys = {backend: ResultCache.key(Simulation(strategy, network, label_of_run='run', label_of_network=label,
+                                                force_update_L=True, backend=backend), 1e-8)
+            for backend in available_backends()}
+    assert len(set(keys.values())) == len(keys)
+
+    # The code that clears includes utils and networks
+    assert 'utils' in cache_module._code_folders and 'networks' in cache_module._code_folders
+    version = cache_module.code_version()
+    monkeypatch.setattr(cache_module, '_code_version', None)
+    monkeypatch.setattr(cache_module, '_code_folders', ['simulation'])
+    assert cache_module.code_version() != version
@@ -0,0 +1,65 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from cascading_defaults import current_dir
+from cascading_defaults.simulation import Simulation
+from cascading_defaults.simulation.catalog import Catalog, catalog
+from conftest import all_strategies
+
+
+def _save_runs(network, label):
+    simulations = {}
+    for strategy in all_strategies():
+        for start_reserves in (1., 4.):
+            simulation = Simulation(strategy, network, label_of_run=f'r{start_reserves:g}',
+                                    start_reserves=start_reserves, label_of_network=label,
+                                    force_update_L=not simulations)
+            simulation.run(rtol=1e-8, max_iter=500, verbose=0, save=True)
+            folder = f'simulations/{label}/{simulation.label_of_run}/{strategy.label}'
+            simulations[folder] = simulation
+    return simulations
+
+
+def test_save_records_and_query(network, label):
+    simulations = _save_runs(network, label)
+    rows = catalog().query(network=label)
+    assert sorted(rows['folder']) == sorted(simulations)
+    for _, row in rows.iterrows():
+        simulation = simulations[row['folder']]
+        assert row['defaults'] == len(simulation.defaulted_nodes)
+        assert row['stages'] == len(simulation.size_p)
+        assert row['termination_reason'] == simulation.termination_reason
+        assert row['nnz'] == simulation.L.nnz
+
+    selected = catalog().query(network=label, strategy=['LargestCreditorFirst'], build_reserves=True)
+    assert set(selected['strategy']) == {'LargestCreditorFirst'} and selected['build_reserves'].all()
+    assert len(catalog().query(network=label, where='label_of_run = ?', params=('r4',))) == 4
+    with pytest.raises(Exception, match='Unknown column'):
+        catalog().query(colour='red')
+
+
+def test_load_selected(network, label):
+    simulations = _save_runs(network, label)
+    loaded = catalog().load(network=label, label_of_run='r1')
+    assert len(loaded) == 4
+    for folder, simulation in loaded.items():
+        np.testing.assert_array_equal(simulation.reserves, simulations[folder].reserves)
+        assert simulation.defaulted_nodes == simulations[folder].defaulted_nodes
+
+
+def test_rebuild(network, label):
+    simulations = _save_runs(network, label)
+    rebuilt = Catalog(f'catalogs/{label}.sqlite').rebuild(upperfolder=f'simulations/{label}', verbose=0)
+    rows = rebuilt.query().set_index('folder')
+    recorded = catalog().query(network=label).set_index('folder')
+    assert sorted(rows.index) == sorted(simulations)
+    for column in ('defaults', 'stages', 'termination_reason', 'never_defaulted', 'strategy', 'build_reserves'):
+        assert rows[column].equals(recorded.loc[rows.index, column]), column
+
+    # Rows of removed folders are removed
+    removed = sorted(simulations)[0]
+    shutil.rmtree(os.path.join(current_dir, removed))
+    assert removed not in set(rebuilt.rebuild(upperfolder=f'simulations/{label}', verbose=0).query()['folder'])
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from cascading_defaults.simulation import ContinuationRunner, Simulation
+from cascading_defaults.simulation.strategies import EisenbergNoe, LargestCreditorFirst, LargestCreditorLast
+
+
+def test_refined_points_equal_standalone_runs(network, label, strategy):
+    runner = ContinuationRunner(strategy, network, reserves=np.linspace(0., 200., 5), label_of_network=label,
+                                force_update_L=True, jump=0, max_refinements=2)
+    runner.run(rtol=1e-8, max_iter=500, verbose=0)
+    assert len(runner.bifurcations) > 0
+    assert runner.results['refinement'].max() > 0
+    refined = runner.results[runner.results['refinement'] > 0]
+    for (scale, start_reserves), result in refined.iloc[:3].iterrows():
+        standalone = Simulation(strategy, network, label_of_run='standalone', start_reserves=start_reserves,
+                                label_of_network=label).run(rtol=1e-8, max_iter=500, verbose=0)
+        defaulting = np.flatnonzero(standalone.total_payables_array > standalone.total_payments_array)
+        np.testing.assert_array_equal(runner.points[(start_reserves, scale)]['defaulting'], defaulting)
+        assert result['ever_defaulted'] == len(standalone.defaulted_nodes)
+        if result['start'] == 'cold':
+            assert result['stages'] == len(standalone.size_p)
+        else:
+            assert result['stages'] <= len(standalone.size_p)
+
+
+def test_jump_is_refined(network, label, strategy):
+    reserves = np.linspace(0., 200., 3)
+    runner = ContinuationRunner(strategy, network, reserves=reserves, label_of_network=label, force_update_L=True,
+                                jump=0, max_refinements=3)
+    runner.run(rtol=1e-8, max_iter=500, verbose=0)
+    assert len(runner.bifurcations) > 0
+    for _, bifurcation in runner.bifurcations.iterrows():
+        assert bifurcation['defaults_low'] != bifurcation['defaults_high']
+        # Refined down to steps of the coarse step over 2**max_refinements
+        assert bifurcation['high'] - bifurcation['low'] <= (reserves[1] - reserves[0])/2**3 + 1e-9
+
+
+def test_build_reserves_runs_cold(network, label):
+    runner = ContinuationRunner(EisenbergNoe(True, True, False), network, reserves=np.linspace(0., 200., 3),
+                                label_of_network=label, force_update_L=True, jump=0, max_refinements=1)
+    runner.run(rtol=1e-8, max_iter=500, verbose=0)
+    assert (runner.results['start'] == 'cold').all()
+    assert not runner.states
+
+
+@pytest.mark.parametrize('strategy', [EisenbergNoe(False, True, True), LargestCreditorFirst(False, True, True),
+                                      LargestCreditorLast(False, False, True)], ids=['EN', 'LCF', 'LCL'])
+def test_warm_start_equals_cold_runs(strategy, network, label):
+    """
+    Without build_reserves the warm start only saves stages: the results are those of the cold runs.
+    """
+    rng = np.random.default_rng(5)
+    cashflow = rng.uniform(0, 50, network.shape[0])
+    outflow = rng.uniform(0, 20, network.shape[0])
+    runner = ContinuationRunner(strategy, network, reserves=np.linspace(0., 300., 7), scales=[0.5, 1.],
+                                exogenous_cashflow=cashflow, exogenous_outflow=outflow, label_of_network=label,
+                                force_update_L=True, jump=0, max_refinements=3)
+    runner.run(rtol=5e-2, max_iter=500, verbose=0)
+    assert runner.results['refinement'].max() > 0
+    assert (runner.results['start'] == 'warm').sum() > len(runner.points)/2
+    for point, result in runner.points.items():
+        # From the solved point above it, with the same scale
+        assert result['from'] is None or (result['from'][1] == point[1] and result['from'][0] > point[0])
+        cold = Simulation(strategy, network, label_of_run='cold', start_reserves=point[0], label_of_network=label,
+                          exogenous_cashflow=cashflow*point[1], exogenous_outflow=outflow*point[1])
+        cold.run(rtol=5e-2, max_iter=500, verbose=0)
+        defaulting = np.flatnonzero(cold.total_payables_array > cold.total_payments_array)
+        np.testing.assert_array_equal(result['defaulting'], defaulting)
+        assert result['ever_defaulted'] == len(cold.defaulted_nodes)
+        assert result['termination_reason'] == cold.termination_reason == 'converged'
+        assert result['stages'] <= len(cold.size_p)
+        np.testing.assert_array_equal(runner.states[point][0], cold.p.data)
+        np.testing.assert_array_equal(runner.states[point][1], cold.exogenous_payments)
+
+
+def test_warm_start_saves_stages(network, label):
+    kwargs = dict(reserves=np.linspace(0., 300., 7), label_of_network=label, force_update_L=True, jump=0,
+                  max_refinements=3)
+    strategy = EisenbergNoe(False, True, False)
+    warm = ContinuationRunner(strategy, network, **kwargs).run(rtol=5e-2, max_iter=500, verbose=0)
+    cold = ContinuationRunner(strategy, network, **kwargs).run(rtol=5e-2, max_iter=500, warm_start=False, verbose=0)
+    assert (cold.results['start'] == 'cold').all()
+    assert warm.results.index.equals(cold.results.index)
+    np.testing.assert_array_equal(warm.results['defaults'], cold.results['defaults'])
+    assert warm.results['stages'].sum() < cold.results['stages'].sum()
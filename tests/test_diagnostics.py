@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from cascading_defaults.simulation import Simulation
+from cascading_defaults.simulation.diagnostics import ConvergenceMonitor
+from conftest import all_strategies
+
+
+def _cycle(period, N=5):
+    return [np.arange(N, dtype=np.float64) + k for k in range(period)]
+
+
+def test_detects_cycle():
+    monitor = ConvergenceMonitor(stagnation=False)
+    states = _cycle(3)
+    actions = [monitor.update(stage, 1., states[(stage - 1) % 3]) for stage in range(1, 8)]
+    assert actions[:3] == [(None, None)]*3
+    assert actions[3] == ('stop', 'cycle')
+    assert monitor.period == 3
+    assert monitor.events[0] == (4, 'cycle', 3)
+
+
+def test_detects_stagnation():
+    monitor = ConvergenceMonitor(cycles=False, window=10)
+    rng = np.random.default_rng(0)
+    action = None
+    for stage in range(1, 11):
+        action, reason = monitor.update(stage, 1., rng.uniform(size=5))
+    assert (action, reason) == ('stop', 'stagnation')
+
+    # Decreasing residuals don't stagnate
+    monitor = ConvergenceMonitor(cycles=False, window=10)
+    assert all(monitor.update(stage, 0.5**stage, rng.uniform(size=5)) == (None, None) for stage in range(1, 30))
+
+
+def test_accelerate_averages_the_cycle():
+    monitor = ConvergenceMonitor(stagnation=False, action='accelerate')
+    states = _cycle(2)
+    total = sum(states).sum()/2
+    for stage in range(1, 10):
+        reserves = states[(stage - 1) % 2].copy()
+        action, reason = monitor.update(stage, 1., reserves)
+        if action == 'accelerate':
+            break
+    assert reason == 'cycle'
+    # The average over one period, thus the same total
+    np.testing.assert_allclose(reserves, sum(states)/2)
+    assert reserves.sum() == pytest.approx(total)
+    assert monitor.accelerations == 1
+
+
+def test_unknown_action():
+    with pytest.raises(Exception, match='Unknown action'):
+        ConvergenceMonitor(action='ignore')
+
+
+def test_report_doesnt_change_the_run(network, strategy, label):
+    kwargs = dict(label_of_run='run', start_reserves=2., label_of_network=label)
+    reference = Simulation(strategy, network, force_update_L=True, **kwargs).run(rtol=1e-8, max_iter=500, verbose=0)
+    monitored = Simulation(strategy, network, **kwargs).run(rtol=1e-8, max_iter=500, verbose=0,
+                                                            monitor=ConvergenceMonitor(action='report'))
+    np.testing.assert_array_equal(monitored.size_p, reference.size_p)
+    assert monitored.defaulted_nodes == reference.defaulted_nodes
+    assert monitored.termination_reason == reference.termination_reason
+
+
+def test_max_iter_reason(network, label):
+    simulation = Simulation(all_strategies()[0], network, label_of_run='run', start_reserves=2.,
+                            label_of_network=label, force_update_L=True).run(rtol=1e-15, max_iter=3, verbose=0)
+    assert simulation.termination_reason == 'max_iter'
+    assert len(simulation.size_p) < 3
@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from cascading_defaults import current_dir
+from cascading_defaults.networks import SyntheticNetwork
+from cascading_defaults.simulation import Simulation
+from cascading_defaults.utils import split_sink_node
+from conftest import random_network
+
+
+def _with_sink_column(seed=3, N=150):
+    # Node 0 is the outside world: many nodes owe it (column 0), it owes nobody (row 0)
+    L = random_network(N=N, seed=seed).tolil()
+    rng = np.random.default_rng(seed)
+    owes = np.flatnonzero(rng.uniform(size=N) < 0.5)
+    L[owes, 0] = rng.uniform(10, 100, len(owes))
+    # Ties with the other obligations of the rows
+    L[owes[::5], 0] = L[owes[::5], 1].toarray().flatten() + (L[owes[::5], 1].toarray().flatten() == 0)*50
+    L[0, :] = 0
+    L.setdiag(0)
+    L = L.tocsr()
+    L.eliminate_zeros()
+    return L
+
+
+def test_split_sink_node():
+    L = _with_sink_column()
+    split, outflow = split_sink_node(L)
+    assert split.shape == L.shape
+    assert split[:, 0].nnz == 0 and split[0].nnz == 0
+    np.testing.assert_array_equal(outflow, L[:, 0].toarray().flatten())
+    np.testing.assert_array_equal(split[1:, 1:].toarray(), L[1:, 1:].toarray())
+
+
+def test_outflow_matches_sink_column(exogenous_strategy, label):
+    """
+    The virtual sink node pays like the former L_sinknode networks: the outside world as creditor node 0.
+    """
+    L = _with_sink_column()
+    split, outflow = split_sink_node(L)
+    strategy = exogenous_strategy
+    reference_strategy = type(strategy)(strategy.build_reserves, strategy.pay_remaining_money, False)
+    reference = Simulation(reference_strategy, L, label_of_run='sink_column', start_reserves=5.,
+                           label_of_network=label, force_update_L=True).run(rtol=1e-10, max_iter=500, verbose=0)
+    simulation = Simulation(strategy, split, label_of_run='outflow', start_reserves=5.,
+                            label_of_network=f'{label}_split', force_update_L=True,
+                            exogenous_outflow=outflow).run(rtol=1e-10, max_iter=500, verbose=0)
+
+    p, reference_p = simulation.p.toarray(), reference.p.toarray()
+    np.testing.assert_allclose(simulation.exogenous_payments, reference_p[:, 0], rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(p[:, 1:], reference_p[:, 1:], rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(simulation.reserves[1:], reference.reserves[1:], rtol=1e-9, atol=1e-9)
+    assert sorted(simulation.defaulted_nodes) == sorted(reference.defaulted_nodes)
+    # Not all of the outside world is paid
+    assert simulation.exogenous_payments.sum() < outflow.sum()
+
+
+def _network(**kwargs):
+    parameters = dict(N=3000, mean_degree=6, sink_probability=0.3, seed=5, rows_per_seed=128)
+    parameters.update(kwargs)
+    return SyntheticNetwork(**parameters)
+
+
+def test_generator_outflow():
+    network = _network()
+    outflow = network.exogenous_outflow()
+    assert outflow.shape == (network.N,) and (outflow >= 0).all()
+    assert 0.25 < np.mean(outflow > 0) < 0.35
+    np.testing.assert_array_equal(_network().exogenous_outflow(), outflow)
+
+    # Not in the network: node 0 is an ordinary node, and the edges don't depend on sink_probability
+    L = network.generate()
+    assert (L != _network(sink_probability=0.).generate()).nnz == 0
+    assert not _network(sink_probability=0.).exogenous_outflow().any()
+
+
+def test_generator_saves_outflow(label):
+    network = _network()
+    network.save(label, verbose=0)
+    saved = np.load(os.path.join(current_dir, f'transactionnetworks/{label}/exogenous_outflow.npy'))
+    np.testing.assert_array_equal(saved, network.exogenous_outflow())
+
+
+def test_cashflow_without_outflow_reaches_reserves(network, exogenous_strategy, label, rng):
+    from cascading_defaults.simulation.batch import clear_batch
+    strategy = exogenous_strategy
+    cashflow = rng.uniform(0, 50, network.shape[0])
+    runs = {}
+    for name, kwargs in (('without', {}), ('cashflow', {'exogenous_cashflow': cashflow})):
+        runs[name] = Simulation(strategy, network, label_of_run=name, start_reserves=2., label_of_network=label,
+                                force_update_L=not runs, **kwargs).run(rtol=1e-8, max_iter=500, verbose=0)
+    without, simulation = runs['without'], runs['cashflow']
+    # Unscaled, it comes in once
+    assert simulation.total_flow == pytest.approx(without.total_flow + cashflow.sum(), rel=1e-12)
+    if strategy.build_reserves:
+        assert simulation.reserves.sum() + simulation.total_payments_array.sum() == \
+            pytest.approx(simulation.total_flow, rel=1e-9)
+    assert not np.allclose(simulation.reserves, without.reserves)
+
+    results = clear_batch(strategy, simulation.L.tocsr(), np.full((network.shape[0], 1), 2.),
+                          exogenous_cashflows=cashflow.reshape((-1, 1)), rtol=1e-8, max_iter=500)
+    assert results['total_flow'][0] == pytest.approx(simulation.total_flow, rel=1e-12)
+    np.testing.assert_allclose(results['size_p'][0], simulation.p.sum(), rtol=1e-6)
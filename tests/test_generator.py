@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+from scipy import sparse
+
+from cascading_defaults import current_dir
+from cascading_defaults.networks import SyntheticNetwork
+from cascading_defaults.utils import load_memmap_csr
+
+
+def _network(**kwargs):
+    parameters = dict(N=3000, mean_degree=6, reciprocity=0.2, communities=4, seed=7, rows_per_seed=128)
+    parameters.update(kwargs)
+    return SyntheticNetwork(**parameters)
+
+
+def test_same_network_whatever_the_blocks():
+    L = _network().generate(block_size=2**22)
+    for block_size in (500, 3000):
+        other = _network().generate(block_size=block_size)
+        assert (other != L).nnz == 0
+        np.testing.assert_array_equal(other.indices, L.indices)
+    assert (_network(seed=8).generate() != L).nnz > 0
+
+
+def test_structure():
+    network = _network()
+    L = network.generate()
+    assert L.shape == (network.N, network.N)
+    assert L.indptr.dtype == L.indices.dtype == np.int32
+    assert not L.diagonal().any()
+    assert (L.data > 0).all()
+    # Merged parallel edges: sorted, unique columns per row
+    assert L.has_canonical_format
+    # Mean degree before merging
+    assert 0.8*network.mean_degree < L.nnz/network.N < 1.2*network.mean_degree
+
+    # Reciprocated obligations
+    reciprocal = L.multiply(L.T.tocsr())
+    assert reciprocal.nnz > 0
+    unreciprocated = _network(reciprocity=0.).generate()
+    assert unreciprocated.multiply(unreciprocated.T.tocsr()).nnz < reciprocal.nnz
+
+
+def test_blocks_are_rows():
+    network = _network()
+    L = network.generate()
+    stops = []
+    for start, stop, block in network.blocks(block_size=1000):
+        assert block.shape == (stop - start, network.N)
+        assert (block != L[start:stop]).nnz == 0
+        stops.append(stop)
+    assert stops[-1] == network.N
+
+
+def test_saved_memmap_equals_generate(label):
+    network = _network()
+    L = network.generate()
+    nnz = network.save(label, mmap=True, block_size=1000, verbose=0)
+    assert nnz == L.nnz
+    saved = load_memmap_csr(os.path.join(current_dir, f'transactionnetworks/{label}/L'))
+    assert saved.indptr.dtype == saved.indices.dtype == np.int32
+    assert (saved != L).nnz == 0
+
+    network.save(f'{label}_npz', verbose=0)
+    with open(os.path.join(current_dir, f'transactionnetworks/{label}_npz/L.npz'), 'rb') as file:
+        assert (sparse.load_npz(file) != L).nnz == 0
@@ -0,0 +1,39 @@
+import numpy as np
+
+from cascading_defaults.simulation import Simulation
+from cascading_defaults.simulation.grid import SimulationGrid
+from conftest import all_strategies
+
+
+def test_grid_equals_standalone_runs(network, label, rng):
+    strategies = all_strategies(has_exogenous=True)
+    outflow = rng.uniform(0, 10, network.shape[0])
+    parameters = {
+        'low': {'start_reserves': 1.},
+        'high': {'start_reserves': 5., 'exogenous_cashflow': rng.uniform(0, 5, network.shape[0])},
+        'outflow': {'start_reserves': 2., 'exogenous_outflow': outflow}
+    }
+    grid = SimulationGrid(strategies, network, parameters, label_of_network=label, force_update_L=True)
+    grid.run(threads=4, rtol=1e-8, max_iter=500, verbose=0)
+    assert len(grid.results) == len(strategies)*len(parameters)
+
+    for strategy in strategies:
+        for label_of_run, kwargs in parameters.items():
+            simulation = grid.simulations[(strategy.label, label_of_run)]
+            standalone = Simulation(strategy, network, label_of_run=label_of_run, label_of_network=label,
+                                    **kwargs).run(rtol=1e-8, max_iter=500, verbose=0)
+            np.testing.assert_array_equal(simulation.p.toarray(), standalone.p.toarray())
+            np.testing.assert_array_equal(simulation.reserves, standalone.reserves)
+            assert simulation.defaulted_nodes == standalone.defaulted_nodes
+            assert grid.results.loc[(strategy.label, label_of_run), 'defaults'] == len(standalone.defaulted_nodes)
+
+
+def test_grid_shares_L_and_plans(network, label):
+    strategies = all_strategies()
+    grid = SimulationGrid(strategies, network, {'a': {'start_reserves': 1.}, 'b': {'start_reserves': 2.}},
+                          label_of_network=label, force_update_L=True)
+    simulations = grid.setup()
+    for strategy in strategies:
+        a, b = simulations[(strategy.label, 'a')], simulations[(strategy.label, 'b')]
+        assert a.L is b.L is grid.Ls[strategy.L_needed()]
+        assert a.plan is b.plan
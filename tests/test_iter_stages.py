@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from cascading_defaults.simulation import Simulation
+
+
+def _simulation(strategy, network, label, **kwargs):
+    return Simulation(strategy, network, label_of_run='run', start_reserves=2., label_of_network=label, **kwargs)
+
+
+def test_stages_equal_run(network, strategy, label):
+    reference = _simulation(strategy, network, label, force_update_L=True).run(rtol=1e-8, max_iter=500, verbose=0)
+    views = list(_simulation(strategy, network, label).iter_stages(rtol=1e-8, max_iter=500))
+    assert len(views) == len(reference.size_p)
+    np.testing.assert_array_equal([view.size_p for view in views], reference.size_p)
+    np.testing.assert_array_equal([view.stage for view in views], np.arange(1, len(views) + 1))
+    new_defaults = np.concatenate([view.new_defaults for view in views])
+    assert sorted(new_defaults) == sorted(reference.defaulted_nodes)
+    assert views[-1].n_defaulted == len(reference.defaulted_nodes)
+    assert views[-1].converged == (reference.termination_reason == 'converged')
+
+
+def test_break_stops_the_simulation(network, strategy, label):
+    simulation = _simulation(strategy, network, label, force_update_L=True)
+    for view in simulation.iter_stages(rtol=1e-8, max_iter=500):
+        if view.stage == 2:
+            break
+    # Nothing is kept per stage without keep_history
+    assert len(simulation.size_p) == 0
+    assert simulation.termination_reason == ('converged' if view.converged else 'stopped')
+
+    # The views are read-only
+    with pytest.raises(AttributeError):
+        view.stage = 3
+    if len(view.new_defaults):
+        with pytest.raises(ValueError):
+            view.new_defaults[0] = -1
+
+
+def test_break_at_the_last_stage(network, strategy, label):
+    # Breaking after the stage that ended the run (e.g. converged) keeps why it ended
+    reference = _simulation(strategy, network, label, force_update_L=True).run(rtol=1e-8, max_iter=500, verbose=0)
+    simulation = _simulation(strategy, network, label)
+    for view in simulation.iter_stages(rtol=1e-8, max_iter=500):
+        if view.stage == len(reference.size_p):
+            break
+    assert simulation.termination_reason == reference.termination_reason
+    assert view.converged == (reference.termination_reason == 'converged')
+
+    simulation = _simulation(strategy, network, label)
+    for view in simulation.iter_stages(rtol=1e-8, max_iter=500):
+        if view.stage == len(reference.size_p) - 1:
+            break
+    assert simulation.termination_reason == 'stopped'
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from cascading_defaults.simulation import Simulation
+
+
+def _run(strategy, network, label, **kwargs):
+    simulation = Simulation(strategy, network, label_of_run='run', start_reserves=2., label_of_network=label, **kwargs)
+    return simulation.run(rtol=1e-8, max_iter=500, verbose=0)
+
+
+def test_low_memory_equals_default(network, strategy, label):
+    default = _run(strategy, network, label, force_update_L=True)
+    low_memory = _run(strategy, network, label, low_memory=True)
+    assert low_memory.workspace.previous_p_data is None
+    assert low_memory.plan.low_memory
+    # Up to rounding, the column sums of low_memory add the edges in the order of the rows
+    np.testing.assert_allclose(low_memory.p.toarray(), default.p.toarray(), rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(low_memory.reserves, default.reserves, rtol=1e-9, atol=1e-9)
+    assert sorted(low_memory.defaulted_nodes) == sorted(default.defaulted_nodes)
+
+
+def test_memory_budget(network, strategy, label):
+    simulation = Simulation(strategy, network, label_of_run='run', label_of_network=label, force_update_L=True)
+    estimate, low_estimate = (sum(simulation.estimate_memory(low_memory=low_memory).values())
+                              for low_memory in (False, True))
+    assert low_estimate < estimate
+
+    simulation = Simulation(strategy, network, label_of_run='run', label_of_network=label,
+                            memory_budget=(estimate + low_estimate)//2)
+    assert simulation.low_memory
+    with pytest.raises(Exception, match='exceeds the budget'):
+        Simulation(strategy, network, label_of_run='run', label_of_network=label, memory_budget=low_estimate//2)
+
+
+def test_memory_report(network, strategy, label):
+    simulation = _run(strategy, network, label, force_update_L=True)
+    peaks = simulation.memory_report()
+    assert peaks['L'] > 0 and peaks['payments'] > 0
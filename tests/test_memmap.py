@@ -0,0 +1,37 @@
+import numpy as np
+from scipy import sparse
+
+from cascading_defaults.utils import save_memmap_csr, load_memmap_csr
+from conftest import random_network
+
+
+def test_round_trip(tmp_path):
+    L = random_network(N=80)
+    save_memmap_csr(L, str(tmp_path / 'L'))
+    loaded = load_memmap_csr(str(tmp_path / 'L'))
+    assert isinstance(loaded.data, np.memmap)
+    assert (loaded != L).nnz == 0
+
+
+def test_round_trip_keeps_int64(tmp_path):
+    L = random_network(N=80)
+    L.indptr, L.indices = L.indptr.astype(np.int64), L.indices.astype(np.int64)
+    save_memmap_csr(L, str(tmp_path / 'L'))
+    loaded = load_memmap_csr(str(tmp_path / 'L'))
+    # Memory-mapped, not copied into memory as int32
+    assert loaded.indptr.dtype == loaded.indices.dtype == np.int64
+    assert isinstance(loaded.indptr, np.memmap) and isinstance(loaded.indices, np.memmap)
+    np.testing.assert_array_equal(loaded.indptr, L.indptr)
+    np.testing.assert_array_equal(loaded.indices, L.indices)
+
+
+def test_mixed_index_dtypes(tmp_path):
+    # indptr as int64 and indices as int32 (files of older versions): only indptr is converted
+    L = random_network(N=80)
+    folder = tmp_path / 'L'
+    save_memmap_csr(L, str(folder))
+    np.save(str(folder / 'indptr.npy'), L.indptr.astype(np.int64))
+    loaded = load_memmap_csr(str(folder))
+    assert loaded.indptr.dtype == loaded.indices.dtype == np.int32
+    assert isinstance(loaded.indices, np.memmap)
+    assert (loaded != sparse.csr_matrix(L)).nnz == 0
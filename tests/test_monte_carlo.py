@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from cascading_defaults.simulation import MonteCarlo
+from cascading_defaults.simulation.monte_carlo import draw, scenario_rng
+
+
+def _run(strategy, network, label, batch_size, processes=1, seed=3, force_update_L=False,
+         exogenous_distribution=('lognormal', {'mean': 0., 'sigma': 1.}), exogenous_outflow=None):
+    monte_carlo = MonteCarlo(strategy, network, reserves_distribution=('uniform', {'low': 0., 'high': 20.}),
+                             exogenous_distribution=exogenous_distribution, label_of_network=label,
+                             force_update_L=force_update_L, exogenous_outflow=exogenous_outflow)
+    return monte_carlo.run(n_scenarios=20, batch_size=batch_size, processes=processes, seed=seed, rtol=1e-6,
+                           max_iter=300, verbose=0)
+
+
+@pytest.mark.parametrize('batch_size', [1, 7, 64])
+def test_reproducible_regardless_of_batch_size(network, strategy, label, batch_size):
+    reference = _run(strategy, network, label, 20, force_update_L=True)
+    monte_carlo = _run(strategy, network, label, batch_size)
+    np.testing.assert_array_equal(monte_carlo.size_p_relative, reference.size_p_relative)
+    np.testing.assert_array_equal(monte_carlo.default_count_histogram, reference.default_count_histogram)
+    np.testing.assert_array_equal(monte_carlo.default_counts_per_node, reference.default_counts_per_node)
+    np.testing.assert_array_equal(monte_carlo.stages, reference.stages)
+
+
+def test_processes_equal_serial(network, label, exogenous_strategy):
+    outflow = np.random.default_rng(5).uniform(0, 20, network.shape[0])
+    serial = _run(exogenous_strategy, network, label, 6, force_update_L=True, exogenous_outflow=outflow)
+    parallel = _run(exogenous_strategy, network, label, 6, processes=2, exogenous_outflow=outflow)
+    np.testing.assert_array_equal(parallel.size_p_relative, serial.size_p_relative)
+    np.testing.assert_array_equal(parallel.default_counts_per_node, serial.default_counts_per_node)
+    np.testing.assert_array_equal(parallel.stages, serial.stages)
+
+    # The drawn cashflows reach the scenarios
+    without = _run(exogenous_strategy, network, label, 6, exogenous_distribution=0., exogenous_outflow=outflow)
+    assert not np.array_equal(serial.size_p_relative, without.size_p_relative)
+
+
+def test_seed_changes_scenarios(network, label):
+    from cascading_defaults.simulation.strategies import LargestCreditorFirst
+    strategy = LargestCreditorFirst(True, True, False)
+    first = _run(strategy, network, label, 8, force_update_L=True)
+    other = _run(strategy, network, label, 8, seed=4)
+    assert not np.array_equal(first.size_p_relative, other.size_p_relative)
+
+
+def test_draw():
+    N = 5
+    assert np.array_equal(draw(2., scenario_rng(0, 1), N), np.full(N, 2.))
+    np.testing.assert_array_equal(draw(('uniform', {}), scenario_rng(0, 1), N),
+                                  draw(('uniform', {}), scenario_rng(0, 1), N))
+    assert not np.array_equal(draw(('uniform', {}), scenario_rng(0, 1), N), draw(('uniform', {}), scenario_rng(0, 2), N))
+    assert draw(lambda rng, N: np.arange(N), scenario_rng(0, 1), N).dtype == np.float64
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from cascading_defaults.simulation import Simulation
+from cascading_defaults.simulation.partitioned import _partition_boundaries
+from conftest import random_network
+
+
+def _run(strategy, network, label, processes, **kwargs):
+    simulation = Simulation(strategy, network, label_of_run=f'processes{processes}', start_reserves=2.,
+                            label_of_network=label, **kwargs)
+    return simulation.run(rtol=1e-8, max_iter=500, verbose=0, processes=processes)
+
+
+@pytest.mark.parametrize('processes', [2, 3])
+def test_partitioned_equals_serial(network, strategy, label, processes):
+    serial = _run(strategy, network, label, 1, force_update_L=True)
+    partitioned = _run(strategy, network, label, processes)
+    # Every sum is taken in the same order, thus identical
+    np.testing.assert_array_equal(partitioned.p.toarray(), serial.p.toarray())
+    np.testing.assert_array_equal(partitioned.reserves, serial.reserves)
+    np.testing.assert_array_equal(partitioned.size_p, serial.size_p)
+    assert partitioned.defaulted_nodes == serial.defaulted_nodes
+
+
+def test_partitioned_exogenous_equals_serial(exogenous_strategy, label, rng):
+    network = random_network(N=150, seed=2)
+    outflow = rng.uniform(0, 20, network.shape[0])
+    cashflow = rng.uniform(0, 10, network.shape[0])
+    serial = _run(exogenous_strategy, network, label, 1, force_update_L=True, exogenous_outflow=outflow,
+                  exogenous_cashflow=cashflow)
+    partitioned = _run(exogenous_strategy, network, label, 2, exogenous_outflow=outflow, exogenous_cashflow=cashflow)
+    np.testing.assert_array_equal(partitioned.p.toarray(), serial.p.toarray())
+    np.testing.assert_array_equal(partitioned.exogenous_payments, serial.exogenous_payments)
+    assert partitioned.defaulted_nodes == serial.defaulted_nodes
+
+
+def test_partition_boundaries():
+    indptr = np.concatenate([[0], np.cumsum([5, 0, 1, 1, 7, 2, 0, 4])])
+    boundaries = _partition_boundaries(indptr, 3)
+    assert boundaries[0] == 0 and boundaries[-1] == len(indptr) - 1
+    assert np.all(np.diff(boundaries) >= 0)
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from cascading_defaults.simulation.backends import available_backends
+from cascading_defaults.simulation.payments import row_cumsum
+from cascading_defaults.simulation.strategies import LargestCreditorFirst, LargestCreditorLast
+from cascading_defaults.simulation.workspace import Workspace
+
+
+def _rows(rng, counts):
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    return rng.uniform(0, 10, indptr[-1]), indptr
+
+
+@pytest.mark.parametrize('long_row', [None, 3])
+def test_row_cumsum_equals_running_totals(rng, long_row):
+    data, indptr = _rows(rng, [0, 1, 5, 0, 2, 40, 7, 1, 0])
+    expected = np.concatenate([np.cumsum(data[a:b]) for a, b in zip(indptr[:-1], indptr[1:])])
+    np.testing.assert_array_equal(row_cumsum(data, indptr, long_row=long_row), expected)
+
+
+def test_row_cumsum_with_sink(rng):
+    data, indptr = _rows(rng, [0, 1, 5, 3, 2])
+    outflows = rng.uniform(0, 10, 5)
+    sink_positions = indptr[:-1] + np.array([0, 1, 2, 0, 2])
+    cumulative, sink_cumulative = row_cumsum(data, indptr, outflows=outflows, sink_positions=sink_positions)
+    for i in range(5):
+        row = list(data[indptr[i]:indptr[i+1]])
+        k = sink_positions[i] - indptr[i]
+        totals = np.cumsum(row[:k] + [outflows[i]] + row[k:])
+        np.testing.assert_array_equal(cumulative[indptr[i]:indptr[i+1]], np.delete(totals, k))
+        assert sink_cumulative[i] == totals[k]
+
+
+@pytest.mark.parametrize('Strategy', [LargestCreditorFirst, LargestCreditorLast])
+@pytest.mark.parametrize('pay_remaining_money', [True, False])
+@pytest.mark.parametrize('low_memory', [False, True])
+def test_numpy_kernel_equals_compiled(network, label, rng, Strategy, pay_remaining_money, low_memory):
+    strategy = Strategy(True, pay_remaining_money, True)
+    L = strategy.select_right_L(network, label, True).tocsr()
+    N = L.shape[0]
+    for outflows in (None, rng.uniform(0, 20, N)):
+        plan = strategy.plan(L, exogenous_outflows=outflows, low_memory=low_memory)
+        incomings = rng.uniform(0, 300, N)
+        payments = {}
+        for backend in available_backends():
+            sink_out = np.zeros(N)
+            payments[backend] = (strategy.edge_payments(plan, incomings, backend, out=np.empty(L.nnz),
+                                                        sink_out=sink_out).copy(), sink_out)
+        # With the buffers of a workspace (twice, the second time with the sink indices it set up)
+        workspace = Workspace(plan, low_memory=low_memory)
+        for _ in range(2):
+            sink_out = np.zeros(N)
+            payments['workspace'] = (strategy.edge_payments(plan, incomings, 'numpy', out=np.empty(L.nnz),
+                                                            workspace=workspace, sink_out=sink_out).copy(), sink_out)
+        for backend, (edges, sink) in payments.items():
+            np.testing.assert_array_equal(edges, payments['numpy'][0], err_msg=backend)
+            np.testing.assert_array_equal(sink, payments['numpy'][1], err_msg=backend)
+
+
+def test_payments_follow_order(rng):
+    # One node with 10 of incoming cash, owing 6, 3 and 4 (sorted descending for largest creditor first)
+    from scipy import sparse
+    L = sparse.csr_matrix((np.array([6., 4., 3.]), np.array([1, 3, 2]), np.array([0, 3, 3, 3, 3])), shape=(4, 4))
+    for pay_remaining_money, expected in ((True, [6., 4., 0.]), (False, [6., 0., 0.])):
+        strategy = LargestCreditorFirst(True, pay_remaining_money, False)
+        plan = strategy.compile_plan(L)
+        payments = strategy.edge_payments(plan, np.array([10., 0., 0., 0.]), 'numpy')
+        np.testing.assert_array_equal(payments, expected)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from cascading_defaults.simulation import Simulation
+from conftest import random_network
+
+
+def test_plans_are_frozen(network, strategy, label):
+    L = strategy.select_right_L(network, label, True).tocsr()
+    plan = strategy.plan(L)
+    with pytest.raises(AttributeError):
+        plan.total_payables_array = np.zeros(plan.N)
+    with pytest.raises(ValueError):
+        plan.total_payables_array[0] = 1.
+
+
+def test_plans_are_cached(network, strategy, label, rng):
+    L = strategy.select_right_L(network, label, True).tocsr()
+    outflows = rng.uniform(0, 10, L.shape[0])
+    plan = strategy.plan(L)
+    assert strategy.plan(L.copy()) is plan
+    assert strategy.plan(L, low_memory=True) is not plan
+    assert strategy.plan(L, exogenous_outflows=outflows) is not plan
+    assert strategy.plan(L, exogenous_outflows=outflows) is strategy.plan(L, exogenous_outflows=outflows.copy())
+    assert len(strategy.plans) <= strategy.max_cached_plans
+
+
+def test_one_strategy_on_several_networks(strategy, label):
+    # The plans are per L, thus interleaved simulations of one strategy don't share state
+    networks = [random_network(seed=seed) for seed in (1, 2)]
+    alone = []
+    for n, network in enumerate(networks):
+        simulation = Simulation(strategy, network, label_of_run=f'alone{n}', start_reserves=3.,
+                                label_of_network=f'{label}{n}', force_update_L=True)
+        alone.append(simulation.run(rtol=1e-6, max_iter=300, verbose=0))
+    together = [Simulation(strategy, network, label_of_run=f'together{n}', start_reserves=3.,
+                           label_of_network=f'{label}{n}') for n, network in enumerate(networks)]
+    stages = [simulation.iter_stages(rtol=1e-6, max_iter=300) for simulation in together]
+    done = [False, False]
+    while not all(done):
+        for n, iterator in enumerate(stages):
+            if not done[n]:
+                done[n] = next(iterator, None) is None
+    for simulation, reference in zip(together, alone):
+        np.testing.assert_array_equal(simulation.total_payments_array, reference.total_payments_array)
+
+
+def test_process_L_keeps_the_structure(network):
+    from cascading_defaults.simulation.strategies import EisenbergNoe
+    # Rows (and columns) without liabilities
+    L = network.tolil()
+    L[:5, :] = 0
+    L = L.tocsr()
+    L.eliminate_zeros()
+    original = L.copy()
+    processed = EisenbergNoe(True, True, False).process_L_for_strategy(L)
+    for name in ('data', 'indices', 'indptr'):
+        np.testing.assert_array_equal(getattr(L, name), getattr(original, name))
+        np.testing.assert_array_equal(getattr(processed, name), getattr(original, name))
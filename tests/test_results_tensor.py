@@ -0,0 +1,59 @@
+import numpy as np
+from scipy import sparse
+
+from cascading_defaults.analysis.results_tensor import ResultsTensor
+from cascading_defaults.simulation import Simulation
+from conftest import all_strategies
+
+
+def _runs(network, label):
+    simulations = {}
+    for strategy in all_strategies():
+        simulation = Simulation(strategy, network, label_of_run='run', start_reserves=2., label_of_network=label,
+                                force_update_L=True)
+        simulations[strategy.label] = simulation.run(rtol=1e-8, max_iter=500, verbose=0)
+    return simulations
+
+
+def test_stacked_results_equal_the_simulations(network, label):
+    simulations = _runs(network, label)
+    tensor = ResultsTensor(simulations)
+    assert tensor.payments.shape == (len(simulations), network.nnz)
+    assert tensor.in_L is None
+    np.testing.assert_array_equal(tensor.obligations, network.toarray()[tensor.rows, tensor.columns])
+    for k, simulation in enumerate(simulations.values()):
+        p = simulation.p.toarray()
+        np.testing.assert_array_equal(tensor.payments[k], p[tensor.rows, tensor.columns])
+        np.testing.assert_allclose(tensor.out_strengths()[k], p.sum(axis=1), rtol=1e-12)
+        np.testing.assert_allclose(tensor.in_strengths()[k], p.sum(axis=0), rtol=1e-12)
+        np.testing.assert_array_equal(tensor.reserves[k], simulation.reserves)
+        defaulted = np.flatnonzero(tensor.default_stage[k])
+        assert sorted(defaulted) == sorted(simulation.defaulted_nodes)
+
+    summary = tensor.summary()
+    assert list(summary['defaults']) == [len(simulation.defaulted_nodes) for simulation in simulations.values()]
+    labels = list(simulations)
+    np.testing.assert_array_equal(tensor.difference(labels[0], labels[1]),
+                                  tensor.payments[0] - tensor.payments[1])
+    correlations = tensor.rank_correlation()
+    np.testing.assert_allclose(np.diag(correlations), 1.)
+
+
+def test_different_edges(network, label, rng):
+    # The second network has a part of the edges of the first
+    coo = network.tocoo()
+    keep = rng.uniform(size=coo.nnz) < 0.7
+    subnetwork = sparse.csr_matrix((coo.data[keep], (coo.row[keep], coo.col[keep])), shape=network.shape)
+    strategy = all_strategies()[1]
+    simulations = {
+        'all': Simulation(strategy, network, label_of_run='all', start_reserves=2., label_of_network=label,
+                          force_update_L=True).run(rtol=1e-8, max_iter=500, verbose=0),
+        'part': Simulation(strategy, subnetwork, label_of_run='part', start_reserves=2.,
+                           label_of_network=f'{label}_part', force_update_L=True).run(rtol=1e-8, max_iter=500,
+                                                                                      verbose=0)
+    }
+    tensor = ResultsTensor(simulations)
+    assert tensor.nnz == network.nnz
+    assert tensor.in_L[0].all() and tensor.in_L[1].sum() == subnetwork.nnz
+    # No payments over edges that are not in L
+    assert not tensor.payments[1][~tensor.in_L[1]].any()
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from cascading_defaults.simulation import Simulation, SnapshotSeries
+from cascading_defaults.utils import RowSplice
+
+
+def _changes(L, rng, n=6):
+    """
+    Random insertions, deletions and weight changes of L, and L with these applied.
+    """
+    L = L.tocoo()
+    N = L.shape[0]
+    existing = set(zip(L.row.tolist(), L.col.tolist()))
+    picked = rng.choice(L.nnz, 2*n, replace=False)
+    deletions = (L.row[picked[:n]], L.col[picked[:n]])
+    weight_changes = (L.row[picked[n:]], L.col[picked[n:]], rng.uniform(1, 100, n))
+    new_edges = []
+    while len(new_edges) < n:
+        edge = tuple(rng.integers(0, N, 2).tolist())
+        if edge[0] != edge[1] and edge not in existing and edge not in new_edges:
+            new_edges.append(edge)
+    rows, cols = np.array(new_edges).T
+    insertions = (rows, cols, rng.uniform(1, 100, n))
+
+    dense = L.toarray()
+    dense[deletions] = 0.
+    dense[weight_changes[:2]] = weight_changes[2]
+    dense[insertions[:2]] = insertions[2]
+    return insertions, deletions, weight_changes, sparse.csr_matrix(dense)
+
+
+def test_row_splice(rng):
+    L = sparse.random(10, 10, density=0.4, random_state=0, format='csr')
+    rows, counts = np.array([1, 4, 9]), np.array([0, 5, 2])
+    splice = RowSplice(L.indptr, rows, counts)
+    new = np.arange(7) + 100.
+    data = splice.splice(L.data, new)
+    expected = [L.data[L.indptr[i]:L.indptr[i+1]] for i in range(10)]
+    expected[1], expected[4], expected[9] = new[:0], new[:5], new[5:]
+    np.testing.assert_array_equal(data, np.concatenate(expected))
+    np.testing.assert_array_equal(np.diff(splice.indptr), [len(row) for row in expected])
+
+
+def test_updates_equal_processing_from_scratch(network, exogenous_strategy, rng):
+    strategy = exogenous_strategy
+    N = network.shape[0]
+    outflows = rng.uniform(0, 20, N)
+    series = SnapshotSeries(strategy, network, start_reserves=5., exogenous_outflow=outflows)
+    raw = network
+    for day in range(3):
+        insertions, deletions, weight_changes, raw = _changes(raw, rng)
+        series.update(insertions=insertions, deletions=deletions, weight_changes=weight_changes)
+
+        L = sparse.csr_matrix(strategy.process_L_for_strategy(raw.copy()))
+        for name in ('data', 'indices', 'indptr'):
+            np.testing.assert_array_equal(getattr(series.L, name), getattr(L, name))
+        plan = strategy.compile_plan(L, exogenous_outflows=outflows)
+        for name, value in vars(plan).items():
+            patched = getattr(series.plan, name)
+            if isinstance(value, np.ndarray):
+                np.testing.assert_allclose(patched, value, rtol=1e-12, atol=1e-9, err_msg=name)
+            elif sparse.issparse(value) and name != 'relative_liabilities_transposed':  # Not patched
+                np.testing.assert_allclose(patched.toarray(), value.toarray(), rtol=1e-12, err_msg=name)
+
+        simulation = series.run(rtol=1e-6, max_iter=300, verbose=0)
+        cold = Simulation(strategy, L, label_of_run='cold', start_reserves=5., L_is_prepared=True,
+                          exogenous_outflow=outflows)
+        cold.run(rtol=1e-6, max_iter=300, verbose=0)
+        np.testing.assert_allclose(simulation.size_p, cold.size_p, rtol=1e-9)
+        assert sorted(simulation.defaulted_nodes) == sorted(cold.defaulted_nodes)
+
+
+def test_invalid_changes(network):
+    from cascading_defaults.simulation.strategies import LargestCreditorFirst
+    series = SnapshotSeries(LargestCreditorFirst(True, True, False), network)
+    L = network.tocoo()
+    with pytest.raises(Exception, match='already in L'):
+        series.update(insertions=([L.row[0]], [L.col[0]], [1.]))
+    empty = np.flatnonzero(network.toarray()[0] == 0)[1]
+    with pytest.raises(Exception, match='not in L'):
+        series.update(weight_changes=([0], [empty], [1.]))
+
+
+def test_duplicate_insertions_are_summed(network, strategy):
+    series = SnapshotSeries(strategy, network, start_reserves=5.)
+    dense = network.toarray()
+    row = 3
+    cols = np.flatnonzero(dense[row] == 0)
+    cols = cols[cols != row][:2]
+    series.update(insertions=([row, row, row], [cols[0], cols[1], cols[0]], [10., 20., 30.]))
+
+    dense[row, cols[0]], dense[row, cols[1]] = 40., 20.
+    L = sparse.csr_matrix(strategy.process_L_for_strategy(sparse.csr_matrix(dense)))
+    for name in ('data', 'indices', 'indptr'):
+        np.testing.assert_array_equal(getattr(series.L, name), getattr(L, name))
+    plan = strategy.compile_plan(L)
+    for name, value in vars(plan).items():
+        if isinstance(value, np.ndarray):
+            np.testing.assert_allclose(getattr(series.plan, name), value, rtol=1e-12, atol=1e-9, err_msg=name)
+
+    simulation = series.run(rtol=1e-6, max_iter=300, verbose=0)
+    cold = Simulation(strategy, L, label_of_run='cold', start_reserves=5., L_is_prepared=True)
+    cold.run(rtol=1e-6, max_iter=300, verbose=0)
+    np.testing.assert_allclose(simulation.p.toarray(), cold.p.toarray(), rtol=1e-9)
@@ -0,0 +1,62 @@
+import numpy as np
+
+from cascading_defaults.simulation import Simulation, SystemicImportance
+from cascading_defaults.simulation.batch import clear_batch
+from cascading_defaults.simulation.strategies import DefaultStrategy, LargestCreditor, LargestCreditorFirst
+
+
+def test_batch_payments_equal_loop(network, strategy, label, rng):
+    L = strategy.select_right_L(network, label, True).tocsr()
+    N = L.shape[0]
+    for outflows in (None, rng.uniform(0, 20, N)):
+        plan = strategy.plan(L, exogenous_outflows=outflows)
+        incomings = rng.uniform(0, 200, (N, 7))
+        batched = strategy.batch_payments(plan, incomings)
+        looped = DefaultStrategy.batch_payments(strategy, plan, incomings)
+        for batch, loop in zip(batched, looped):
+            if isinstance(strategy, LargestCreditor):
+                np.testing.assert_array_equal(batch, loop)
+            else:
+                np.testing.assert_allclose(batch, loop, rtol=1e-12, atol=1e-9)
+
+
+def test_clear_batch_equals_simulation(network, strategy, label):
+    simulation = Simulation(strategy, network, label_of_run='single', start_reserves=5., label_of_network=label,
+                            force_update_L=True)
+    simulation.run(rtol=1e-6, max_iter=300, verbose=0)
+    results = clear_batch(strategy, simulation.L.tocsr(), np.full((network.shape[0], 3), 5.), rtol=1e-6,
+                          max_iter=300)
+    for b in range(3):
+        np.testing.assert_allclose(results['size_p'][b], simulation.p.sum(), rtol=1e-9)
+        if isinstance(strategy, LargestCreditor):
+            # Eisenberg-Noe pays pro rata in the simulation, thus nodes that pay in full can differ by rounding
+            assert (results['default_stage'][:, b] > 0).sum() == len(simulation.defaulted_nodes)
+
+
+def test_defaults_caused_excludes_shocked_node(network, label):
+    strategy = LargestCreditorFirst(True, True, False)
+    importance = SystemicImportance(strategy, network, start_reserves=2., label_of_network=label,
+                                    force_update_L=True)
+    importance.run(rtol=1e-6, max_iter=300, batch_size=16, processes=1, verbose=0)
+    results = importance.results
+    assert (results['defaults_caused'] >= 0).all()
+    assert (results['defaults_caused'] <= results['defaults']).all()
+
+    # A node that fails by itself, without a cascade, causes no defaults
+    for node in results.index[:5]:
+        single = clear_batch(strategy, importance.L, importance.start_reserves.reshape((-1,1)),
+                             failed_nodes=np.array([node]), rtol=1e-6, max_iter=300)
+        defaulted = single['default_stage'][:, 0] > 0
+        defaulted[node] = False
+        assert results.loc[node, 'defaults_caused'] == (defaulted & ~importance.baseline_defaulted).sum()
+
+
+def test_processes_equal_serial(network, label):
+    strategy = LargestCreditorFirst(True, False, False)
+    runs = []
+    for processes in (1, 2):
+        importance = SystemicImportance(strategy, network, start_reserves=2., label_of_network=label,
+                                        force_update_L=processes == 1)
+        importance.run(rtol=1e-6, max_iter=300, batch_size=16, processes=processes, verbose=0)
+        runs.append(importance.results.sort_index())
+    np.testing.assert_array_equal(runs[0].values, runs[1].values)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from cascading_defaults.simulation import Simulation
+from cascading_defaults.simulation.trajectory import TrajectoryRecorder, Trajectory
+
+
+def _recorded_run(strategy, network, label, folder, **kwargs):
+    """
+    Runs with a recorder, returns the simulation and copies of the payments, reserves and defaults after every stage.
+    """
+    simulation = Simulation(strategy, network, label_of_run='run', start_reserves=2., label_of_network=label,
+                            force_update_L=True)
+    recorder = TrajectoryRecorder(folder, **kwargs)
+    states = {}
+    for view in simulation.iter_stages(rtol=1e-8, max_iter=500, recorder=recorder):
+        workspace = simulation.workspace
+        states[view.stage] = (workspace.p_data.copy(), simulation.reserves.copy(),
+                              np.flatnonzero(workspace.defaulted))
+    return simulation, states
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_replay_reconstructs_every_stage(network, strategy, label, compress):
+    simulation, states = _recorded_run(strategy, network, label, f'trajectories/{label}', keyframe_interval=3,
+                                       chunk_stages=2, compress=compress)
+    trajectory = Trajectory(f'trajectories/{label}')
+    assert trajectory.stages == len(states)
+
+    replayed = {stage: (p_data.copy(), reserves.copy(), np.flatnonzero(defaulted))
+                for stage, p_data, reserves, defaulted in trajectory.replay(1)}
+    assert sorted(replayed) == sorted(states)
+    for stage, (p_data, reserves, defaults) in states.items():
+        np.testing.assert_array_equal(replayed[stage][0], p_data)
+        np.testing.assert_array_equal(replayed[stage][1], reserves)
+        np.testing.assert_array_equal(replayed[stage][2], defaults)
+
+    # Random access, from the keyframe before the stage
+    for stage in sorted(states)[::-1]:
+        p, reserves, defaults = trajectory.state(stage)
+        np.testing.assert_array_equal(p.data, states[stage][0])
+        np.testing.assert_array_equal(p.indices, simulation.L.indices)
+        np.testing.assert_array_equal(reserves, states[stage][1])
+        np.testing.assert_array_equal(defaults, states[stage][2])
+
+
+def test_replay_out_of_range(network, strategy, label):
+    _recorded_run(strategy, network, label, f'trajectories/{label}')
+    trajectory = Trajectory(f'trajectories/{label}')
+    with pytest.raises(Exception, match='not in the trajectory'):
+        next(trajectory.replay(trajectory.stages + 1))
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from cascading_defaults.simulation.workspace import Workspace
+
+
+@pytest.mark.parametrize('low_memory', [False, True])
+def test_sums_equal_scipy(network, strategy, label, rng, low_memory):
+    L = strategy.select_right_L(network, label, True).tocsr()
+    workspace = Workspace(strategy.plan(L, low_memory=low_memory), low_memory=low_memory)
+    data = rng.uniform(0, 1, L.nnz)
+    payments = L.copy()
+    payments.data = data
+    np.testing.assert_array_equal(workspace.row_sums(data, out=np.empty(L.shape[0])),
+                                  np.asarray(payments.sum(axis=1)).flatten())
+    np.testing.assert_allclose(workspace.column_sums(data, out=np.empty(L.shape[0])),
+                               np.asarray(payments.sum(axis=0)).flatten(), rtol=1e-12)
+
+    # A batch of scenarios gives the sums of every scenario on its own
+    batch = rng.uniform(0, 1, (3, L.nnz))
+    rows, columns = workspace.row_sums(batch, out=np.empty((3, L.shape[0]))), \
+        workspace.column_sums(batch, out=np.empty((3, L.shape[0])))
+    for b in range(3):
+        np.testing.assert_array_equal(rows[b], workspace.row_sums(batch[b], out=np.empty(L.shape[0])))
+        np.testing.assert_array_equal(columns[b], workspace.column_sums(batch[b], out=np.empty(L.shape[0])))
+
+
+def test_scratch_buffers(network, strategy, label):
+    L = strategy.select_right_L(network, label, True).tocsr()
+    workspace = Workspace(strategy.plan(L))
+    assert 'float_nnz' not in vars(workspace)
+    assert workspace.float_nnz.shape == (L.nnz,)
+    workspace.release_scratch()
+    assert 'float_nnz' not in vars(workspace)
+
+    p_data = workspace.p_data
+    workspace.swap()
+    assert workspace.previous_p_data is p_data
+
+
+def test_allclose(network, strategy, label, rng):
+    L = strategy.select_right_L(network, label, True).tocsr()
+    workspace = Workspace(strategy.plan(L))
+    for n in (L.shape[0], L.nnz):
+        a = rng.uniform(1, 2, n)
+        assert workspace.allclose(a, a*(1 + 1e-7), rtol=1e-6)
+        b = a.copy()
+        b[-1] *= 1.1
+        assert not workspace.allclose(a, b, rtol=1e-6)